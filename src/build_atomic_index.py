@@ -0,0 +1,46 @@
+import argparse
+import logging
+
+from max.commonsense_builders.atomic_builder import build_atomic_index
+from max.commonsense_builders.retrieval_builder import build_retrieval_index
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--atomic_csv_paths",
+        type=str,
+        nargs='+',
+        default=["data/atomic/v4_atomic_trn.csv"],
+        help=(
+            "ATOMIC csv files to index, as obtained by "
+            "scripts/get_atomic_data.sh."
+        )
+    )
+    parser.add_argument(
+        "--index_path",
+        type=str,
+        default="data/atomic/atomic_index.pickle",
+        help="Where to save the index."
+    )
+    parser.add_argument(
+        "--retrieval_index_dir",
+        type=str,
+        help=(
+            "Optional. If set, the ATOMIC events are also added to the "
+            "vector index in this directory, used by "
+            "RetrievalCommonsenseBuilder."
+        )
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level="INFO")
+    args = parse_args()
+    build_atomic_index(args.atomic_csv_paths, args.index_path)
+    if args.retrieval_index_dir is not None:
+        build_retrieval_index(args.atomic_csv_paths, args.retrieval_index_dir)
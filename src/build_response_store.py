@@ -0,0 +1,100 @@
+import argparse
+import functools
+import logging
+
+from max import (
+    PatternNegationExpectationExtractor, CometCommonsenseBuilder,
+    PatternResponseGenerator, SarcasmGenerator
+)
+from max.commonsense_builders.sentiment_service import (
+    SentimentClient, start_sentiment_process
+)
+from max.response_store import build_response_store
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--catalogue_path",
+        type=str,
+        required=True,
+        help="A text file containing one event per line."
+    )
+    parser.add_argument(
+        "--store_path",
+        type=str,
+        required=True,
+        help=(
+            "Where to save the response store. If a store already exists "
+            "there, only new or changed events are processed."
+        )
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of worker processes. Each loads its own COMET and "
+            "sentiment models, so set this according to the memory "
+            "available rather than the number of cores."
+        )
+    )
+    parser.add_argument(
+        "--num_responses",
+        type=int,
+        default=1,
+        help=(
+            "Number of responses to generate per expectation. Lookups in "
+            "the store can ask for at most this many."
+        )
+    )
+    parser.add_argument(
+        "--sentiment_socket",
+        type=str,
+        default=None,
+        help=(
+            "Optional. Host the sentiment model in a single process serving "
+            "all the workers on this Unix socket, instead of loading a copy "
+            "of it in each worker."
+        )
+    )
+    return parser.parse_args()
+
+
+def init_sarcasm_generator(sentiment_socket=None):
+    sentiment_analyser = None
+    if sentiment_socket is not None:
+        sentiment_analyser = SentimentClient(sentiment_socket)
+    return SarcasmGenerator(
+        PatternNegationExpectationExtractor.default(),
+        CometCommonsenseBuilder.default(
+            sentiment_analyser=sentiment_analyser
+        ),
+        PatternResponseGenerator.default()
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level="INFO")
+    args = parse_args()
+    sentiment_process = None
+    if args.sentiment_socket is not None:
+        sentiment_process = start_sentiment_process(args.sentiment_socket)
+    try:
+        num_processed, num_reused = build_response_store(
+            args.catalogue_path, args.store_path,
+            functools.partial(
+                init_sarcasm_generator, sentiment_socket=args.sentiment_socket
+            ),
+            num_workers=args.num_workers, num_responses=args.num_responses
+        )
+    finally:
+        if sentiment_process is not None:
+            sentiment_process.terminate()
+    logger.info(
+        f"Saved {num_processed + num_reused} events to {args.store_path} "
+        f"({num_processed} processed, {num_reused} reused)"
+    )
@@ -1,15 +1,26 @@
 import argparse
-import json
+import contextlib
 import logging
-
-from typing import List
+import sys
 
 from max import (
-    ExplainableSarcasticResponse, PatternNegationExpectationExtractor,
-    CommonsenseBuilderResponse, CometCommonsenseBuilder,
-    PatternResponseGenerator,
-    SarcasmGenerator
+    PatternNegationExpectationExtractor, CometCommonsenseBuilder,
+    AtomicIndexCommonsenseBuilder, RetrievalCommonsenseBuilder,
+    PatternResponseGenerator, ResponseStore, SarcasmGenerator
 )
+from max.cache import open_cache
+from max.coalescing import CoalescingSarcasmGenerator
+from max.commonsense_builders.sentiment_analyser import MODEL
+from max.commonsense_builders.sentiment_service import SentimentClient
+from max.latency import LatencyTracker
+from max.memory import MemoryMonitor
+from max.pipeline import PipelinedSarcasmGenerator
+from max.profiling import StageProfiler
+from max.resources import ResourceConfig, autotune, parse_cpu_list
+from max.sharding import process_shard
+from max.streaming import INPUT_FORMATS, stream_responses
+from max.warmup import warm_up
+from max.writers import RESPONSE_WRITERS
 
 
 logger = logging.getLogger('main')
@@ -24,7 +35,9 @@ def parse_args():
         help=(
             "Optional. A text file containing one event per line. An event is "
             "a text that describes an action performed by someone, e.g. "
-            '"I won the marathon". If not preset will enter interactive mode.'
+            '"I won the marathon". If not present, events are read from '
+            "stdin and their responses written to stdout as json lines, as "
+            "soon as they are generated."
         )
     )
     parser.add_argument(
@@ -36,28 +49,372 @@ def parse_args():
             "strategy. Required if event_file_path is set."
         )
     )
+    parser.add_argument(
+        "--atomic_index_path",
+        type=str,
+        help=(
+            "Optional. An ATOMIC index built with src/build_atomic_index.py. "
+            "If set, commonsense is looked up in the index first, and COMET "
+            "is only queried for events not found therein."
+        )
+    )
+    parser.add_argument(
+        "--retrieval_index_dir",
+        type=str,
+        help=(
+            "Optional. A directory holding a vector index of events, e.g. "
+            "built with src/build_atomic_index.py. If set, commonsense of "
+            "the most similar indexed event is reused when the similarity "
+            "is above retrieval_threshold. Events for which COMET is queried "
+            "are added to the index."
+        )
+    )
+    parser.add_argument(
+        "--retrieval_threshold",
+        type=float,
+        default=0.9,
+        help="Minimum cosine similarity for reusing an indexed event."
+    )
+    parser.add_argument(
+        "--response_store_path",
+        type=str,
+        help=(
+            "Optional. A response store built with "
+            "src/build_response_store.py. Events found therein are answered "
+            "without running the pipeline."
+        )
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        choices=list(RESPONSE_WRITERS.keys()),
+        default="json",
+        help=(
+            "Format of the output file. parquet is a compact, columnar "
+            "format for large batches; it requires pyarrow."
+        )
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Optional. Seed for picking response template fragments."
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help=(
+            "Optional. In batch mode, run the pipeline stages for successive "
+            "events concurrently, and log per-stage occupancy at the end."
+        )
+    )
+    parser.add_argument(
+        "--comet_threads",
+        type=int,
+        help="Optional. Intra-op threads for the COMET model."
+    )
+    parser.add_argument(
+        "--sentiment_threads",
+        type=int,
+        help="Optional. Intra-op threads for the sentiment model."
+    )
+    parser.add_argument(
+        "--inter_op_threads",
+        type=int,
+        help="Optional. PyTorch inter-op threads."
+    )
+    parser.add_argument(
+        "--cpu_affinity",
+        type=parse_cpu_list,
+        help='Optional. The cpus to run on, e.g. "0-3,8".'
+    )
+    parser.add_argument(
+        "--spacy_n_process",
+        type=int,
+        default=1,
+        help="Number of processes spacy uses for batches of events."
+    )
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help=(
+            "Optional. Before batch mode, time the first events of "
+            "event_file_path with several thread counts per model, and use "
+            "the fastest. Overrides comet_threads and sentiment_threads."
+        )
+    )
+    parser.add_argument(
+        "--lean",
+        action="store_true",
+        help=(
+            "Optional. Keep memory flat over very large event files: skip "
+            "the raw commonsense copies kept for debugging, and free the "
+            "strings spacy stores for each event. Not supported with "
+            "pipelined."
+        )
+    )
+    parser.add_argument(
+        "--num_shards",
+        type=int,
+        help=(
+            "Optional. Split event_file_path into this many shards by hash "
+            "of the event, and only process shard shard_index, writing to "
+            "shard_dir instead of output_file_path. Shards can run on "
+            "different hosts sharing a filesystem; merge them with "
+            "src/merge_shards.py."
+        )
+    )
+    parser.add_argument(
+        "--shard_index",
+        type=int,
+        help="The shard to process, from 0 to num_shards - 1."
+    )
+    parser.add_argument(
+        "--shard_dir",
+        type=str,
+        help=(
+            "The directory where shard outputs are written. A shard that "
+            "was interrupted resumes from its last complete event."
+        )
+    )
+    parser.add_argument(
+        "--profile_dir",
+        type=str,
+        help=(
+            "Optional. Profile the stages of a sample of the events, and "
+            "save per-stage profiles and a collapsed-stack file for "
+            "flamegraphs to this directory."
+        )
+    )
+    parser.add_argument(
+        "--profile_sample_rate",
+        type=float,
+        default=0.01,
+        help="Fraction of the events to profile."
+    )
+    parser.add_argument(
+        "--profile_torch",
+        action="store_true",
+        help=(
+            "Optional. Also run profiled events under torch.profiler, and "
+            "save a trace per event."
+        )
+    )
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help=(
+            "Optional. Compute the responses to repeated events, compared "
+            "after normalization, once, and reuse them for coalesce_ttl "
+            "seconds."
+        )
+    )
+    parser.add_argument(
+        "--coalesce_ttl",
+        type=float,
+        default=300.0,
+        help="How long, in seconds, coalesced responses are reused."
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help=(
+            "Optional. Cache COMET outputs, sentiment scores, expectations "
+            "and inflections in this backend: memory, "
+            "sqlite:///path/to/cache.db or redis://host:port/db."
+        )
+    )
+    parser.add_argument(
+        "--cache_max_entries",
+        type=int,
+        default=None,
+        help=(
+            "Maximum number of entries of the memory and sqlite caches. "
+            "For redis, configure maxmemory on the server instead."
+        )
+    )
+    parser.add_argument(
+        "--latency_report_interval",
+        type=float,
+        default=None,
+        help=(
+            "Optional. Keep latency histograms of the events, COMET calls "
+            "(by relation type and input length) and sentiment batches, and "
+            "log their percentiles every this many seconds and at the end."
+        )
+    )
+    parser.add_argument(
+        "--latency_export_path",
+        type=str,
+        default=None,
+        help=(
+            "Optional. Also write the latency histograms to this json file "
+            "at each report. Implies latency histograms."
+        )
+    )
+    parser.add_argument(
+        "--latency_slo",
+        type=float,
+        default=None,
+        help=(
+            "Optional. Target latency per event, in seconds; reports then "
+            "include the fraction of events over it. Implies latency "
+            "histograms."
+        )
+    )
+    parser.add_argument(
+        "--sentiment_socket",
+        type=str,
+        default=None,
+        help=(
+            "Optional. Score sentiments with the model hosted by "
+            "src/sentiment_server.py on this Unix socket, instead of "
+            "loading a copy of it."
+        )
+    )
+    parser.add_argument(
+        "--input_format",
+        type=str,
+        default="text",
+        choices=INPUT_FORMATS,
+        help=(
+            "Format of the events read from stdin: one event per line "
+            "(text), or one json string or object with an event and an "
+            "optional id per line (jsonl)."
+        )
+    )
+    parser.add_argument(
+        "--flush_interval",
+        type=float,
+        default=0.05,
+        help=(
+            "When reading events from stdin with a batch_size above 1, how "
+            "long, in seconds, a batch waits for more events before being "
+            "processed."
+        )
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help=(
+            "Optional. Process events this many at a time, so that the "
+            "models batch across events."
+        )
+    )
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help=(
+            "Optional. Before processing events, preload the caches from "
+            "disk and run warm-up events through every stage until the "
+            "latency is steady."
+        )
+    )
+    parser.add_argument(
+        "--ready_file",
+        type=str,
+        default=None,
+        help=(
+            "Optional. File written once the warm-up is over, e.g. for a "
+            "readiness probe. Implies warmup."
+        )
+    )
     args = parser.parse_args()
-    if args.event_file_path is not None:
+    if args.ready_file is not None:
+        args.warmup = True
+    if args.batch_size > 1:
+        assert not args.pipelined, (
+            "batch_size is not supported with pipelined"
+        )
+        assert not args.coalesce, "batch_size is not supported with coalesce"
+        assert args.profile_dir is None, (
+            "batch_size is not supported with profile_dir"
+        )
+    if args.coalesce:
+        assert not args.pipelined, "coalesce is not supported with pipelined"
+    if args.event_file_path is None:
+        assert not args.pipelined, (
+            "pipelined is not supported when reading events from stdin"
+        )
+        assert not args.autotune, (
+            "autotune is not supported when reading events from stdin"
+        )
+    if args.profile_dir is not None:
+        assert not args.pipelined, (
+            "profile_dir is not supported with pipelined"
+        )
+    if args.lean:
+        # The strings spacy stores for an event can only be freed once no
+        # other event is being processed, which is never the case when
+        # stages overlap.
+        assert not args.pipelined, "lean is not supported with pipelined"
+    if args.num_shards is not None:
+        assert args.event_file_path is not None, (
+            "If num_shards is provided, event_file_path is also needed"
+        )
+        assert args.shard_index is not None and \
+            0 <= args.shard_index < args.num_shards, (
+                "If num_shards is provided, shard_index must be between 0 "
+                "and num_shards - 1"
+            )
+        assert args.shard_dir is not None, (
+            "If num_shards is provided, shard_dir is also needed"
+        )
+    elif args.event_file_path is not None:
         assert args.output_file_path is not None, (
             "If event_file_path is provided, output_file_path is also needed"
         )
     return args
 
 
-def main_batch(sarcasm_generator, event_file_path, output_file_path):
+def generate_serially(sarcasm_generator, events, num_responses=1):
+    for event in events:
+        logger.info(f"Processing event: {event}")
+        yield sarcasm_generator.generate_responses(
+            event, num_responses=num_responses
+        )
+
+
+def main_batch(
+    sarcasm_generator, event_file_path, output_file_path, output_format='json',
+    pipelined=False, batch_size=1
+):
+    writer_cls = RESPONSE_WRITERS[output_format]
     with open(event_file_path, 'r', encoding='utf-8') as in_fp, \
-         open(output_file_path, 'w', encoding='utf-8') as out_fp:
-        for line in in_fp:
-            event = line.strip()
-            logger.info(f"Processing event: {event}")
-            responses = sarcasm_generator.generate_responses(
-                event, num_responses=1
-            )[0]
-            json.dump([r.to_json() for r in responses], out_fp, indent=2)
+         writer_cls(output_file_path) as writer:
+        events = (line.strip() for line in in_fp)
+        if pipelined:
+            response_lsts = PipelinedSarcasmGenerator(
+                sarcasm_generator
+            ).generate_responses_iter(events, num_responses=1)
+        elif batch_size > 1:
+            response_lsts = sarcasm_generator.generate_responses_iter(
+                events, num_responses=1, batch_size=batch_size
+            )
+        else:
+            response_lsts = generate_serially(
+                sarcasm_generator, events, num_responses=1
+            )
+        memory_monitor = MemoryMonitor()
+        for response_lst in response_lsts:
+            writer.write(response_lst[0])
+            memory_monitor.step()
+        memory_monitor.report()
 
 
-def main_interactive(sarcasm_generator):
-    raise NotImplementedError
+def main_stream(
+    sarcasm_generator, input_format='text', batch_size=1, flush_interval=0.05
+):
+    out_fp = sys.stdout
+    # Stdout only holds responses: anything else printed, e.g. COMET's
+    # decoded sequences, goes to stderr.
+    with contextlib.redirect_stdout(sys.stderr):
+        num_events = stream_responses(
+            sarcasm_generator, sys.stdin, out_fp, input_format=input_format,
+            batch_size=batch_size, flush_interval=flush_interval
+        )
+    logger.info(f"Processed {num_events} events from stdin")
 
 
 def init_logger(logger):
@@ -73,21 +430,131 @@ def init_logger(logger):
 
 
 def main(args):
-    expectation_extractor = PatternNegationExpectationExtractor.default()
-    commonsense_builder = CometCommonsenseBuilder.default()
-    response_generator = PatternResponseGenerator.default()
+    resource_config = ResourceConfig(
+        comet_threads=args.comet_threads,
+        sentiment_threads=args.sentiment_threads,
+        inter_op_threads=args.inter_op_threads,
+        cpu_affinity=args.cpu_affinity,
+        spacy_n_process=args.spacy_n_process
+    )
+    resource_config.apply()
+
+    cache = None
+    if args.cache is not None:
+        cache = open_cache(args.cache, max_entries=args.cache_max_entries)
+
+    expectation_extractor = PatternNegationExpectationExtractor.default(
+        cache=cache
+    )
+    sentiment_analyser = None
+    if args.sentiment_socket is not None:
+        sentiment_analyser = SentimentClient(args.sentiment_socket)
+        if cache is not None:
+            # The server hosts the default model.
+            sentiment_analyser.cache = cache.namespace(
+                'sentiment', MODEL, sentiment_analyser.labels
+            )
+    comet_builder = CometCommonsenseBuilder.default(
+        cache=cache, sentiment_analyser=sentiment_analyser
+    )
+    commonsense_builder = comet_builder
+    retrieval_builder = None
+    if args.retrieval_index_dir is not None:
+        retrieval_builder = RetrievalCommonsenseBuilder.default(
+            args.retrieval_index_dir, fallback_builder=commonsense_builder,
+            threshold=args.retrieval_threshold
+        )
+        commonsense_builder = retrieval_builder
+    if args.atomic_index_path is not None:
+        commonsense_builder = AtomicIndexCommonsenseBuilder.default(
+            args.atomic_index_path, fallback_builder=commonsense_builder
+        )
+    response_generator = PatternResponseGenerator.default(
+        compact=args.output_format == "parquet", seed=args.seed, cache=cache
+    )
+    profiler = None
+    if args.profile_dir is not None:
+        profiler = StageProfiler(
+            args.profile_dir, sample_rate=args.profile_sample_rate,
+            use_torch=args.profile_torch, seed=args.seed
+        )
+    response_store = None
+    if args.response_store_path is not None:
+        response_store = ResponseStore(args.response_store_path)
+    latency_tracker = None
+    if args.latency_report_interval is not None or \
+            args.latency_export_path is not None or \
+            args.latency_slo is not None:
+        latency_tracker = LatencyTracker(
+            report_interval=args.latency_report_interval,
+            export_path=args.latency_export_path, slo=args.latency_slo
+        )
     sarcasm_generator = SarcasmGenerator(
-        expectation_extractor, commonsense_builder, response_generator
+        expectation_extractor, commonsense_builder, response_generator,
+        response_store=response_store, lean=args.lean, profiler=profiler,
+        latency_tracker=latency_tracker
     )
 
-    if args.event_file_path is not None:
+    resource_config.configure(sarcasm_generator)
+
+    if args.warmup:
+        warm_up(sarcasm_generator, ready_file=args.ready_file)
+
+    if args.autotune:
+        with open(args.event_file_path, 'r', encoding='utf-8') as fp:
+            sample_events = [line.strip() for line, _ in zip(fp, range(8))]
+        autotune(
+            sarcasm_generator, sample_events, base_config=resource_config
+        )
+    if latency_tracker is not None:
+        # Warm-up and autotuning events are not reported.
+        latency_tracker.reset()
+        latency_tracker.start()
+    batch_generator = sarcasm_generator
+    if args.coalesce:
+        batch_generator = CoalescingSarcasmGenerator(
+            sarcasm_generator, ttl=args.coalesce_ttl
+        )
+    if args.num_shards is not None:
+        logger.info(
+            f"Entering batch mode, shard {args.shard_index} / "
+            f"{args.num_shards}"
+        )
+        process_shard(
+            batch_generator, args.event_file_path, args.shard_dir,
+            args.shard_index, args.num_shards, pipelined=args.pipelined,
+            batch_size=args.batch_size
+        )
+    elif args.event_file_path is not None:
         logger.info("Entering batch mode")
         main_batch(
-            sarcasm_generator, args.event_file_path, args.output_file_path
+            batch_generator, args.event_file_path,
+            args.output_file_path, output_format=args.output_format,
+            pipelined=args.pipelined, batch_size=args.batch_size
         )
     else:
-        logger.info("Entering interactive mode")
-        main_interactive(sarcasm_generator)
+        logger.info("Entering streaming mode")
+        main_stream(
+            batch_generator, input_format=args.input_format,
+            batch_size=args.batch_size, flush_interval=args.flush_interval
+        )
+    if args.coalesce:
+        batch_generator.log_stats()
+
+    if latency_tracker is not None:
+        latency_tracker.stop()
+    if retrieval_builder is not None:
+        retrieval_builder.save()
+    if profiler is not None:
+        profiler.uninstrument()
+        profiler.save()
+    if cache is not None:
+        for component in [
+            expectation_extractor, comet_builder,
+            comet_builder.sentiment_analyser, response_generator
+        ]:
+            component.cache.log_stats()
+        cache.close()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,14 @@
-from .types import ExplainableSarcasticResponse, CommonsenseBuilderResponse
+from .types import (
+    ExplainableSarcasticResponse, CompactSarcasticResponse,
+    CommonsenseBuilderResponse
+)
 from .expectation_extractors import PatternNegationExpectationExtractor
-from .commonsense_builders import CometCommonsenseBuilder
+from .commonsense_builders import (
+    CometCommonsenseBuilder, AtomicIndexCommonsenseBuilder,
+    RetrievalCommonsenseBuilder
+)
 from .response_generators import PatternResponseGenerator
+from .response_store import ResponseStore
 from .sarcasm_generator import SarcasmGenerator
 
 # from commonsense_builders.comet_builder import build_commonsense
@@ -0,0 +1,458 @@
+"""Caches shared by the components of the pipeline.
+
+Components that cache (`CometCommonsenseBuilder`, `SentimentAnalyser`,
+`PatternNegationExpectationExtractor` and the inflections of
+`PatternResponseGenerator`) take a `cache` argument: a view of a backend
+under a namespace (see `Cache.namespace`), whose keys include a hash of
+the component's model and data versions, so that a new model never reads
+entries computed by the previous one. All components can share one
+backend, which is then the one place to trade memory for hit rate.
+
+Backends:
+    `LRUCache`: in process memory, least recently used entries evicted
+        first;
+    `SQLiteCache`: in a SQLite file, shared across processes and runs;
+    `RedisCache`: on a Redis server, or any server speaking its protocol,
+        shared across hosts.
+`open_cache` builds a backend from a url.
+
+Values are pickled by the file and network backends, so these must only
+be shared with trusted processes.
+"""
+import collections
+import hashlib
+import logging
+import pathlib
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+
+def file_version(path) -> Tuple[str, int]:
+    """A cheap identity of a model or data file, for cache namespaces: its
+    name and size.
+    """
+    path = pathlib.Path(path)
+    return path.name, path.stat().st_size
+
+
+def version_hash(*parts) -> str:
+    """A short hash of `parts`, e.g. a model name and version, for cache
+    namespaces.
+    """
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    return digest[:12]
+
+
+class Cache:
+    """Interface of the cache backends: a size-bounded mapping from string
+    keys to picklable values.
+
+    Subclasses implement `get_many`, `set_many` and `clear`.
+    """
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """The values of the keys of `keys` that are in the cache."""
+        raise NotImplementedError
+
+    def set_many(self, items: Dict[str, Any]):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def get(self, key: str, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set(self, key: str, value):
+        self.set_many({key: value})
+
+    def namespace(self, name: str, *version) -> 'NamespacedCache':
+        """A view of this cache whose keys are prefixed with `name` and a
+        hash of `version`.
+        """
+        return NamespacedCache(self, name, version_hash(*version))
+
+
+class NamespacedCache(Cache):
+    """A view of a backend under a prefix, which counts its hits and
+    misses.
+    """
+    def __init__(self, backend: Cache, name: str, version: str):
+        self.backend = backend
+        self.name = name
+        self.prefix = f"{name}:{version}:"
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get_many(self, keys):
+        values = self.backend.get_many([self.prefix + key for key in keys])
+        prefix_len = len(self.prefix)
+        values = {key[prefix_len:]: value for key, value in values.items()}
+        self.num_hits += len(values)
+        self.num_misses += len(keys) - len(values)
+        return values
+
+    def set_many(self, items):
+        self.backend.set_many({
+            self.prefix + key: value for key, value in items.items()
+        })
+
+    def clear(self):
+        """Clear the whole backend; entries are not indexed by namespace.
+        """
+        self.backend.clear()
+
+    def log_stats(self):
+        num_lookups = self.num_hits + self.num_misses
+        if num_lookups > 0:
+            logger.info(
+                f"Cache {self.name}: {self.num_hits} hits out of "
+                f"{num_lookups} lookups ({self.num_hits / num_lookups:.0%})"
+            )
+
+
+def get_or_compute_many(
+    cache: Optional[Cache],
+    inputs: List[Any],
+    compute: Callable[[List[Any]], List[Any]],
+    key: Callable[[Any], str] = str
+) -> List[Any]:
+    """The values of `inputs`, taken from `cache` or, for the inputs missing
+    from it, computed with one call to `compute` and added to it.
+
+    Args:
+        cache (`Cache`):
+            the cache; if None, all the values are computed
+        inputs (`List[Any]`):
+            the inputs; inputs with the same key are computed once
+        compute (`Callable[[List[Any]], List[Any]]`):
+            computes the values of a list of inputs, in order
+        key (`Callable[[Any], str]`):
+            the cache key of an input
+
+    Returns:
+        `List[Any]`: the values, in the order of `inputs`
+    """
+    if cache is None:
+        return compute(inputs)
+    keys = [key(input) for input in inputs]
+    key_to_input = dict(zip(keys, inputs))
+    values = cache.get_many(list(key_to_input))
+    miss_keys = [k for k in key_to_input if k not in values]
+    if len(miss_keys) > 0:
+        computed = dict(zip(
+            miss_keys, compute([key_to_input[k] for k in miss_keys])
+        ))
+        cache.set_many(computed)
+        values.update(computed)
+    return [values[k] for k in keys]
+
+
+class LRUCache(Cache):
+    """Cache in process memory, holding at most `max_entries` entries.
+
+    Values are stored as they are, not copied, so they must not be
+    modified once cached. Thread-safe.
+    """
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, keys):
+        values = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    values[key] = self._entries[key]
+        return values
+
+    def set_many(self, items):
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(Cache):
+    """Cache in a SQLite file, holding at most about `max_entries` entries,
+    so it can be shared by the processes of a host and reused across runs.
+
+    Each entry records when it was last read or written; once the cache
+    holds more than `max_entries` entries, the least recently used are
+    deleted, along with a tenth of `max_entries` more, so that eviction
+    runs once per many writes. Thread-safe.
+    """
+    # Keys per statement, below SQLite's limit on parameters.
+    CHUNK_SIZE = 500
+
+    def __init__(self, path, max_entries: int = 1000000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache '
+            '(key TEXT PRIMARY KEY, value BLOB, atime REAL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime)'
+        )
+        # Estimate of the number of entries, counting replaced entries as
+        # new ones; counted exactly before evicting.
+        self._num_entries = len(self)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM cache'
+            ).fetchone()[0]
+
+    def _chunks(self, keys):
+        for start in range(0, len(keys), self.CHUNK_SIZE):
+            yield keys[start:start + self.CHUNK_SIZE]
+
+    def get_many(self, keys):
+        values = {}
+        with self._lock:
+            for chunk in self._chunks(list(keys)):
+                placeholders = ', '.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT key, value FROM cache '
+                    f'WHERE key IN ({placeholders})',
+                    chunk
+                ).fetchall()
+                if len(rows) == 0:
+                    continue
+                with self._conn:
+                    self._conn.execute(
+                        f'UPDATE cache SET atime = ? '
+                        f'WHERE key IN ({placeholders})',
+                        [time.time()] + chunk
+                    )
+                for key, value in rows:
+                    values[key] = pickle.loads(value)
+        return values
+
+    def set_many(self, items):
+        atime = time.time()
+        rows = [
+            (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), atime)
+            for key, value in items.items()
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO cache (key, value, atime) '
+                    'VALUES (?, ?, ?)',
+                    rows
+                )
+            self._num_entries += len(rows)
+            if self._num_entries > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        num_entries = self._conn.execute(
+            'SELECT COUNT(*) FROM cache'
+        ).fetchone()[0]
+        num_evicted = num_entries - self.max_entries
+        if num_evicted > 0:
+            num_evicted += self.max_entries // 10
+            with self._conn:
+                self._conn.execute(
+                    'DELETE FROM cache WHERE key IN '
+                    '(SELECT key FROM cache ORDER BY atime LIMIT ?)',
+                    (num_evicted,)
+                )
+            num_entries = max(num_entries - num_evicted, 0)
+        self._num_entries = num_entries
+
+    def clear(self):
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM cache')
+            self._num_entries = 0
+
+    def close(self):
+        self._conn.close()
+
+
+class RedisCache(Cache):
+    """Cache on a server speaking the Redis protocol (RESP), with a minimal
+    client, so no Redis package is needed.
+
+    Eviction is left to the server, e.g. with `maxmemory` and the
+    `allkeys-lru` policy; entries can also expire after `ttl` seconds.
+    Thread-safe; commands are sent over a single connection, opened on
+    first use.
+    """
+    def __init__(
+        self, host: str = 'localhost', port: int = 6379, db: int = 0,
+        ttl: Optional[float] = None, timeout: float = 5.0
+    ):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        self._sock = socket.create_connection(
+            (self.host, self.port), timeout=self.timeout
+        )
+        self._reader = self._sock.makefile('rb')
+        if self.db != 0:
+            self._send([b'SELECT', str(self.db).encode()])
+            reply = self._read_reply()
+            if isinstance(reply, RuntimeError):
+                raise reply
+
+    def _send(self, args):
+        chunks = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            chunks.append(f"${len(arg)}\r\n".encode())
+            chunks.append(arg)
+            chunks.append(b'\r\n')
+        self._sock.sendall(b''.join(chunks))
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Connection closed by the cache server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload
+        if kind == b'-':
+            # Raised once all the replies are read, so that the connection
+            # stays in sync.
+            return RuntimeError(f"Cache server error: {payload.decode()}")
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ValueError(f"Unexpected reply from the cache server: {line!r}")
+
+    def execute(self, *commands):
+        """Send `commands`, each a list of arguments, in one round trip,
+        and return their replies.
+        """
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            try:
+                for command in commands:
+                    self._send([
+                        arg if isinstance(arg, bytes) else str(arg).encode()
+                        for arg in command
+                    ])
+                replies = [self._read_reply() for _ in commands]
+            except OSError:
+                # The connection is in an unknown state; reconnect next time.
+                self._close()
+                raise
+        for reply in replies:
+            if isinstance(reply, RuntimeError):
+                raise reply
+        return replies
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if len(keys) == 0:
+            return {}
+        replies, = self.execute(['MGET'] + [key.encode() for key in keys])
+        return {
+            key: pickle.loads(reply)
+            for key, reply in zip(keys, replies) if reply is not None
+        }
+
+    def set_many(self, items):
+        if len(items) == 0:
+            return
+        commands = []
+        for key, value in items.items():
+            command = [
+                b'SET', key.encode(),
+                pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            ]
+            if self.ttl is not None:
+                command += [b'PX', int(self.ttl * 1000)]
+            commands.append(command)
+        self.execute(*commands)
+
+    def clear(self):
+        self.execute(['FLUSHDB'])
+
+    def _close(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+            self._sock = None
+            self._reader = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def open_cache(url: str, max_entries: Optional[int] = None) -> Cache:
+    """Build a cache backend from `url`.
+
+    Args:
+        url (`str`):
+            "memory" for an `LRUCache`, "sqlite:///path/to/cache.db" (or
+            "sqlite://relative/path.db") for a `SQLiteCache`, or
+            "redis://host:port/db" for a `RedisCache`
+        max_entries (`int`):
+            the size bound of the memory and SQLite backends; the default of
+            each backend if None
+
+    Returns:
+        `Cache`: the backend
+    """
+    parsed = urllib.parse.urlparse(url)
+    kwargs = {} if max_entries is None else {'max_entries': max_entries}
+    if url in ('memory', 'memory://'):
+        return LRUCache(**kwargs)
+    if parsed.scheme == 'sqlite':
+        return SQLiteCache(parsed.netloc + parsed.path, **kwargs)
+    if parsed.scheme == 'redis':
+        return RedisCache(
+            host=parsed.hostname or 'localhost', port=parsed.port or 6379,
+            db=int(parsed.path.lstrip('/') or 0)
+        )
+    raise ValueError(f"Unsupported cache url: {url}")
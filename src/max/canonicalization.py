@@ -0,0 +1,101 @@
+import dataclasses
+import functools
+import re
+
+from dataclasses import dataclass
+from typing import List
+
+import ftfy
+
+from max.types import CompactSarcasticResponse, ResponseContext
+
+
+_QUOTES = '"\'`'
+_SPACE_BEFORE_PUNCT = re.compile(r'\s+([,;:.!?])')
+# Sentence-final punctuation, except the period of a trailing abbreviation
+# such as "U.S.".
+_FINAL_PUNCT = re.compile(r'(?<!\b[A-Za-z])[.!?…]+$|[!?…]+$')
+_LOWER_I = re.compile(r"(?<![\w'.-])i(?![\w.-])")
+
+
+@dataclass(frozen=True)
+class CanonicalEvent:
+    """An event in canonical form.
+
+    Attributes:
+        key: the canonical text of the event. Events that differ only in
+            encoding glitches, whitespace, final punctuation, surrounding
+            quotes, or the case of the first letter or of an all-caps text
+            have the same key. It is both the key under which results for
+            the event are cached, and the text the models are run on, so
+            that cached results do not depend on which surface form came
+            first.
+        surface: the event as given, to report in the output
+    """
+    key: str
+    surface: str
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def canonical_text(event: str) -> str:
+    """See `CanonicalEvent.key`."""
+    # ftfy is comparatively slow, and only needed for non-ascii text or
+    # html entities.
+    if not event.isascii() or '&' in event:
+        event = ftfy.fix_text(event)
+    event = ' '.join(event.split())
+    while len(event) >= 2 and event[0] == event[-1] and event[0] in _QUOTES:
+        event = event[1:-1].strip()
+    event = _SPACE_BEFORE_PUNCT.sub(r'\1', event)
+    event = _FINAL_PUNCT.sub('', event).rstrip()
+
+    # Case is only folded where it carries no information: shouting, the
+    # first letter of the sentence, and the pronoun "i".
+    if event.isupper() and ' ' in event:
+        event = event.lower()
+    event = _LOWER_I.sub('I', event)
+    # Words with inner capitals, such as "iPhone", are left as they are.
+    if len(event) > 0 and event.split(' ', 1)[0].islower():
+        event = event[0].upper() + event[1:]
+    return event
+
+
+def canonicalize(event: str) -> CanonicalEvent:
+    return CanonicalEvent(key=canonical_text(event), surface=event)
+
+
+def restore_surface(response_lst: List[list], surface: str) -> List[list]:
+    """Replace the event in responses generated for a canonical event, or
+    for another surface form of it, with `surface`.
+
+    Args:
+        response_lst (`List[List[ExplainableSarcasticResponse]]`):
+            as returned by `SarcasmGenerator.generate_responses`;
+            `CompactSarcasticResponse` objects are also accepted
+        surface (`str`):
+            the event as given
+
+    Returns:
+        `List[List[ExplainableSarcasticResponse]]`: new lists of responses;
+            responses that already refer to `surface` are reused
+    """
+    contexts = {}
+
+    def restore(response):
+        if response.event == surface:
+            return response
+        if isinstance(response, CompactSarcasticResponse):
+            # Responses that shared a context still share one.
+            context = contexts.get(id(response.context))
+            if context is None:
+                context = ResponseContext(
+                    surface, response.context.failed_expectation
+                )
+                contexts[id(response.context)] = context
+            return CompactSarcasticResponse.from_response(response, context)
+        return dataclasses.replace(response, event=surface)
+
+    return [
+        [restore(response) for response in responses]
+        for responses in response_lst
+    ]
@@ -0,0 +1,126 @@
+import collections
+import logging
+import threading
+import time
+
+from typing import Callable, Dict, Hashable
+
+from max.canonicalization import canonicalize, restore_surface
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+
+class _InFlight:
+    """A computation that callers with the same key wait on."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class CoalescingSarcasmGenerator:
+    """Wraps a `SarcasmGenerator` so that requests for the same event are
+    computed once.
+
+    Events are keyed by their canonical form (see
+    `max.canonicalization`), together with the number of responses.
+    Requests for a key that is being computed wait for that computation and
+    share its result, instead of running the pipeline again; completed
+    results are kept for `ttl` seconds, for at most `max_entries` keys, and
+    answer later requests directly. Each request gets the responses with
+    its own surface form of the event.
+
+    Failures are not cached: the exception is raised to all the requests
+    waiting on the computation, and the next request recomputes.
+
+    Thread-safe, so a single instance can serve concurrent requests, e.g.
+    in a server; in batch mode, it deduplicates repeated events.
+    """
+    def __init__(
+        self,
+        sarcasm_generator,
+        ttl: float = 300.0,
+        max_entries: int = 10000,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.sarcasm_generator = sarcasm_generator
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, _InFlight] = {}
+        # key -> (expiry time, responses), least recently used first.
+        self._cache = collections.OrderedDict()
+        self.num_computed = 0
+        self.num_coalesced = 0
+        self.num_cached = 0
+
+    def _cache_get(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expiry_time, response_lst = entry
+        if expiry_time <= self.clock():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return response_lst
+
+    def _cache_put(self, key, response_lst):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        self._cache[key] = (self.clock() + self.ttl, response_lst)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def generate_responses(self, event: str, num_responses: int = 1):
+        """See `SarcasmGenerator.generate_responses`."""
+        key = (canonicalize(event).key, num_responses)
+        with self._lock:
+            response_lst = self._cache_get(key)
+            if response_lst is not None:
+                self.num_cached += 1
+                return restore_surface(response_lst, event)
+            in_flight = self._in_flight.get(key)
+            is_leader = in_flight is None
+            if is_leader:
+                in_flight = _InFlight()
+                self._in_flight[key] = in_flight
+                self.num_computed += 1
+            else:
+                self.num_coalesced += 1
+
+        if not is_leader:
+            in_flight.done.wait()
+            if in_flight.exception is not None:
+                raise in_flight.exception
+            if in_flight.result is None:
+                raise RuntimeError(
+                    f"The computation of responses to {event!r} was "
+                    "interrupted"
+                )
+            return restore_surface(in_flight.result, event)
+
+        try:
+            in_flight.result = self.sarcasm_generator.generate_responses(
+                event, num_responses=num_responses
+            )
+        except Exception as e:
+            in_flight.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if in_flight.result is not None:
+                    self._cache_put(key, in_flight.result)
+            in_flight.done.set()
+        return restore_surface(in_flight.result, event)
+
+    def log_stats(self):
+        logger.info(
+            f"Coalescing: {self.num_computed} computed, "
+            f"{self.num_coalesced} coalesced with in-flight requests, "
+            f"{self.num_cached} answered from the cache"
+        )
@@ -1,2 +1,4 @@
 from .sentiment_analyser import SentimentAnalyser
-from .comet_builder import CometCommonsenseBuilder
\ No newline at end of file
+from .comet_builder import CometCommonsenseBuilder
+from .atomic_builder import AtomicIndexCommonsenseBuilder
+from .retrieval_builder import RetrievalCommonsenseBuilder
\ No newline at end of file
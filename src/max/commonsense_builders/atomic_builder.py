@@ -0,0 +1,166 @@
+import json
+import logging
+import pathlib
+import pickle
+
+from typing import Dict, List, Optional
+
+import pandas as pd
+import spacy
+
+from .builder import FallbackCommonsenseBuilder
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+ATOMIC_RELATION_TYPES = [
+    'xIntent', 'xNeed', 'xAttr', 'xWant', 'xReact', 'xEffect'
+]
+INDEX_VERSION = 2
+
+
+def _subject_end(sp_obt):
+    """The index of the first token after the subject of `sp_obt`, if it
+    starts the event, e.g. 2 for "My brother won the marathon"; without a
+    dependency parse, the subject is taken to be the first token.
+    """
+    if sp_obt.has_annotation('DEP'):
+        for tok in sp_obt:
+            if tok.dep_ in ['nsubj', 'nsubjpass'] and tok.left_edge.i == 0:
+                return tok.right_edge.i + 1
+    return 1
+
+
+def normalize_event(sp_obt):
+    """Normalize a spacy-processed event into a lookup key.
+
+    The key is the lowercased lemma sequence, without punctuation, with the
+    subject replaced by "personx", as in ATOMIC.
+
+    Example: "My brother won the marathon." -> "personx win the marathon"
+    """
+    toks = ['personx']
+    for tok in sp_obt[_subject_end(sp_obt):]:
+        if tok.is_punct and tok.text != '___':
+            continue
+        if tok.lower_ in ['personx', 'persony']:
+            toks.append(tok.lower_)
+        else:
+            toks.append(tok.lemma_.lower())
+    return ' '.join(toks)
+
+
+class AtomicIndexCommonsenseBuilder(FallbackCommonsenseBuilder):
+    """Serves relation objects from a precomputed index of ATOMIC events.
+
+    An input is first matched exactly against the ATOMIC events, then by its
+    normalized (lemmatized) form, see `normalize_event`. On a miss the
+    fallback builder, usually `CometCommonsenseBuilder`, is queried.
+    """
+    def __init__(self, index, spacy_processor, fallback_builder):
+        super().__init__(fallback_builder)
+        self.index = index
+        self.spacy_processor = spacy_processor
+
+    def lookup(self, input) -> Optional[Dict[str, List[str]]]:
+        obts_id = self.index['exact'].get(' '.join(input.split()))
+        if obts_id is None:
+            key = normalize_event(self.spacy_processor(input))
+            obts_id = self.index['normalized'].get(key)
+        if obts_id is None:
+            return None
+        return self.index['obts'][obts_id]
+
+    @classmethod
+    def default(cls, index_path, fallback_builder=None):
+        if fallback_builder is None:
+            from .comet_builder import CometCommonsenseBuilder
+            fallback_builder = CometCommonsenseBuilder.default()
+        index = load_atomic_index(index_path)
+        spacy_processor = spacy.load('en_core_web_sm')
+        return cls(index, spacy_processor, fallback_builder)
+
+
+def read_atomic_csv(atomic_csv_path):
+    """Read an ATOMIC csv file, e.g. `v4_atomic_trn.csv`, as obtained by
+    `scripts/get_atomic_data.sh`, into a dictionary from an event to
+    relation objects.
+
+    Objects are lowercased and deduplicated, and "none" objects are
+    dropped, so that the result resembles the beams returned by COMET.
+    Events without any xAttr object are dropped, since the postprocessing
+    of `CometCommonsenseBuilder` builds on them; they are left to the
+    fallback builder.
+    """
+    df = pd.read_csv(atomic_csv_path, usecols=['event'] + ATOMIC_RELATION_TYPES)
+    event_to_obts = {}
+    for row in df.itertuples(index=False):
+        event = ' '.join(row.event.split())
+        obts = event_to_obts.setdefault(
+            event, {R: [] for R in ATOMIC_RELATION_TYPES}
+        )
+        for R in ATOMIC_RELATION_TYPES:
+            for obt in json.loads(getattr(row, R)):
+                obt = ' '.join(obt.lower().split())
+                if obt != 'none' and len(obt) > 0 and obt not in obts[R]:
+                    obts[R].append(obt)
+    return {
+        event: obts for event, obts in event_to_obts.items()
+        if len(obts['xAttr']) > 0
+    }
+
+
+def build_atomic_index(atomic_csv_paths, index_path, spacy_processor=None):
+    """Build the index used by `AtomicIndexCommonsenseBuilder` and save it at
+    `index_path`.
+
+    Args:
+        atomic_csv_paths (`List[str]`):
+            paths to ATOMIC csv files
+        index_path (`str`):
+            where to save the index
+        spacy_processor:
+            spacy pipeline used to normalize events, see `normalize_event`
+    """
+    if spacy_processor is None:
+        spacy_processor = spacy.load('en_core_web_sm')
+
+    event_to_obts = {}
+    for atomic_csv_path in atomic_csv_paths:
+        logger.info(f"Reading {atomic_csv_path}")
+        for event, obts in read_atomic_csv(atomic_csv_path).items():
+            event_to_obts.setdefault(event, obts)
+
+    events = list(event_to_obts.keys())
+    index = {
+        'version': INDEX_VERSION,
+        'obts': [event_to_obts[event] for event in events],
+        'exact': {event: obts_id for obts_id, event in enumerate(events)},
+        'normalized': {}
+    }
+    logger.info(f"Normalizing {len(events)} events")
+    for obts_id, sp_obt in enumerate(
+        spacy_processor.pipe(events, batch_size=256)
+    ):
+        # On collisions, keep the first event.
+        index['normalized'].setdefault(normalize_event(sp_obt), obts_id)
+
+    pathlib.Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(index_path, 'wb') as fp:
+        pickle.dump(index, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    return index
+
+
+def load_atomic_index(index_path):
+    with open(index_path, 'rb') as fp:
+        index = pickle.load(fp)
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError(
+            f"Unsupported ATOMIC index version {index.get('version')} at "
+            f"{index_path}; please rebuild it with src/build_atomic_index.py"
+        )
+    logger.info(
+        f"Loaded ATOMIC index with {len(index['exact'])} events from "
+        f"{index_path}"
+    )
+    return index
@@ -1,4 +1,159 @@
+import logging
+
+from typing import Dict, List, Optional, Tuple
+
+from max import CommonsenseBuilderResponse
+
+
+logger = logging.getLogger('sarcasm_generator')
+
 
 class CommonsenseBuilder:
-    def build_commonsense(event, *args):
+    """Base class of the commonsense builders.
+
+    Subclasses implement `build_comet_commonsense`, which returns the raw
+    relation objects of an input, and `remove_comet_overlap`, which
+    postprocesses those of an event and of an expectation;
+    `build_commonsense` combines them.
+    """
+    def build_commonsense(
+        self,
+        event: str,
+        failed_expectation: str = None,
+        sampling: str = 'beam-10',
+        keep_raw: bool = True
+    ) -> Tuple[CommonsenseBuilderResponse, CommonsenseBuilderResponse]:
+        """Generates commonsense relation objects for a set of predefined
+        relation types.
+
+        Args:
+            event (`str`):
+                an event, i.e. a reference to an action performed by an actor,
+                such as "Ben won the marathon"
+            failed_expectation (`str`):
+                An event that is incongruous to the input event. This event has
+                failed since the input event happened.
+            rel_type (`str`):
+                The type of the commonsense if-then relations to consider.
+                Objects of this relation will be inferred. In the current
+                implementation, this can be one of 'xIntent', 'xNeed', 'xAttr',
+                'xWant', 'xReact', 'xWant', 'xEffect'.
+            sampling (`str`):
+                the sampling algorithm to be used by the commonsense generator
+            keep_raw (`bool`):
+                whether to also return the raw commonsense; if not, the
+                second instance returned is None and no copies are made
+
+        Returns:
+            `Tuple[CommonsenseBuilderResponse, CommonsenseBuilderResponse]`:
+                Two instances of `CommonsenseBuilderResponse`. Within one
+                instance, both `event_obts` and `failed_expectation_obts`
+                are dictionaries from a relation type to a list of commonsense
+                objects.
+                Why two instances? The first one is postprocessed; the second
+                one is raw, as returned by COMET. We usually use the first one.
+                The second one is for debugging purposes.
+        """
+        event_cs = self.build_comet_commonsense(event, sampling)
+
+        # "raw" here refers to "without the postprocessing applied below in
+        # remove_comet_overlap"
+        raw_event_cs = event_cs.copy() if keep_raw else None
+
+        if failed_expectation is not None:
+            exp_cs = self.build_comet_commonsense(
+                failed_expectation, sampling
+            )
+            raw_exp_cs = exp_cs.copy() if keep_raw else None
+        else:
+            exp_cs = None
+            raw_exp_cs = None
+
+        event_cs, exp_cs = self.remove_comet_overlap(event_cs, exp_cs)
+
+        if not keep_raw:
+            return (
+                CommonsenseBuilderResponse(
+                    event_obts=event_cs, failed_expectation_obts=exp_cs
+                ),
+                None
+            )
+        if failed_expectation is not None and exp_cs is not None:
+            return (
+                CommonsenseBuilderResponse(
+                    event_obts=event_cs, failed_expectation_obts=exp_cs
+                ),
+                CommonsenseBuilderResponse(
+                    event_obts=raw_event_cs, failed_expectation_obts=raw_exp_cs
+                )
+            )
+        else:
+            return (
+                CommonsenseBuilderResponse(event_obts=event_cs),
+                CommonsenseBuilderResponse(event_obts=raw_event_cs)
+            )
+
+    def build_comet_commonsense(self, input, sampling):
+        raise NotImplementedError
+
+    def remove_comet_overlap(self, in_cs, exp_cs=None):
+        raise NotImplementedError
+
+
+class FallbackCommonsenseBuilder(CommonsenseBuilder):
+    """Base class for builders that answer from a precomputed source and
+    fall back to another builder (usually `CometCommonsenseBuilder`) on a
+    miss.
+
+    Subclasses implement `lookup`, which returns the raw relation objects
+    for an input, i.e. a dictionary from a relation type to a list of
+    objects, in the same format as
+    `CometCommonsenseBuilder.build_comet_commonsense`, or None on a miss.
+    Postprocessing is always delegated to the fallback builder.
+    """
+    def __init__(self, fallback_builder):
+        self.fallback_builder = fallback_builder
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def lookup(self, input) -> Optional[Dict[str, List[str]]]:
         raise NotImplementedError
+
+    def build_comet_commonsense(self, input, sampling):
+        outputs = self.lookup(input)
+        if outputs is not None:
+            self.num_hits += 1
+            # Copy the lists, since postprocessing must not alter the source.
+            return {R: list(obts) for R, obts in outputs.items()}
+        self.num_misses += 1
+        logger.debug(f"{type(self).__name__} miss: {input}")
+        return self.fallback_builder.build_comet_commonsense(input, sampling)
+
+    def build_comet_commonsense_batch(self, inputs, sampling):
+        """Same as `build_comet_commonsense`, for a list of inputs. The
+        misses are passed to the fallback builder in one batch.
+        """
+        outputs = [self.lookup(input) for input in inputs]
+        miss_inputs = [
+            input for input, obts in zip(inputs, outputs) if obts is None
+        ]
+        self.num_hits += len(inputs) - len(miss_inputs)
+        self.num_misses += len(miss_inputs)
+        for input in miss_inputs:
+            logger.debug(f"{type(self).__name__} miss: {input}")
+        miss_outputs = iter(
+            self.fallback_builder.build_comet_commonsense_batch(
+                miss_inputs, sampling
+            ) if len(miss_inputs) > 0 else []
+        )
+        return [
+            {R: list(obts) for R, obts in obts.items()}
+            if obts is not None else next(miss_outputs)
+            for obts in outputs
+        ]
+
+    def remove_comet_overlap(self, in_cs, exp_cs=None):
+        return self.fallback_builder.remove_comet_overlap(in_cs, exp_cs)
+
+    def remove_comet_overlap_batch(self, cs_pairs):
+        return self.fallback_builder.remove_comet_overlap_batch(cs_pairs)
@@ -1,37 +1,44 @@
+import functools
 import pathlib
 import sys
 
-from typing import Tuple
-
 import spacy
 import torch
 from spacy.lang.en.stop_words import STOP_WORDS
 
-from max import CommonsenseBuilderResponse
+from max.cache import file_version, get_or_compute_many
+from max.resources import torch_threads
 from .sentiment_analyser import SentimentAnalyser
 from .builder import CommonsenseBuilder
 
 
 # This should be re-engineered
 COMET_PATH = pathlib.Path(__file__).absolute().parent / 'comet'
-sys.path.append(str(COMET_PATH))
-
-
-from src.data import data
-from src.data import config
-from src.interactive import functions
-from utils import utils
 
 
 STOP_WORDS.add('stay')
 DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
-config.device = DEVICE
+
+
+def comet_functions():
+    """Import the COMET code on first use. Only running the model needs it,
+    so the postprocessing in this module, and stand-ins for the model in
+    tests, work without a COMET checkout.
+    """
+    if str(COMET_PATH) not in sys.path:
+        sys.path.append(str(COMET_PATH))
+    from src.data import data
+    from src.data import config
+    from src.interactive import functions
+    from utils import utils
+    config.device = DEVICE
+    return functions
 
 
 class CometCommonsenseBuilder(CommonsenseBuilder):
     def __init__(
         self, model, data_loader, text_encoder, valid_relation_types, opt,
-        spacy_processor, sentiment_analyser
+        spacy_processor, sentiment_analyser, num_threads=None, cache=None
     ):
         self.model = model
         self.data_loader = data_loader
@@ -40,85 +47,57 @@ class CometCommonsenseBuilder(CommonsenseBuilder):
         self.opt = opt
         self.spacy_processor = spacy_processor
         self.sentiment_analyser = sentiment_analyser
+        # Intra-op threads for the model; None for the PyTorch default.
+        self.num_threads = num_threads
+        # Optional `max.cache.Cache` of raw COMET outputs.
+        self.cache = cache
 
-    def build_commonsense(
-        self,
-        event: str,
-        failed_expectation: str = None,
-        sampling: str = 'beam-10'
-    ) -> Tuple[CommonsenseBuilderResponse, CommonsenseBuilderResponse]:
-        """Generates commonsense relation objects for a set of predefined
-        relation types.
-
-        Args:
-            event (`str`):
-                an event, i.e. a reference to an action performed by an actor,
-                such as "Ben won the marathon"
-            failed_expectation (`str`):
-                An event that is incongruous to the input event. This event has
-                failed since the input event happened.
-            rel_type (`str`):
-                The type of the commonsense if-then relations to consider.
-                Objects of this relation will be inferred. In the current
-                implementation, this can be one of 'xIntent', 'xNeed', 'xAttr',
-                'xWant', 'xReact', 'xWant', 'xEffect'.
-            sampling (`str`):
-                the sampling algorithm to be used by the commonsense generator
-
-        Returns:
-            `Tuple[CommonsenseBuilderResponse, CommonsenseBuilderResponse]`:
-                Two instances of `CommonsenseBuilderResponse`. Within one
-                instance, both `event_obts` and `failed_expectation_obts`
-                are dictionaries from a relation type to a list of commonsense
-                objects.
-                Why two instances? The first one is postprocessed; the second
-                one is raw, as returned by COMET. We usually use the first one.
-                The second one is for debugging purposes.
-        """
-        event_cs = self.build_comet_commonsense(event, sampling)
-
-        # "raw" here refers to "without the postprocessing applied below in
-        # remove_comet_overlap"
-        raw_event_cs = event_cs.copy()
+    def build_comet_commonsense(self, input, sampling):
+        return self.build_comet_commonsense_batch([input], sampling)[0]
 
-        if failed_expectation is not None:
-            exp_cs = self.build_comet_commonsense(
-                failed_expectation, sampling
-            )
-            raw_exp_cs = exp_cs.copy()
-        else:
-            exp_cs = None
-            raw_exp_cs = None
-
-        event_cs, exp_cs = self.remove_comet_overlap(event_cs, exp_cs)
-
-        if failed_expectation is not None and exp_cs is not None:
-            return (
-                CommonsenseBuilderResponse(
-                    event_obts=event_cs, failed_expectation_obts=exp_cs
-                ),
-                CommonsenseBuilderResponse(
-                    event_obts=raw_event_cs, failed_expectation_obts=raw_exp_cs
-                )
-            )
-        else:
-            return (
-                CommonsenseBuilderResponse(event_obts=event_cs),
-                CommonsenseBuilderResponse(event_obts=raw_event_cs)
+    def build_comet_commonsense_batch(self, inputs, sampling):
+        """Same as `build_comet_commonsense`, for a list of inputs. Inputs
+        are looked up in `self.cache`, if set. COMET's interactive decoding
+        takes one input at a time, so the others are decoded in turn; this
+        is the extension point for builders that can decode several at once.
+        """
+        outputs = get_or_compute_many(
+            self.cache, inputs,
+            lambda inputs: [
+                self.run_comet(input, sampling) for input in inputs
+            ],
+            key=lambda input: f"{sampling}\n{input}"
+        )
+        if self.cache is None:
+            return outputs
+        # Cached outputs may be shared, and callers may modify theirs.
+        return [
+            {R: list(obts) for R, obts in output.items()}
+            for output in outputs
+        ]
+
+    def run_comet(self, input, sampling):
+        """Decode the relation objects of `input` with COMET."""
+        return {
+            relation_type: self.run_comet_relation(
+                input, sampling, relation_type
             )
+            for relation_type in sorted(self.valid_relation_types)
+        }
 
-    def build_comet_commonsense(self, input, sampling):
+    def run_comet_relation(self, input, sampling, relation_type):
+        """Decode the relation objects of `input` for one relation type.
+        COMET decodes relation types one at a time anyway, so this is as
+        fast as asking for all of them at once, and can be timed.
+        """
+        functions = comet_functions()
         sampler = functions.set_sampler(self.opt, sampling, self.data_loader)
-        outputs = functions.get_atomic_sequence(
-            input, self.model, sampler, self.data_loader, self.text_encoder,
-            list(self.valid_relation_types)
-        )
-        outputs = {
-            relation_type: relation_obt['beams']
-            for relation_type, relation_obt in outputs.items()
-            if relation_type in self.valid_relation_types
-        }
-        return outputs
+        with torch.no_grad(), torch_threads(self.num_threads):
+            outputs = functions.get_atomic_sequence(
+                input, self.model, sampler, self.data_loader,
+                self.text_encoder, relation_type
+            )
+        return outputs[relation_type]['beams']
 
     # ======================================================================== #
     # Warning: the code that follows is rather tedious.
@@ -153,87 +132,149 @@ class CometCommonsenseBuilder(CommonsenseBuilder):
             != self.sentiment_analyser.get_sentiment(s2)
         )
 
+    def sents_contradict_batch(self, s1_lst, s2_lst):
+        """Same as `sents_contradict`, for pairs of sentences. Each distinct
+        sentence is scored once, and all are scored in one batched call.
+        """
+        sents = list(dict.fromkeys(s1_lst + s2_lst))
+        sent_to_label = dict(zip(
+            sents, self.sentiment_analyser.get_sentiment_batch(sents)
+        ))
+        return [
+            sent_to_label[s1] != sent_to_label[s2]
+            for s1, s2 in zip(s1_lst, s2_lst)
+        ]
+
     def remove_comet_overlap(self, in_cs, exp_cs=None):
-        # Preprocess and dedupe individually.
+        return self.remove_comet_overlap_batch([(in_cs, exp_cs)])[0]
+
+    def remove_comet_overlap_batch(self, cs_pairs):
+        """Same as `remove_comet_overlap`, for a list of pairs of raw
+        commonsense of an event and of an expectation. The contradiction
+        checks of all the pairs are scored together.
+        """
+        prepared = [
+            self._dedupe_comet_overlap(in_cs, exp_cs)
+            for in_cs, exp_cs in cs_pairs
+        ]
+
+        # Remove obts that contradict with xAttr obts. The sentences of all
+        # the events and expectations are scored together. Commonsense
+        # without xAttr obts has no reference sentence and is kept as is.
+        ref_sents = []
+        sents = []
+        for _, in_cs, exp_cs in prepared:
+            # Reference sentences built from xAttr obts.
+            for cs in [in_cs] + ([exp_cs] if exp_cs is not None else []):
+                if len(cs['xAttr']) == 0:
+                    continue
+                ref_sent = gen_sentence('xAttr', cs['xAttr'][:5])
+                for R, obts in cs.items():
+                    ref_sents.extend([ref_sent] * len(obts))
+                    sents.extend(gen_sentence(R, [obt]) for obt in obts)
+        contradict = iter(self.sents_contradict_batch(ref_sents, sents))
+
+        def remove_contradictions(cs):
+            if len(cs['xAttr']) == 0:
+                return cs
+            return {
+                R: [obt for obt in obts if not next(contradict)]
+                for R, obts in cs.items()
+            }
+
+        cs_pairs = []
+        for vocab, in_cs, exp_cs in prepared:
+            in_cs = remove_contradictions(in_cs)
+            if exp_cs is not None:
+                exp_cs = remove_contradictions(exp_cs)
+
+            # Remove obts that are duplicated across relations,
+            # in the priority order below.
+            in_acc = 0
+            exp_acc = 0
+            for R in [
+                'xAttr', 'xIntent', 'xNeed', 'xReact', 'xWant', 'xEffect'
+            ]:
+                in_cs[R] = vocab.diff_bits(in_cs[R], in_acc)
+                in_acc |= vocab.bits(in_cs[R])
+                if exp_cs is not None:
+                    exp_cs[R] = vocab.diff_bits(exp_cs[R], exp_acc)
+                    exp_acc |= vocab.bits(exp_cs[R])
+            cs_pairs.append((in_cs, exp_cs))
+        return cs_pairs
+
+    def _dedupe_comet_overlap(self, in_cs, exp_cs):
+        """The steps of `remove_comet_overlap` before the contradiction
+        checks.
+        """
+        # Preprocess.
         in_cs = {
-            R: obts_unique([
+            R: [
                 self.preproc_obt(obt, R)
                 for obt in obts
-                if obt != 'none' and len(obt.strip()) > 0])
+                if obt != 'none' and len(obt.strip()) > 0
+            ]
             for R, obts in in_cs.items()
         }
         if exp_cs is not None and len(exp_cs['xAttr']) == 0:
             exp_cs = None
         if exp_cs is not None:
             exp_cs = {
-                R: obts_unique([
+                R: [
                     self.preproc_obt(obt, R)
                     for obt in obts
-                    if obt != 'none' and len(obt.strip()) > 0])
+                    if obt != 'none' and len(obt.strip()) > 0
+                ]
                 for R, obts in exp_cs.items()
             }
 
+        # Objects are only ever compared with objects of the same event and
+        # expectation, so the comparisons are computed once for all of them.
+        vocab = ObtVocabulary([
+            obt
+            for cs in [in_cs] + ([exp_cs] if exp_cs is not None else [])
+            for obts in cs.values() for obt in obts
+        ])
+
+        # Dedupe individually.
+        in_cs = {R: vocab.unique(obts) for R, obts in in_cs.items()}
+        if exp_cs is not None:
+            exp_cs = {R: vocab.unique(obts) for R, obts in exp_cs.items()}
+
         if exp_cs is not None:
             # Get suspect objects.
             common_cs = {
-                R: obts_inters(in_cs[R], exp_cs[R]) for R in in_cs.keys()
+                R: vocab.inters(in_cs[R], exp_cs[R]) for R in in_cs.keys()
             }
             # in_cs = {R: [obt for obt in obts if not obt_in(obt, common_cs[R])]
             #          for R, obts in in_cs.items()}
             exp_cs = {
-                R: [obt for obt in obts if not obt_in(obt, common_cs[R])]
+                R: vocab.diff(obts, common_cs[R])
                 for R, obts in exp_cs.items()
             }
 
         if exp_cs is not None and len(exp_cs['xAttr']) == 0:
             exp_cs = None
-        # Reference sentences built from xAttr obts.
-        in_ref_sent = gen_sentence('xAttr', in_cs['xAttr'][:5])
-        if exp_cs is not None:
-            exp_ref_sent = gen_sentence('xAttr', exp_cs['xAttr'][:5])
-
-        # Remove obts that contradict with xAttr obts.
-        in_cs = {
-            R: [
-                obt
-                for obt in obts
-                if not self.sents_contradict(
-                    in_ref_sent, gen_sentence(R, [obt])
-                )]
-            for R, obts in in_cs.items()
-        }
-        if exp_cs is not None:
-            exp_cs = {
-                R: [
-                    obt
-                    for obt in obts
-                    if not self.sents_contradict(
-                        exp_ref_sent, gen_sentence(R, [obt])
-                    )]
-                for R, obts in exp_cs.items()
-            }
-
-        # Remove obts that are duplicated across relations,
-        # in the priority order below.
-        in_acc = set()
-        exp_acc = set()
-        for R in ['xAttr', 'xIntent', 'xNeed', 'xReact', 'xWant', 'xEffect']:
-            in_cs[R] = obts_diff(in_cs[R], in_acc)
-            in_acc.update(in_cs[R])
-            if exp_cs is not None:
-                exp_cs[R] = obts_diff(exp_cs[R], exp_acc)
-                exp_acc.update(exp_cs[R])
-
-        return in_cs, exp_cs
+        return vocab, in_cs, exp_cs
 
     @classmethod
-    def default(cls):
+    def default(cls, cache=None, sentiment_analyser=None):
+        """Args:
+            cache (`max.cache.Cache`):
+                if set, the backend of the caches of COMET outputs and
+                sentiment scores
+            sentiment_analyser (`SentimentAnalyser`):
+                the analyser to use, e.g. a
+                `sentiment_service.SentimentClient` sharing the model of
+                another process; defaults to loading the model
+        """
+        functions = comet_functions()
         valid_relation_types = {
             'xIntent', 'xNeed', 'xAttr', 'xWant', 'xReact', 'xWant', 'xEffect'
         }
-        opt, state_dict = functions.load_model_file(str(
+        model_path = \
             COMET_PATH / 'pretrained_models' / 'atomic_pretrained_model.pickle'
-        ))
+        opt, state_dict = functions.load_model_file(str(model_path))
         if opt.data.get("maxe1", None) is None:
             opt.data.maxe1 = 17
             opt.data.maxe2 = 35
@@ -246,16 +287,30 @@ class CometCommonsenseBuilder(CommonsenseBuilder):
         model = functions.make_model(opt, n_vocab, n_ctx, state_dict)
         model = model.to(DEVICE)
         spacy_processor = spacy.load('en_core_web_sm')
-        sentiment_analyser = SentimentAnalyser.default()
+        if sentiment_analyser is None:
+            sentiment_analyser = SentimentAnalyser.default(cache=cache)
+        if cache is not None:
+            cache = cache.namespace(
+                'comet', file_version(model_path),
+                sorted(valid_relation_types)
+            )
         return cls(
             model, data_loader, text_encoder, valid_relation_types, opt,
-            spacy_processor, sentiment_analyser
+            spacy_processor, sentiment_analyser, cache=cache
         )
 
 
+@functools.lru_cache(maxsize=2 ** 16)
+def obt_key(obt):
+    """The words of `obt` that are not stop words, which `obt_eq`
+    compares.
+    """
+    return ' '.join([tok for tok in obt.split() if tok not in STOP_WORDS])
+
+
 def obt_eq(o1, o2):
-    o1 = ' '.join([tok for tok in o1.split() if tok not in STOP_WORDS])
-    o2 = ' '.join([tok for tok in o2.split() if tok not in STOP_WORDS])
+    o1 = obt_key(o1)
+    o2 = obt_key(o2)
     return o1 == o2\
         or o1.startswith(o2) or o2.startswith(o1)\
         or o1.endswith(o2) or o2.endswith(o1)
@@ -281,6 +336,81 @@ def obts_unique(obts):
     return unique
 
 
+class ObtVocabulary:
+    """Integer IDs for a set of objects, with, for each ID, the bitset of
+    the IDs of the objects it is equal to in the sense of `obt_eq`.
+
+    `obt_eq` compares the keys of two objects (see `obt_key`) as prefixes
+    and suffixes of each other. Rather than comparing every pair, the
+    prefixes and suffixes of each key are looked up among the keys.
+    Membership tests against a list of objects are then a bitwise and with
+    the bitset of that list.
+
+    Args:
+        obts (`List[str]`):
+            the objects; all the objects passed to the methods must be
+            among them
+    """
+    def __init__(self, obts):
+        self.ids = {}
+        keys = []
+        for obt in obts:
+            if obt not in self.ids:
+                self.ids[obt] = len(keys)
+                keys.append(obt_key(obt))
+
+        key_bits = {}
+        for i, key in enumerate(keys):
+            key_bits[key] = key_bits.get(key, 0) | 1 << i
+        # Each key is equal to itself, to the keys among its prefixes and
+        # suffixes, and, symmetrically, to the keys it is an affix of.
+        key_to_eq_bits = dict(key_bits)
+        for key, bits in key_bits.items():
+            for j in range(len(key)):
+                for affix in (key[:j], key[j + 1:]):
+                    if affix in key_bits:
+                        key_to_eq_bits[key] |= key_bits[affix]
+                        key_to_eq_bits[affix] |= bits
+        self.eq_bits = [key_to_eq_bits[key] for key in keys]
+
+    def bits(self, obts):
+        """The bitset of the IDs of `obts`."""
+        bits = 0
+        for obt in obts:
+            bits |= 1 << self.ids[obt]
+        return bits
+
+    def eq_any(self, obt, bits):
+        """Same as `obt_in`, against the objects whose IDs are in `bits`."""
+        return self.eq_bits[self.ids[obt]] & bits != 0
+
+    def unique(self, obts):
+        """Same as `obts_unique`."""
+        unique = []
+        unique_bits = 0
+        for obt in obts:
+            if obt != 'none' and len(obt) > 0 \
+                    and not self.eq_any(obt, unique_bits):
+                unique.append(obt)
+                unique_bits |= 1 << self.ids[obt]
+        return unique
+
+    def inters(self, obts1, obts2):
+        """Same as `obts_inters`."""
+        bits = self.bits(obts2)
+        return [obt for obt in obts1 if self.eq_any(obt, bits)]
+
+    def diff(self, obts1, obts2):
+        """Same as `obts_diff`."""
+        return self.diff_bits(obts1, self.bits(obts2))
+
+    def diff_bits(self, obts, bits):
+        """Same as `obts_diff`, against the objects whose IDs are in
+        `bits`.
+        """
+        return [obt for obt in obts if not self.eq_any(obt, bits)]
+
+
 def and_join(obts):
     if len(obts) == 1:
         return obts[0]
@@ -0,0 +1,304 @@
+import json
+import logging
+import pathlib
+import threading
+import zlib
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import spacy
+
+from .atomic_builder import normalize_event, read_atomic_csv
+from .builder import FallbackCommonsenseBuilder
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+EMBEDDING_DIM = 512
+# Lemmas that negate a normalized event.
+NEGATIONS = {'not', "n't", 'never', 'no'}
+
+
+def embed_text(text, dim=EMBEDDING_DIM):
+    """Embed a normalized event (see `normalize_event`) as an L2-normalized
+    bag of hashed word unigrams, word bigrams and character trigrams.
+
+    The embedding is cheap to compute and deterministic across processes,
+    so vectors can be persisted and compared between runs.
+    """
+    words = text.split()
+    features = list(words)
+    features.extend(' '.join(pair) for pair in zip(words, words[1:]))
+    for word in words:
+        padded = f'#{word}#'
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        h = zlib.crc32(feature.encode('utf-8'))
+        # Use one bit of the hash for the sign to reduce collision bias.
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def is_negated(key):
+    """Whether the normalized event `key` is negated, e.g.
+    "personx do not win the race".
+    """
+    return sum(tok in NEGATIONS for tok in key.split()) % 2 == 1
+
+
+class EventVectorIndex:
+    """A persistent nearest-neighbour index from normalized events to raw
+    relation objects.
+
+    On disk, the index is a directory with three files:
+        `vectors.f32`: the event vectors, one float32 row per event,
+            memory-mapped when loaded;
+        `entries.jsonl`: one {"key": ..., "obts": ...} line per event, in the
+            same order as the vectors;
+        `meta.json`: the vector dimension and the number of saved events.
+            Written last, so a partially written save is ignored on load.
+
+    Events added after loading are kept in memory until `save` appends them.
+    """
+    def __init__(self, index_dir, dim=EMBEDDING_DIM):
+        self.index_dir = pathlib.Path(index_dir)
+        self.dim = dim
+        self.keys = []
+        self.obts = []
+        self.key_to_row = {}
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.pending_vectors = []
+        self.num_saved = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, vector, obts):
+        """Insert an event; does nothing if `key` is already indexed."""
+        if key in self.key_to_row:
+            return
+        self.key_to_row[key] = len(self.keys)
+        self.keys.append(key)
+        self.obts.append(obts)
+        self.pending_vectors.append(vector.astype(np.float32))
+
+    def search(self, vector, k=1):
+        """Return the `k` most similar events as (similarity, key, obts)
+        tuples, most similar first. Similarity is the cosine similarity.
+        """
+        if len(self.keys) == 0:
+            return []
+        scores = self.vectors @ vector
+        if len(self.pending_vectors) > 0:
+            scores = np.concatenate(
+                [scores, np.stack(self.pending_vectors) @ vector]
+            )
+        k = min(k, len(scores))
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows])]
+        return [
+            (float(scores[row]), self.keys[row], self.obts[row])
+            for row in rows
+        ]
+
+    def preload(self):
+        """Read the memory-mapped vectors into the page cache."""
+        if len(self.vectors) > 0:
+            np.asarray(self.vectors).sum()
+
+    def save(self):
+        """Append the events added since the last save to the index files."""
+        if len(self.pending_vectors) == 0 and self.num_saved > 0:
+            return
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.index_dir / 'vectors.f32', 'ab') as fp:
+            for vector in self.pending_vectors:
+                fp.write(vector.tobytes())
+        entries_path = self.index_dir / 'entries.jsonl'
+        with open(entries_path, 'a', encoding='utf-8') as fp:
+            for row in range(self.num_saved, len(self.keys)):
+                json.dump(
+                    {"key": self.keys[row], "obts": self.obts[row]}, fp
+                )
+                fp.write('\n')
+        with open(self.index_dir / 'meta.json', 'w', encoding='utf-8') as fp:
+            json.dump({"dim": self.dim, "count": len(self.keys)}, fp)
+        self.num_saved = len(self.keys)
+        self.pending_vectors = []
+        self._map_vectors()
+        logger.info(f"Saved {self.num_saved} events to {self.index_dir}")
+
+    def _map_vectors(self):
+        if self.num_saved == 0:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            return
+        self.vectors = np.memmap(
+            self.index_dir / 'vectors.f32', dtype=np.float32, mode='r',
+            shape=(self.num_saved, self.dim)
+        )
+
+    @classmethod
+    def load(cls, index_dir):
+        """Load the index at `index_dir`, or create an empty one if
+        `index_dir` does not contain an index yet.
+        """
+        index_dir = pathlib.Path(index_dir)
+        if not (index_dir / 'meta.json').exists():
+            return cls(index_dir)
+        with open(index_dir / 'meta.json', 'r', encoding='utf-8') as fp:
+            meta = json.load(fp)
+        index = cls(index_dir, dim=meta['dim'])
+        with open(index_dir / 'entries.jsonl', 'r', encoding='utf-8') as fp:
+            for line, _ in zip(fp, range(meta['count'])):
+                entry = json.loads(line)
+                index.key_to_row[entry['key']] = len(index.keys)
+                index.keys.append(entry['key'])
+                index.obts.append(entry['obts'])
+        index.num_saved = meta['count']
+        index._truncate_to_saved()
+        index._map_vectors()
+        logger.info(f"Loaded {len(index)} events from {index_dir}")
+        return index
+
+    def _truncate_to_saved(self):
+        # Drop the tail of an interrupted save, so that the next save
+        # appends at the right offsets.
+        vectors_path = self.index_dir / 'vectors.f32'
+        num_bytes = self.num_saved * self.dim * np.dtype(np.float32).itemsize
+        if vectors_path.stat().st_size > num_bytes:
+            with open(vectors_path, 'r+b') as fp:
+                fp.truncate(num_bytes)
+        entries_path = self.index_dir / 'entries.jsonl'
+        with open(entries_path, 'r+b') as fp:
+            for _ in range(self.num_saved):
+                fp.readline()
+            fp.truncate()
+
+
+class RetrievalCommonsenseBuilder(FallbackCommonsenseBuilder):
+    """Serves relation objects of the most similar previously seen event.
+
+    Inputs are normalized (see `normalize_event`) and embedded (see
+    `embed_text`). If the nearest event in the index with the same polarity
+    (see `is_negated`) is at least `threshold` similar, its relation
+    objects are reused: the embedding is lexical, so an event and its
+    negation, whose relation objects are opposite, are close. Otherwise
+    the fallback builder is queried and, if `insert_misses` is set, its
+    output is inserted into the index, which is saved every `save_every`
+    insertions.
+    """
+    def __init__(
+        self, index, spacy_processor, fallback_builder, threshold=0.9,
+        insert_misses=True, save_every=100, num_neighbours=5
+    ):
+        super().__init__(fallback_builder)
+        self.index = index
+        self.spacy_processor = spacy_processor
+        self.threshold = threshold
+        self.insert_misses = insert_misses
+        self.save_every = save_every
+        # Neighbours searched for one with the same polarity.
+        self.num_neighbours = num_neighbours
+        # Guards the index, which concurrent requests (see
+        # `max.coalescing`) search and insert into.
+        self._lock = threading.Lock()
+
+    def _key(self, input):
+        return normalize_event(self.spacy_processor(input))
+
+    def lookup(self, input) -> Optional[Dict[str, List[str]]]:
+        return self._lookup_key(self._key(input))
+
+    def _lookup_key(self, key) -> Optional[Dict[str, List[str]]]:
+        negated = is_negated(key)
+        vector = embed_text(key, self.index.dim)
+        with self._lock:
+            neighbours = self.index.search(vector, k=self.num_neighbours)
+        for similarity, neighbour_key, obts in neighbours:
+            if similarity < self.threshold:
+                return None
+            if is_negated(neighbour_key) == negated:
+                logger.debug(
+                    f'Reusing commonsense of "{neighbour_key}" for "{key}" '
+                    f'(similarity {similarity:.3f})'
+                )
+                return obts
+        return None
+
+    def build_comet_commonsense(self, input, sampling):
+        # The key is computed once, for the lookup and the insertion.
+        key = self._key(input)
+        outputs = self._lookup_key(key)
+        if outputs is not None:
+            self.num_hits += 1
+            # Copy the lists, since postprocessing must not alter the index.
+            return {R: list(obts) for R, obts in outputs.items()}
+        self.num_misses += 1
+        logger.debug(f"{type(self).__name__} miss: {input}")
+        outputs = self.fallback_builder.build_comet_commonsense(
+            input, sampling
+        )
+        if self.insert_misses:
+            vector = embed_text(key, self.index.dim)
+            obts = {R: list(obts) for R, obts in outputs.items()}
+            with self._lock:
+                self.index.add(key, vector, obts)
+                if len(self.index.pending_vectors) >= self.save_every:
+                    self.index.save()
+        return outputs
+
+    def build_comet_commonsense_batch(self, inputs, sampling):
+        # One input at a time, so that the misses inserted for an input can
+        # be reused for the following ones, as without batching.
+        return [
+            self.build_comet_commonsense(input, sampling) for input in inputs
+        ]
+
+    def save(self):
+        with self._lock:
+            self.index.save()
+
+    def preload(self):
+        self.index.preload()
+
+    @classmethod
+    def default(cls, index_dir, fallback_builder=None, threshold=0.9):
+        if fallback_builder is None:
+            from .comet_builder import CometCommonsenseBuilder
+            fallback_builder = CometCommonsenseBuilder.default()
+        index = EventVectorIndex.load(index_dir)
+        spacy_processor = spacy.load('en_core_web_sm')
+        return cls(
+            index, spacy_processor, fallback_builder, threshold=threshold
+        )
+
+
+def build_retrieval_index(atomic_csv_paths, index_dir, spacy_processor=None):
+    """Add the ATOMIC events in `atomic_csv_paths` to the vector index at
+    `index_dir`, creating it if needed.
+    """
+    if spacy_processor is None:
+        spacy_processor = spacy.load('en_core_web_sm')
+    index = EventVectorIndex.load(index_dir)
+
+    event_to_obts = {}
+    for atomic_csv_path in atomic_csv_paths:
+        logger.info(f"Reading {atomic_csv_path}")
+        for event, obts in read_atomic_csv(atomic_csv_path).items():
+            event_to_obts.setdefault(event, obts)
+
+    events = list(event_to_obts.keys())
+    logger.info(f"Embedding {len(events)} events")
+    for event, sp_obt in zip(
+        events, spacy_processor.pipe(events, batch_size=256)
+    ):
+        key = normalize_event(sp_obt)
+        index.add(key, embed_text(key, index.dim), event_to_obts[event])
+    index.save()
+    return index
@@ -2,12 +2,17 @@ import csv
 import numpy as np
 import urllib.request
 
+from typing import Iterator, List, Optional
+
 import torch
 
 from transformers import AutoModelForSequenceClassification
 from transformers import AutoTokenizer
 from scipy.special import softmax
 
+from max.cache import get_or_compute_many
+from max.resources import torch_threads
+
 
 TASK = "sentiment"
 MODEL = f"cardiffnlp/twitter-roberta-base-{TASK}"
@@ -30,14 +35,47 @@ def preprocess_text(text):
     return " ".join(processed_tokens)
 
 
+def length_bucketed_batches(
+    lengths: List[int], batch_size: int, max_tokens: Optional[int] = None
+) -> Iterator[List[int]]:
+    """Group the indices of texts with the given token lengths into
+    batches of texts with similar lengths, so that padding each batch to
+    its own longest text wastes little computation.
+
+    Indices are sorted by length, then cut into consecutive batches of at
+    most `batch_size` texts and, if set, at most `max_tokens` tokens after
+    padding. Within each batch, indices are sorted by length.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batch = []
+    for i in order:
+        # Lengths are increasing, so the padded size is set by text i.
+        if len(batch) > 0 and (
+            len(batch) == batch_size
+            or (max_tokens is not None
+                and (len(batch) + 1) * lengths[i] > max_tokens)
+        ):
+            yield batch
+            batch = []
+        batch.append(i)
+    if len(batch) > 0:
+        yield batch
+
+
 class SentimentAnalyser:
-    def __init__(self, model, tokenizer, labels):
+    def __init__(
+        self, model, tokenizer, labels, num_threads=None, cache=None
+    ):
         self.model = model
         self.tokenizer = tokenizer
         self.labels = labels
+        # Intra-op threads for the model; None for the PyTorch default.
+        self.num_threads = num_threads
+        # Optional `max.cache.Cache` of scores, keyed by preprocessed text.
+        self.cache = cache
 
     @classmethod
-    def default(cls):
+    def default(cls, cache=None):
         model = AutoModelForSequenceClassification.from_pretrained(
             MODEL
         ).to(DEVICE)
@@ -49,14 +87,26 @@ class SentimentAnalyser:
                 html, delimiter='\t', fieldnames=["index", "polarity"]
             )
         labels = [row["polarity"] for row in reader if len(row) > 1]
-        return cls(model, tokenizer, labels)
-
-    def get_sentiment(self, text, excluded=['neutral']):
-        text = preprocess_text(text)
+        if cache is not None:
+            cache = cache.namespace('sentiment', MODEL, labels)
+        return cls(model, tokenizer, labels, cache=cache)
+
+    def get_scores(self, text):
+        """Return the softmax scores of `text`."""
+        return get_or_compute_many(
+            self.cache, [preprocess_text(text)],
+            lambda texts: [self._score(texts[0])]
+        )[0]
+
+    def _score(self, text):
         encoded_input = self.tokenizer(text, return_tensors='pt').to(DEVICE)
-        output = self.model(**encoded_input)
+        with torch.no_grad(), torch_threads(self.num_threads):
+            output = self.model(**encoded_input)
         scores = output[0][0].detach().cpu().numpy()
-        scores = softmax(scores)
+        return softmax(scores)
+
+    def get_sentiment(self, text, excluded=['neutral']):
+        scores = self.get_scores(text)
 
         ranking = np.argsort(scores)[::-1]
         for rank in ranking:
@@ -64,15 +114,71 @@ class SentimentAnalyser:
                 return self.labels[rank]
 
     def get_sentiment_dist(self, text):
-        text = preprocess_text(text)
-        encoded_input = self.tokenizer(text, return_tensors='pt').to(DEVICE)
-        output = self.model(**encoded_input)
-        scores = output[0][0].detach().cpu().numpy()
-        scores = softmax(scores)
+        scores = self.get_scores(text)
 
         ranking = np.argsort(scores)[::-1]
         return [(self.labels[rank], scores[rank]) for rank in ranking]
 
+    def get_scores_batch(self, texts, batch_size=32, max_tokens=None):
+        """Return the softmax scores of each text, in the order of `texts`.
+
+        Texts are looked up in `self.cache`, if set. The others are
+        scheduled in length buckets (see `length_bucketed_batches`) and each
+        batch is padded only to its own longest text.
+        """
+        return get_or_compute_many(
+            self.cache, [preprocess_text(text) for text in texts],
+            lambda texts: self._score_batch(texts, batch_size, max_tokens)
+        )
+
+    def _score_batch(self, texts, batch_size, max_tokens):
+        if len(texts) == 0:
+            return []
+        lengths = [
+            len(input_ids) for input_ids in self.tokenizer(texts)['input_ids']
+        ]
+        scores = [None] * len(texts)
+        for batch in length_bucketed_batches(lengths, batch_size, max_tokens):
+            encoded_input = self.tokenizer(
+                [texts[i] for i in batch], padding=True, return_tensors='pt'
+            ).to(DEVICE)
+            with torch.no_grad(), torch_threads(self.num_threads):
+                output = self.model(**encoded_input)
+            batch_scores = softmax(output[0].cpu().numpy(), axis=1)
+            for i, text_scores in zip(batch, batch_scores):
+                scores[i] = text_scores
+        return scores
+
+    def get_sentiment_batch(
+        self, texts, excluded=['neutral'], batch_size=32, max_tokens=None
+    ):
+        """Same as `get_sentiment`, for a list of texts scored in length
+        buckets. Returns one label per text, in the order of `texts`.
+        """
+        sentiments = []
+        for scores in self.get_scores_batch(texts, batch_size, max_tokens):
+            ranking = np.argsort(scores)[::-1]
+            sentiments.append(next(
+                (
+                    self.labels[rank] for rank in ranking
+                    if self.labels[rank] not in excluded
+                ),
+                None
+            ))
+        return sentiments
+
+    def get_sentiment_dist_batch(self, texts, batch_size=32, max_tokens=None):
+        """Same as `get_sentiment_dist`, for a list of texts scored in
+        length buckets.
+        """
+        dists = []
+        for scores in self.get_scores_batch(texts, batch_size, max_tokens):
+            ranking = np.argsort(scores)[::-1]
+            dists.append([
+                (self.labels[rank], scores[rank]) for rank in ranking
+            ])
+        return dists
+
 
 if __name__ == "__main__":
     analyser = SentimentAnalyser.default()
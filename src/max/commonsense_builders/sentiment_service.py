@@ -0,0 +1,310 @@
+"""A sentiment model shared by the processes of a host.
+
+`SentimentServer` hosts one `SentimentAnalyser` behind a Unix socket and
+scores the texts of concurrent requests together; `SentimentClient` is a
+drop-in `SentimentAnalyser` that sends its texts to the server instead of
+loading the model, so N worker processes hold one copy of the weights
+instead of N.
+
+Messages are json, prefixed with their length as a 4-byte big-endian
+integer. A request is either {"texts": [...]}, answered with
+{"scores": [[...], ...]}, or {"labels": true}, answered with
+{"labels": [...]}; failures are answered with {"error": "..."}.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from .sentiment_analyser import SentimentAnalyser
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+LENGTH = struct.Struct('>I')
+
+
+def _send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(LENGTH.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, num_bytes):
+    chunks = []
+    while num_bytes > 0:
+        chunk = sock.recv(num_bytes)
+        if len(chunk) == 0:
+            return None
+        chunks.append(chunk)
+        num_bytes -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv_message(sock):
+    header = _recv_exactly(sock, LENGTH.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, LENGTH.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.done = threading.Event()
+        self.scores = None
+        self.error = None
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            message = _recv_message(self.request)
+            if message is None:
+                return
+            if message.get('labels'):
+                _send_message(
+                    self.request,
+                    {'labels': server.sentiment_analyser.labels}
+                )
+                continue
+            request = _Request(message['texts'])
+            server.requests.put(request)
+            request.done.wait()
+            if request.error is not None:
+                _send_message(self.request, {'error': request.error})
+            else:
+                _send_message(self.request, {'scores': request.scores})
+
+
+class SentimentServer(socketserver.ThreadingUnixStreamServer):
+    """Serves the scores of `sentiment_analyser` on the Unix socket
+    `socket_path`.
+
+    Each connection is served by its own thread, which queues its requests;
+    a single batching thread runs the model on the texts of all the
+    requests queued within `max_wait` seconds of the first one, up to
+    `max_batch_size` texts, with `SentimentAnalyser.get_scores_batch`.
+
+    Args:
+        sentiment_analyser (`SentimentAnalyser`):
+            the analyser whose model is shared
+        socket_path (`str`):
+            the path of the socket; a stale socket file there is replaced
+        max_batch_size (`int`):
+            the maximum number of texts scored together
+        max_wait (`float`):
+            how long, in seconds, a request waits for others to batch with
+    """
+    daemon_threads = True
+
+    def __init__(
+        self, sentiment_analyser, socket_path, max_batch_size=256,
+        max_wait=0.002
+    ):
+        self.sentiment_analyser = sentiment_analyser
+        self.socket_path = str(socket_path)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.num_requests = 0
+        self.num_batches = 0
+        pathlib.Path(self.socket_path).unlink(missing_ok=True)
+        super().__init__(self.socket_path, _Handler)
+        self._batcher = threading.Thread(
+            target=self._run_batches, name="sentiment-batcher", daemon=True
+        )
+        self._batcher.start()
+        self._serve_thread = None
+
+    def _next_batch(self):
+        requests = [self.requests.get()]
+        if requests[0] is None:
+            return None
+        num_texts = len(requests[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        while num_texts < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Stop once this batch is answered.
+                self.requests.put(None)
+                break
+            requests.append(request)
+            num_texts += len(request.texts)
+        return requests
+
+    def _run_batches(self):
+        while True:
+            requests = self._next_batch()
+            if requests is None:
+                return
+            texts = [text for request in requests for text in request.texts]
+            try:
+                scores = self.sentiment_analyser.get_scores_batch(texts)
+                scores = iter([
+                    [float(score) for score in text_scores]
+                    for text_scores in scores
+                ])
+                for request in requests:
+                    request.scores = [next(scores) for _ in request.texts]
+            except Exception as e:
+                logger.exception("Sentiment scoring failed")
+                for request in requests:
+                    request.error = f"{type(e).__name__}: {e}"
+            self.num_requests += len(requests)
+            self.num_batches += 1
+            for request in requests:
+                request.done.set()
+
+    def start(self):
+        """Serve in a background thread."""
+        self._serve_thread = threading.Thread(
+            target=self.serve_forever, name="sentiment-server", daemon=True
+        )
+        self._serve_thread.start()
+        return self
+
+    def close(self):
+        if self._serve_thread is not None:
+            self.shutdown()
+            self._serve_thread.join()
+        self.requests.put(None)
+        self._batcher.join()
+        self.server_close()
+        pathlib.Path(self.socket_path).unlink(missing_ok=True)
+        logger.info(
+            f"Sentiment server: {self.num_requests} requests in "
+            f"{self.num_batches} batches"
+        )
+
+
+class SentimentClient(SentimentAnalyser):
+    """A `SentimentAnalyser` whose texts are scored by a `SentimentServer`
+    listening on `socket_path`.
+
+    Each process opens its own connection on first use, so a client
+    created before worker processes are forked, or pickled to them, can be
+    used in all of them. Scores can still be cached locally, in `cache`.
+    """
+    def __init__(self, socket_path, cache=None, timeout=60.0):
+        self.socket_path = str(socket_path)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._pid = None
+        labels = self._request({'labels': True})['labels']
+        super().__init__(None, None, labels, cache=cache)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_sock'] = None
+        state['_pid'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _request(self, message):
+        with self._lock:
+            if self._sock is None or self._pid != os.getpid():
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.settimeout(self.timeout)
+                self._sock.connect(self.socket_path)
+                self._pid = os.getpid()
+            try:
+                _send_message(self._sock, message)
+                reply = _recv_message(self._sock)
+            except OSError:
+                self._close()
+                raise
+            if reply is None:
+                self._close()
+                raise ConnectionError(
+                    f"Sentiment server at {self.socket_path} closed the "
+                    "connection"
+                )
+        if 'error' in reply:
+            raise RuntimeError(f"Sentiment server error: {reply['error']}")
+        return reply
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _score(self, text):
+        return self._score_batch([text], None, None)[0]
+
+    def _score_batch(self, texts, batch_size, max_tokens):
+        # Batch sizes are the server's.
+        if len(texts) == 0:
+            return []
+        scores = self._request({'texts': texts})['scores']
+        return [np.array(text_scores) for text_scores in scores]
+
+
+def serve_sentiment(socket_path, max_batch_size=256, max_wait=0.002):
+    """Load the default sentiment model and serve it on `socket_path`
+    until the process is terminated.
+    """
+    server = SentimentServer(
+        SentimentAnalyser.default(), socket_path,
+        max_batch_size=max_batch_size, max_wait=max_wait
+    )
+    logger.info(f"Serving sentiment scores on {socket_path}")
+    server.serve_forever()
+
+
+def start_sentiment_process(socket_path, timeout=600.0, **kwargs):
+    """Run `serve_sentiment` in a child process, and wait until it accepts
+    connections.
+
+    Returns:
+        `multiprocessing.Process`: the server process; terminate it once
+            done
+    """
+    pathlib.Path(socket_path).unlink(missing_ok=True)
+    process = multiprocessing.Process(
+        target=serve_sentiment, args=(str(socket_path),), kwargs=kwargs,
+        name="sentiment-server", daemon=True
+    )
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        if not process.is_alive():
+            raise RuntimeError("The sentiment server failed to start")
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(str(socket_path))
+            return process
+        except OSError:
+            if time.monotonic() > deadline:
+                process.terminate()
+                raise TimeoutError(
+                    f"The sentiment server did not start in {timeout}s"
+                )
+            time.sleep(0.1)
@@ -4,13 +4,23 @@ import pathlib
 import lemminflect
 import spacy
 
+from max.cache import file_version, get_or_compute_many
 from .extractor import ExpectationExtractor
 
 
+# Bumped when the extraction rules change, so that cached expectations
+# are not reused.
+CACHE_VERSION = 1
+
+
 class PatternNegationExpectationExtractor(ExpectationExtractor):
-    def __init__(self, antonyms_tsv_path):
+    def __init__(self, antonyms_tsv_path, n_process=1, cache=None):
         self.spacy_processor = self._init_spacy()
         self.word_to_antonym = self._read_antonyms_tsv(antonyms_tsv_path)
+        # Number of processes used by spacy in `extract_expectations_batch`.
+        self.n_process = n_process
+        # Optional `max.cache.Cache` of expectations.
+        self.cache = cache
 
     def _init_spacy(self):
         spacy_processor = spacy.load('en_core_web_sm')
@@ -65,7 +75,35 @@ class PatternNegationExpectationExtractor(ExpectationExtractor):
                 a list of possible expectations, such as
                 ["Ben did not win the marathon", "Ben lost the marathon"].
         """
-        sp_obt = self.spacy_processor(event)
+        return self.extract_expectations_batch([event], use_antonyms)[0]
+
+    def extract_expectations_batch(
+        self, events, use_antonyms=False, batch_size=64
+    ):
+        """Same as `extract_expectations`, for a list of events. Events are
+        looked up in `self.cache`, if set; the others are processed together
+        by spacy, using `self.n_process` processes.
+        """
+        expectation_lsts = get_or_compute_many(
+            self.cache, events,
+            lambda events: self._extract(events, use_antonyms, batch_size),
+            key=lambda event: f"{use_antonyms}\n{event}"
+        )
+        # Cached lists may be shared, and callers may modify theirs.
+        return [list(expectations) for expectations in expectation_lsts]
+
+    def _extract(self, events, use_antonyms, batch_size):
+        if len(events) == 1:
+            sp_obts = [self.spacy_processor(events[0])]
+        else:
+            sp_obts = self.spacy_processor.pipe(
+                events, batch_size=batch_size, n_process=self.n_process
+            )
+        return [
+            self._extract_from_doc(sp_obt, use_antonyms) for sp_obt in sp_obts
+        ]
+
+    def _extract_from_doc(self, sp_obt, use_antonyms):
         expectations = []
 
         log_summary = [(w.text, w.pos_, w.tag_) for w in sp_obt]
@@ -261,13 +299,20 @@ class PatternNegationExpectationExtractor(ExpectationExtractor):
         return expectations
 
     @classmethod
-    def default(cls):
+    def default(cls, n_process=1, cache=None):
         antonyms_tsv_path = (
             # /src/max/expectation_extractors/ -> /
             pathlib.Path(__file__).absolute().parent.parent.parent.parent
             / 'resources' / "antonyms.tsv"
         )
-        return cls(antonyms_tsv_path)
+        extractor = cls(antonyms_tsv_path, n_process=n_process)
+        if cache is not None:
+            meta = extractor.spacy_processor.meta
+            extractor.cache = cache.namespace(
+                'expectations', CACHE_VERSION, meta['name'], meta['version'],
+                file_version(antonyms_tsv_path)
+            )
+        return extractor
 
 
 def pos_match(sp_obt, pattern):
@@ -0,0 +1,393 @@
+import contextlib
+import functools
+import json
+import logging
+import math
+import os
+import pathlib
+import threading
+import time
+
+from typing import Dict, Optional
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+PERCENTILES = [50, 90, 99]
+
+
+class LatencyHistogram:
+    """A histogram of latencies with a bounded relative error, in the
+    manner of HdrHistogram.
+
+    Latencies are counted in microseconds, in buckets whose width is at
+    most a `2 ** -(precision_bits - 1)` fraction of their lower bound, so
+    percentiles are exact to within about 1.6% by default, with a number of
+    buckets that only grows with the logarithm of the largest latency. The
+    minimum, maximum and mean are exact.
+    """
+    def __init__(self, precision_bits: int = 7):
+        self.precision_bits = precision_bits
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _bucket(self, micros: int) -> int:
+        shift = max(micros.bit_length() - self.precision_bits, 0)
+        # Buckets below 2 ** precision_bits hold one value each; above,
+        # each power of two is split into 2 ** (precision_bits - 1) buckets.
+        return (shift << (self.precision_bits - 1)) + (micros >> shift)
+
+    def _bucket_upper_bound(self, bucket: int) -> float:
+        """The largest latency, in seconds, counted in `bucket`."""
+        half = 1 << (self.precision_bits - 1)
+        shift = max((bucket >> (self.precision_bits - 1)) - 1, 0)
+        mantissa = bucket - (shift << (self.precision_bits - 1))
+        if bucket < 2 * half:
+            return bucket / 1e6
+        return (((mantissa + 1) << shift) - 1) / 1e6
+
+    def record(self, seconds: float):
+        bucket = self._bucket(max(int(seconds * 1e6), 0))
+        with self._lock:
+            self.counts[bucket] = self.counts.get(bucket, 0) + 1
+            self.count += 1
+            self.total += seconds
+            self.min = min(self.min, seconds)
+            self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """The latency, in seconds, that a fraction `q / 100` of the
+        recorded latencies do not exceed, or None if none were recorded.
+        """
+        with self._lock:
+            if self.count == 0:
+                return None
+            # Rounded first, so that e.g. 99.9% of 10000 is 9990, not 9991.
+            rank = max(math.ceil(round(q * self.count / 100, 9)), 1)
+            seen = 0
+            for bucket in sorted(self.counts):
+                seen += self.counts[bucket]
+                if seen >= rank:
+                    return min(self._bucket_upper_bound(bucket), self.max)
+            return self.max
+
+    def fraction_above(self, seconds: float) -> float:
+        """The fraction of the recorded latencies above `seconds`, counting
+        the bucket of `seconds` as below.
+        """
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            limit = self._bucket(max(int(seconds * 1e6), 0))
+            num_above = sum(
+                count for bucket, count in self.counts.items()
+                if bucket > limit
+            )
+            return num_above / self.count
+
+    def merge(self, other: 'LatencyHistogram'):
+        """Add the latencies recorded by `other`, e.g. in another process.
+        """
+        assert other.precision_bits == self.precision_bits
+        with other._lock:
+            counts = dict(other.counts)
+            count, total = other.count, other.total
+            min_, max_ = other.min, other.max
+        with self._lock:
+            for bucket, bucket_count in counts.items():
+                self.counts[bucket] = self.counts.get(bucket, 0) + bucket_count
+            self.count += count
+            self.total += total
+            self.min = min(self.min, min_)
+            self.max = max(self.max, max_)
+
+    def summary(self) -> dict:
+        summary = {'count': self.count}
+        if self.count > 0:
+            summary['mean'] = self.total / self.count
+            for q in PERCENTILES:
+                summary[f'p{q}'] = self.percentile(q)
+            summary['max'] = self.max
+        return summary
+
+    def to_dict(self) -> dict:
+        """The summary and the bucket counts, from which `from_dict`
+        rebuilds the histogram.
+        """
+        with self._lock:
+            buckets = sorted(self.counts.items())
+        return {
+            **self.summary(),
+            'precision_bits': self.precision_bits,
+            'min': self.min if self.count > 0 else None,
+            'total': self.total,
+            'buckets': buckets
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LatencyHistogram':
+        histogram = cls(data['precision_bits'])
+        histogram.counts = {bucket: count for bucket, count in data['buckets']}
+        histogram.count = data['count']
+        histogram.total = data['total']
+        if histogram.count > 0:
+            histogram.min = data['min']
+            histogram.max = data['max']
+        return histogram
+
+
+def size_bucket(size: int) -> str:
+    """The power-of-two range of `size`, e.g. "5-8", for grouping inputs of
+    similar sizes.
+    """
+    if size <= 2:
+        return str(size)
+    upper = 1 << (size - 1).bit_length()
+    return f"{upper // 2 + 1}-{upper}"
+
+
+class LatencyTracker:
+    """Opt-in latency histograms for the stages of `SarcasmGenerator`.
+
+    `instrument` times, each in its own histogram:
+        - `generate_responses` and `generate_responses_batch`, per call;
+        - `build_comet_commonsense`, per input of the outermost commonsense
+          builder, whether answered from a cache, an index or COMET; the
+          inputs of a batch each count for an equal share of its latency;
+        - `comet[words=<n>]`: each COMET decoding, by number of words of
+          the input, and `comet[<relation type>]`: the decoding of each
+          relation type;
+        - `sentiment[texts=<n>]`: each call of the sentiment model, by
+          number of texts.
+
+    If `report_interval` is set, `start` logs a summary (count, mean, p50,
+    p90, p99, max) of each histogram every `report_interval` seconds and,
+    if `export_path` is set, writes the histograms there as json, with
+    their bucket counts so that those of several processes can be merged
+    (see `LatencyHistogram.from_dict`). `stop` reports a last time.
+
+    Args:
+        slo (`float`):
+            optional target latency, in seconds, of `generate_responses`;
+            summaries then include the fraction of events over it
+    """
+    def __init__(
+        self,
+        report_interval: Optional[float] = None,
+        export_path=None,
+        slo: Optional[float] = None,
+        precision_bits: int = 7
+    ):
+        self.report_interval = report_interval
+        self.export_path = pathlib.Path(export_path) \
+            if export_path is not None else None
+        self.slo = slo
+        self.precision_bits = precision_bits
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+        self._patches = []
+        self._local = threading.local()
+        self._stopped = threading.Event()
+        self._reporter = None
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = LatencyHistogram(self.precision_bits)
+                self.histograms[name] = histogram
+            return histogram
+
+    def reset(self):
+        """Forget the latencies recorded so far, e.g. those of a warm-up."""
+        with self._lock:
+            self.histograms = {}
+
+    def record(self, name: str, seconds: float):
+        self.histogram(name).record(seconds)
+
+    @contextlib.contextmanager
+    def time(self, name: str):
+        """Record the latency of the enclosed block in `name`, unless it
+        raises.
+        """
+        start_time = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - start_time)
+
+    def _wrap(self, owner, attr, name, num_items=None):
+        """Time the calls of `owner.attr` in the histogram `name`, or in
+        that which `name` returns given the arguments of the call.
+
+        If `num_items` is set, it returns the number of items of a call
+        given its arguments, and each item is recorded with an equal share
+        of the latency of the call. Calls made within a call timed in the
+        same histogram, in the same thread, are part of it and are not
+        recorded.
+        """
+        fn = getattr(owner, attr)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            histogram_name = \
+                name if isinstance(name, str) else name(*args, **kwargs)
+            active = self._active_names()
+            if histogram_name in active:
+                return fn(*args, **kwargs)
+            active.add(histogram_name)
+            try:
+                start_time = time.perf_counter()
+                result = fn(*args, **kwargs)
+                elapsed = time.perf_counter() - start_time
+            finally:
+                active.discard(histogram_name)
+            count = 1 if num_items is None else num_items(*args, **kwargs)
+            histogram = self.histogram(histogram_name)
+            for _ in range(count):
+                histogram.record(elapsed / count)
+            return result
+
+        # Instance attributes shadow the methods of the class.
+        self._patches.append((owner, attr, owner.__dict__.get(attr)))
+        setattr(owner, attr, wrapper)
+
+    def _active_names(self):
+        """The names of the histograms of the calls being timed in the
+        current thread.
+        """
+        active = getattr(self._local, 'active', None)
+        if active is None:
+            active = self._local.active = set()
+        return active
+
+    def instrument(self, sarcasm_generator):
+        """Wrap the methods of `sarcasm_generator` and of its components
+        that are timed (see the class docstring).
+        """
+        from max.resources import _commonsense_builders
+
+        for attr in ['generate_responses', 'generate_responses_batch']:
+            self._wrap(sarcasm_generator, attr, attr)
+        # Only the outermost builder's commonsense is timed; that of the
+        # builders it falls back to is part of it. Batches, as built by
+        # `generate_responses_batch`, are recorded per input.
+        builder = sarcasm_generator.commonsense_builder
+        self._wrap(
+            builder, 'build_comet_commonsense', 'build_comet_commonsense'
+        )
+        self._wrap(
+            builder, 'build_comet_commonsense_batch',
+            'build_comet_commonsense',
+            num_items=lambda inputs, sampling: len(inputs)
+        )
+        sentiment_analysers = []
+        for builder in _commonsense_builders(sarcasm_generator):
+            if hasattr(builder, 'run_comet'):
+                self._wrap(
+                    builder, 'run_comet',
+                    lambda input, sampling:
+                        f"comet[words={size_bucket(len(input.split()))}]"
+                )
+                self._wrap(
+                    builder, 'run_comet_relation',
+                    lambda input, sampling, relation_type:
+                        f"comet[{relation_type}]"
+                )
+            sentiment_analyser = getattr(builder, 'sentiment_analyser', None)
+            if sentiment_analyser is not None and not any(
+                sentiment_analyser is other for other in sentiment_analysers
+            ):
+                sentiment_analysers.append(sentiment_analyser)
+        for sentiment_analyser in sentiment_analysers:
+            self._wrap(sentiment_analyser, '_score', 'sentiment[texts=1]')
+            self._wrap(
+                sentiment_analyser, '_score_batch',
+                lambda texts, batch_size, max_tokens:
+                    f"sentiment[texts={size_bucket(len(texts))}]"
+            )
+
+    def uninstrument(self):
+        for owner, attr, original in reversed(self._patches):
+            if original is None:
+                delattr(owner, attr)
+            else:
+                setattr(owner, attr, original)
+        self._patches = []
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        summary = {}
+        for name, histogram in histograms:
+            summary[name] = histogram.summary()
+            if name == 'generate_responses' and self.slo is not None:
+                summary[name]['over_slo'] = histogram.fraction_above(
+                    self.slo
+                )
+        return summary
+
+    def log_summary(self):
+        for name, summary in self.summary().items():
+            if summary['count'] == 0:
+                continue
+            line = f"Latency of {name}: {summary['count']} calls"
+            for stat in ['mean'] + [f'p{q}' for q in PERCENTILES] + ['max']:
+                line += f", {stat} {summary[stat] * 1000:.1f}ms"
+            if 'over_slo' in summary:
+                line += (
+                    f", {summary['over_slo']:.2%} over "
+                    f"{self.slo * 1000:.0f}ms"
+                )
+            logger.info(line)
+
+    def export(self, path=None):
+        """Write the histograms to `path`, or `self.export_path`, as json.
+        """
+        path = pathlib.Path(path) if path is not None else self.export_path
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        data = {
+            'time': time.time(),
+            'slo': self.slo,
+            'summary': self.summary(),
+            'histograms': {
+                name: histogram.to_dict() for name, histogram in histograms
+            }
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Readers never see a partly written file.
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(data, indent=2), encoding='utf-8')
+        tmp_path.replace(path)
+
+    def report(self):
+        self.log_summary()
+        if self.export_path is not None:
+            self.export()
+
+    def _run_reporter(self):
+        while not self._stopped.wait(self.report_interval):
+            self.report()
+
+    def start(self):
+        """Report every `report_interval` seconds, in a background thread.
+        """
+        if self.report_interval is not None:
+            self._reporter = threading.Thread(
+                target=self._run_reporter, name="latency-reporter",
+                daemon=True
+            )
+            self._reporter.start()
+        return self
+
+    def stop(self):
+        """Stop reporting, and report a last time."""
+        if self._reporter is not None:
+            self._stopped.set()
+            self._reporter.join()
+            self._reporter = None
+        self.report()
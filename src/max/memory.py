@@ -0,0 +1,117 @@
+import contextlib
+import logging
+import os
+import resource
+import sys
+
+from typing import List, Tuple
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+
+def current_rss():
+    """Resident set size of this process, in bytes."""
+    try:
+        with open('/proc/self/statm', 'r') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # No procfs; fall back to the high-water mark.
+        return peak_rss()
+
+
+def peak_rss():
+    """High-water mark of the resident set size of this process, in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryMonitor:
+    """Samples the resident set size every `every` events and reports the
+    high-water mark of a run.
+    """
+    def __init__(self, every=1000):
+        self.every = every
+        self.num_events = 0
+        self.samples: List[Tuple[int, int]] = [(0, current_rss())]
+
+    def step(self):
+        self.num_events += 1
+        if self.num_events % self.every == 0:
+            rss = current_rss()
+            self.samples.append((self.num_events, rss))
+            logger.info(
+                f"Memory after {self.num_events} events: "
+                f"rss {rss / 2 ** 20:.1f} MB, "
+                f"peak {peak_rss() / 2 ** 20:.1f} MB"
+            )
+
+    def growth_per_event(self, skip_fraction=0.25):
+        """Average rss growth in bytes per event, ignoring the first
+        `skip_fraction` of the samples, during which caches fill up.
+        """
+        samples = self.samples[int(len(self.samples) * skip_fraction):]
+        if len(samples) < 2 or samples[-1][0] == samples[0][0]:
+            return 0.0
+        return (samples[-1][1] - samples[0][1]) \
+            / (samples[-1][0] - samples[0][0])
+
+    def report(self):
+        end_rss = current_rss()
+        # ru_maxrss is sampled by the kernel, so it may lag behind.
+        peak = max([peak_rss(), end_rss] + [rss for _, rss in self.samples])
+        report = {
+            "num_events": self.num_events,
+            "start_rss_mb": self.samples[0][1] / 2 ** 20,
+            "end_rss_mb": end_rss / 2 ** 20,
+            "peak_rss_mb": peak / 2 ** 20,
+            "growth_per_1k_events_mb":
+                self.growth_per_event() * 1000 / 2 ** 20
+        }
+        logger.info(
+            "Memory report: " + ", ".join(
+                f"{key} {value:.1f}" if isinstance(value, float)
+                else f"{key} {value}"
+                for key, value in report.items()
+            )
+        )
+        return report
+
+
+def spacy_processors(sarcasm_generator):
+    """The distinct spacy pipelines used by the components of
+    `sarcasm_generator`.
+    """
+    from max.response_generators import pattern_generator
+
+    extractor = sarcasm_generator.expectation_extractor
+    candidates = [
+        getattr(extractor, 'spacy_processor', None), pattern_generator.nlp
+    ]
+    builder = sarcasm_generator.commonsense_builder
+    while builder is not None:
+        candidates.append(getattr(builder, 'spacy_processor', None))
+        builder = getattr(builder, 'fallback_builder', None)
+
+    processors = []
+    for candidate in candidates:
+        if candidate is not None and \
+                all(candidate is not p for p in processors):
+            processors.append(candidate)
+    return processors
+
+
+@contextlib.contextmanager
+def spacy_memory_zones(spacy_processors):
+    """Free the strings and lexemes that `spacy_processors` add to their
+    vocabularies within the block, so that the vocabularies do not grow
+    with every new event. No Doc created within the block may be used after
+    it.
+    """
+    with contextlib.ExitStack() as stack:
+        for spacy_processor in spacy_processors:
+            if hasattr(spacy_processor, 'memory_zone'):
+                stack.enter_context(spacy_processor.memory_zone())
+        yield
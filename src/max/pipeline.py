@@ -0,0 +1,302 @@
+import logging
+import queue
+import threading
+import time
+
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from max import CommonsenseBuilderResponse
+from max.canonicalization import canonicalize, restore_surface
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+_END = object()
+
+
+class _Failed:
+    """Carries an exception raised by a stage down to the consumer."""
+    def __init__(self, exception):
+        self.exception = exception
+
+
+@dataclass
+class _EventItem:
+    """An event and the intermediate results of the stages it went through.
+    """
+    # The event as given; replaced by its canonical form in the first stage.
+    event: str
+    surface: Optional[str] = None
+    expectation_lst: List[str] = field(default_factory=list)
+    event_cs: Optional[dict] = None
+    exp_cs_lst: List[dict] = field(default_factory=list)
+    cs_obt_lst: List[CommonsenseBuilderResponse] = field(default_factory=list)
+    # Set from the response store, or by the last stage.
+    response_lst: Optional[list] = None
+    # When the event was fed to the pipeline.
+    start_time: float = field(default_factory=time.perf_counter)
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    num_items: int = 0
+    # Seconds spent processing items.
+    busy_time: float = 0.0
+    # Seconds spent waiting for input from the previous stage.
+    starved_time: float = 0.0
+    # Seconds spent waiting for room in the output queue (backpressure).
+    blocked_time: float = 0.0
+    max_queue_size: int = 0
+    start_time: float = 0.0
+    end_time: float = 0.0
+
+    @property
+    def occupancy(self):
+        """Fraction of the stage's lifetime spent processing items."""
+        wall_time = self.end_time - self.start_time
+        return self.busy_time / wall_time if wall_time > 0 else 0.0
+
+    def summary(self):
+        return (
+            f"{self.name}: {self.num_items} items, "
+            f"occupancy {self.occupancy:.0%}, busy {self.busy_time:.2f}s, "
+            f"starved {self.starved_time:.2f}s, "
+            f"blocked {self.blocked_time:.2f}s, "
+            f"max input queue {self.max_queue_size}"
+        )
+
+
+def _put_unless_stopped(out_queue, item, stopped):
+    """Put `item` in `out_queue`, unless `stopped` is set before there is
+    room for it. Returns whether it was put.
+    """
+    while not stopped.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class _Stage(threading.Thread):
+    def __init__(self, name, fn, in_queue, out_queue, stopped):
+        super().__init__(name=f"pipeline-{name}", daemon=True)
+        self.fn = fn
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        # Set when the consumer stops early; items are then passed on
+        # unprocessed until the end of the input.
+        self.stopped = stopped
+        self.metrics = StageMetrics(name)
+
+    def run(self):
+        metrics = self.metrics
+        metrics.start_time = time.perf_counter()
+        while True:
+            t0 = time.perf_counter()
+            metrics.max_queue_size = max(
+                metrics.max_queue_size, self.in_queue.qsize()
+            )
+            item = self.in_queue.get()
+            t1 = time.perf_counter()
+            metrics.starved_time += t1 - t0
+            if item is _END:
+                break
+
+            if not isinstance(item, _Failed) and not self.stopped.is_set():
+                try:
+                    item = self.fn(item)
+                except Exception as e:
+                    item = _Failed(e)
+                metrics.num_items += 1
+            t2 = time.perf_counter()
+            metrics.busy_time += t2 - t1
+
+            self.out_queue.put(item)
+            metrics.blocked_time += time.perf_counter() - t2
+        metrics.end_time = time.perf_counter()
+        self.out_queue.put(_END)
+
+
+class PipelinedSarcasmGenerator:
+    """Runs the stages of `SarcasmGenerator.generate_responses` for
+    successive events concurrently, one worker thread per stage, so that,
+    e.g., spacy extraction for one event overlaps COMET decoding for the
+    previous one.
+
+    The stages are:
+        extract: expectation extraction;
+        comet: raw commonsense for the event and each expectation; the
+            event's commonsense is built once, not once per expectation;
+        postprocess: `remove_comet_overlap`, including sentiment scoring;
+        render: response generation.
+
+    Stages are connected by queues of at most `queue_size` items, so a slow
+    stage makes the previous ones wait instead of accumulating work.
+    Threads suffice since the model stages spend most of their time in
+    PyTorch and spacy code that releases the GIL.
+
+    Per-stage metrics are available through `metrics` once a run ends.
+    """
+    def __init__(self, sarcasm_generator, queue_size=4, sampling='beam-10'):
+        self.sarcasm_generator = sarcasm_generator
+        self.queue_size = queue_size
+        self.sampling = sampling
+        self.metrics: List[StageMetrics] = []
+
+    def _stages(self, num_responses) -> List[Tuple[str, Callable]]:
+        sg = self.sarcasm_generator
+        builder = sg.commonsense_builder
+
+        def extract(item):
+            canonical_event = canonicalize(item.event)
+            item.event, item.surface = \
+                canonical_event.key, canonical_event.surface
+            if sg.response_store is not None:
+                item.response_lst = sg.response_store.get(
+                    item.event, num_responses
+                )
+                if item.response_lst is not None:
+                    return item
+            item.expectation_lst = \
+                sg.expectation_extractor.extract_expectations(
+                    item.event, use_antonyms=True
+                )
+            return item
+
+        def comet(item):
+            if item.response_lst is not None or \
+                    len(item.expectation_lst) == 0:
+                return item
+            item.event_cs = builder.build_comet_commonsense(
+                item.event, self.sampling
+            )
+            item.exp_cs_lst = [
+                builder.build_comet_commonsense(exp, self.sampling)
+                for exp in item.expectation_lst
+            ]
+            return item
+
+        def postprocess(item):
+            if item.response_lst is not None:
+                return item
+            item.cs_obt_lst = []
+            for exp_cs in item.exp_cs_lst:
+                in_cs, exp_cs = builder.remove_comet_overlap(
+                    dict(item.event_cs), exp_cs
+                )
+                item.cs_obt_lst.append(CommonsenseBuilderResponse(
+                    event_obts=in_cs, failed_expectation_obts=exp_cs
+                ))
+            return item
+
+        def render(item):
+            if item.response_lst is None:
+                item.response_lst = []
+                for failed_expectation, cs_obt in zip(
+                    item.expectation_lst, item.cs_obt_lst
+                ):
+                    for _ in range(num_responses):
+                        item.response_lst.append(
+                            sg.response_generator.generate_responses(
+                                item.event, failed_expectation, cs_obt
+                            )
+                        )
+            item.response_lst = restore_surface(
+                item.response_lst, item.surface
+            )
+            return item
+
+        return [
+            ('extract', extract), ('comet', comet),
+            ('postprocess', postprocess), ('render', render)
+        ]
+
+    def generate_responses_iter(
+        self, events: Iterable[str], num_responses: int = 1
+    ) -> Iterator[list]:
+        """Generate responses for each event, as
+        `SarcasmGenerator.generate_responses` would, yielding the result for
+        each event in input order as soon as it is ready.
+        """
+        stage_fns = self._stages(num_responses)
+        queues = [
+            queue.Queue(maxsize=self.queue_size)
+            for _ in range(len(stage_fns) + 1)
+        ]
+        stopped = threading.Event()
+        stages = [
+            _Stage(name, fn, in_queue, out_queue, stopped)
+            for (name, fn), in_queue, out_queue in zip(
+                stage_fns, queues, queues[1:]
+            )
+        ]
+        self.metrics = [stage.metrics for stage in stages]
+        latency_tracker = self.sarcasm_generator.latency_tracker
+
+        def feed():
+            try:
+                for event in events:
+                    if not _put_unless_stopped(
+                        queues[0], _EventItem(event), stopped
+                    ):
+                        return
+            except Exception as e:
+                # E.g. the input could not be read; raised to the consumer
+                # after the responses to the events before.
+                _put_unless_stopped(queues[0], _Failed(e), stopped)
+            finally:
+                _put_unless_stopped(queues[0], _END, stopped)
+
+        feeder = threading.Thread(
+            target=feed, name="pipeline-feed", daemon=True
+        )
+        feeder.start()
+        for stage in stages:
+            stage.start()
+
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _END:
+                    break
+                if isinstance(item, _Failed):
+                    raise item.exception
+                if latency_tracker is not None:
+                    latency_tracker.record(
+                        'generate_responses',
+                        time.perf_counter() - item.start_time
+                    )
+                yield item.response_lst
+        finally:
+            # After a failure, or if the caller stops iterating early, the
+            # threads may be blocked on full queues: drain them, and end the
+            # input of each stage, until all have stopped. The feeder may be
+            # blocked reading the input, so it is not waited for.
+            stopped.set()
+            while any(stage.is_alive() for stage in stages):
+                for pipeline_queue in queues:
+                    try:
+                        while True:
+                            pipeline_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+                for stage in stages:
+                    if stage.is_alive():
+                        try:
+                            stage.in_queue.put_nowait(_END)
+                        except queue.Full:
+                            pass
+                for stage in stages:
+                    stage.join(timeout=0.01)
+            self.log_metrics()
+
+    def generate_responses_batch(self, events, num_responses=1):
+        return list(self.generate_responses_iter(events, num_responses))
+
+    def log_metrics(self):
+        for metrics in self.metrics:
+            logger.info(f"Pipeline stage {metrics.summary()}")
@@ -0,0 +1,278 @@
+import collections
+import contextlib
+import cProfile
+import functools
+import io
+import logging
+import os
+import pathlib
+import pstats
+import random
+import sys
+import threading
+import time
+
+from typing import Dict, List, Optional
+
+import torch
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+# The stages `StageProfiler` times and profiles (see `instrument`).
+STAGES = [
+    'extract_expectations', 'build_comet_commonsense', 'preproc_obt',
+    'sents_contradict', 'get_inflection'
+]
+
+
+class _StackSampler(threading.Thread):
+    """Samples the Python stack of one thread every `interval` seconds, and
+    counts the samples per stack, in the collapsed format of flamegraph.pl:
+    frames from the root, separated by semicolons.
+    """
+    def __init__(self, thread_id, stacks, interval):
+        super().__init__(name="profiler-stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.stacks = stacks
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(
+                    f"{code.co_name} "
+                    f"({os.path.basename(code.co_filename)}:"
+                    f"{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if len(frames) > 0:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class StageProfiler:
+    """Opt-in profiler for the stages of `SarcasmGenerator`.
+
+    A fraction `sample_rate` of the events is profiled. For those events:
+        - each stage (see `STAGES`) runs under its own `cProfile` profiler,
+          accumulated over events, and its calls and wall time are counted;
+          a stage called from within another stage is only timed, as its
+          time is part of the outer stage's profile;
+        - the Python stack of the thread processing the event is sampled
+          every `sample_interval` seconds, for flamegraphs;
+        - if `use_torch`, the event runs under `torch.profiler`, with one
+          labelled range per stage, and its trace is exported.
+    Other events only pay for a check of a thread-local flag per stage.
+
+    `save` writes to `output_dir`:
+        - `<stage>.prof`: the profile of each stage, readable with `pstats`
+          or snakeviz;
+        - `stages.txt`: per-stage calls and wall times, and the top
+          functions of each stage;
+        - `stacks.collapsed`: the stack samples, e.g. for
+          `flamegraph.pl stacks.collapsed > flamegraph.svg`;
+        - `torch_trace_<n>.json`: the PyTorch trace of the n-th profiled
+          event, viewable in chrome://tracing.
+    """
+    def __init__(
+        self,
+        output_dir,
+        sample_rate: float = 0.01,
+        sample_interval: float = 0.005,
+        use_torch: bool = False,
+        seed: Optional[int] = None
+    ):
+        self.output_dir = pathlib.Path(output_dir)
+        self.sample_rate = sample_rate
+        self.sample_interval = sample_interval
+        self.use_torch = use_torch
+        self.rng = random.Random(seed)
+        self.num_events = 0
+        self.num_profiled_events = 0
+        self.stage_profiles: Dict[str, cProfile.Profile] = {}
+        self.stage_calls = collections.Counter()
+        self.stage_times = collections.Counter()
+        self.stacks = collections.Counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._patches = []
+
+    def _stage_stack(self) -> Optional[List[str]]:
+        """The stages the calling thread is in, or None if it is not
+        processing a profiled event.
+        """
+        return getattr(self._local, 'stage_stack', None)
+
+    @contextlib.contextmanager
+    def profile_event(self):
+        """Profile the enclosed event, if it is sampled."""
+        if self._stage_stack() is not None:
+            # Nested in an event that is already profiled.
+            yield
+            return
+        with self._lock:
+            self.num_events += 1
+            sampled = self.rng.random() < self.sample_rate
+            if sampled:
+                self.num_profiled_events += 1
+                event_num = self.num_profiled_events
+        if not sampled:
+            yield
+            return
+
+        self._local.stage_stack = []
+        sampler = _StackSampler(
+            threading.get_ident(), self.stacks, self.sample_interval
+        )
+        sampler.start()
+        with contextlib.ExitStack() as stack:
+            if self.use_torch:
+                torch_profiler = stack.enter_context(torch.profiler.profile(
+                    activities=[torch.profiler.ProfilerActivity.CPU]
+                ))
+            try:
+                yield
+            finally:
+                sampler.stop()
+                self._local.stage_stack = None
+        if self.use_torch:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            torch_profiler.export_chrome_trace(
+                str(self.output_dir / f"torch_trace_{event_num:06d}.json")
+            )
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Profile the enclosed stage, if within a profiled event."""
+        stage_stack = self._stage_stack()
+        if stage_stack is None:
+            yield
+            return
+
+        profile = None
+        if len(stage_stack) == 0:
+            with self._lock:
+                profile = self.stage_profiles.setdefault(
+                    name, cProfile.Profile()
+                )
+        stage_stack.append(name)
+        with contextlib.ExitStack() as stack:
+            if self.use_torch:
+                stack.enter_context(torch.profiler.record_function(name))
+            if profile is not None:
+                try:
+                    profile.enable()
+                    stack.callback(profile.disable)
+                except ValueError:
+                    # Another profiler is active, e.g. the whole program
+                    # runs under cProfile.
+                    pass
+            start_time = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - start_time
+                stage_stack.pop()
+                with self._lock:
+                    self.stage_calls[name] += 1
+                    self.stage_times[name] += elapsed
+
+    def _wrap(self, owner, attr, stage_name):
+        fn = getattr(owner, attr)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.stage(stage_name):
+                return fn(*args, **kwargs)
+
+        # Instance attributes shadow the methods of the class; module
+        # attributes replace the functions until `uninstrument`.
+        self._patches.append((owner, attr, owner.__dict__.get(attr)))
+        setattr(owner, attr, wrapper)
+
+    def instrument(self, sarcasm_generator):
+        """Wrap the stage methods of the components of `sarcasm_generator`.
+        """
+        from max.resources import _commonsense_builders
+        from max.response_generators import pattern_generator
+
+        extractor = sarcasm_generator.expectation_extractor
+        self._wrap(
+            extractor, 'extract_expectations', 'extract_expectations'
+        )
+
+        # Only the outermost builder's commonsense is a stage; that of the
+        # builders it falls back to is part of it.
+        self._wrap(
+            sarcasm_generator.commonsense_builder, 'build_comet_commonsense',
+            'build_comet_commonsense'
+        )
+        for builder in _commonsense_builders(sarcasm_generator):
+            for attr, stage_name in [
+                ('preproc_obt', 'preproc_obt'),
+                ('sents_contradict', 'sents_contradict'),
+                ('sents_contradict_batch', 'sents_contradict')
+            ]:
+                if hasattr(builder, attr):
+                    self._wrap(builder, attr, stage_name)
+
+        templates = getattr(
+            sarcasm_generator.response_generator, 'templates', None
+        )
+        if templates is not None:
+            self._wrap(templates, 'inflect_batch', 'get_inflection')
+        self._wrap(pattern_generator, 'get_inflection', 'get_inflection')
+
+    def uninstrument(self):
+        """Restore the methods, and the module functions, wrapped by
+        `instrument`.
+        """
+        for owner, attr, original in reversed(self._patches):
+            if original is None:
+                delattr(owner, attr)
+            else:
+                setattr(owner, attr, original)
+        self._patches = []
+
+    def summary(self):
+        lines = [
+            f"Profiled {self.num_profiled_events} of {self.num_events} "
+            "events"
+        ]
+        for name in STAGES:
+            num_calls = self.stage_calls[name]
+            if num_calls > 0:
+                total_time = self.stage_times[name]
+                lines.append(
+                    f"{name}: {num_calls} calls, {total_time:.3f}s, "
+                    f"{total_time / num_calls * 1000:.2f}ms per call"
+                )
+        return '\n'.join(lines)
+
+    def save(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        report = io.StringIO()
+        report.write(self.summary() + '\n')
+        for name, profile in self.stage_profiles.items():
+            profile.dump_stats(str(self.output_dir / f"{name}.prof"))
+            report.write(f"\n=== {name} ===\n")
+            pstats.Stats(profile, stream=report) \
+                .sort_stats('cumulative').print_stats(20)
+        (self.output_dir / 'stages.txt').write_text(
+            report.getvalue(), encoding='utf-8'
+        )
+        with open(
+            self.output_dir / 'stacks.collapsed', 'w', encoding='utf-8'
+        ) as fp:
+            for stack, count in sorted(self.stacks.items()):
+                fp.write(f"{stack} {count}\n")
+        logger.info(f"Saved profiles to {self.output_dir}")
+        logger.info(self.summary())
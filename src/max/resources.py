@@ -0,0 +1,194 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from dataclasses import dataclass, replace
+from typing import List, Optional
+
+import torch
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+
+# Held while PyTorch runs with a thread count set by `torch_threads`.
+_torch_threads_lock = threading.RLock()
+
+
+@contextlib.contextmanager
+def torch_threads(num_threads: Optional[int]):
+    """Run the enclosed PyTorch calls with `num_threads` intra-op threads.
+
+    PyTorch's intra-op thread count is process-wide: setting it in one
+    thread changes it for all the others. Blocks with a thread count
+    therefore hold a process-wide lock, so that components running in
+    different threads (see `max.pipeline`) each run their model calls
+    with their own count, in turn, rather than overriding each other's
+    count and restoring the wrong one. Does nothing if `num_threads` is
+    None, in which case the calls run with whatever count is set.
+    """
+    if num_threads is None:
+        yield
+        return
+    with _torch_threads_lock:
+        prev_num_threads = torch.get_num_threads()
+        torch.set_num_threads(num_threads)
+        try:
+            yield
+        finally:
+            torch.set_num_threads(prev_num_threads)
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """Parse a cpu list such as "0-3,8" into [0, 1, 2, 3, 8]."""
+    cpus = []
+    for part in cpu_list.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif len(part.strip()) > 0:
+            cpus.append(int(part))
+    return cpus
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+@dataclass
+class ResourceConfig:
+    """How many cores each component of a process may use.
+
+    Attributes:
+        comet_threads: intra-op threads for the COMET model
+        sentiment_threads: intra-op threads for the sentiment model
+        inter_op_threads: process-wide PyTorch inter-op threads; can only
+            be set before PyTorch runs any parallel work
+        cpu_affinity: the cpus the process may run on
+        spacy_n_process: processes used by spacy for batches of events
+    None means leaving the default in place.
+    """
+    comet_threads: Optional[int] = None
+    sentiment_threads: Optional[int] = None
+    inter_op_threads: Optional[int] = None
+    cpu_affinity: Optional[List[int]] = None
+    spacy_n_process: int = 1
+
+    def for_worker(self, worker_index, num_workers):
+        """Split `cpu_affinity` (by default, all available cpus) evenly
+        across `num_workers` worker processes, and return the configuration
+        of worker `worker_index`. Unset thread counts default to the number
+        of cpus of the worker.
+        """
+        cpus = self.cpu_affinity or available_cpus()
+        per_worker = max(1, len(cpus) // num_workers)
+        start = (worker_index * per_worker) % len(cpus)
+        worker_cpus = cpus[start:start + per_worker]
+        return replace(
+            self,
+            cpu_affinity=worker_cpus,
+            comet_threads=self.comet_threads or len(worker_cpus),
+            sentiment_threads=self.sentiment_threads or len(worker_cpus)
+        )
+
+    def apply(self, sarcasm_generator=None):
+        """Apply the process-wide settings and, if given, configure the
+        components of `sarcasm_generator`.
+        """
+        if self.cpu_affinity is not None and \
+                hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.cpu_affinity)
+        if self.inter_op_threads is not None:
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError as e:
+                logger.warning(f"Unable to set inter-op threads: {e}")
+        if sarcasm_generator is not None:
+            self.configure(sarcasm_generator)
+
+    def configure(self, sarcasm_generator):
+        extractor = sarcasm_generator.expectation_extractor
+        if hasattr(extractor, 'n_process'):
+            extractor.n_process = self.spacy_n_process
+        for builder in _commonsense_builders(sarcasm_generator):
+            if hasattr(builder, 'num_threads'):
+                builder.num_threads = self.comet_threads
+            sentiment_analyser = getattr(builder, 'sentiment_analyser', None)
+            if hasattr(sentiment_analyser, 'num_threads'):
+                sentiment_analyser.num_threads = self.sentiment_threads
+
+
+def _commonsense_builders(sarcasm_generator):
+    """The commonsense builder of `sarcasm_generator` and the builders it
+    falls back to.
+    """
+    builder = sarcasm_generator.commonsense_builder
+    while builder is not None:
+        yield builder
+        builder = getattr(builder, 'fallback_builder', None)
+
+
+def _candidate_thread_counts(num_cpus: int) -> List[int]:
+    """A few thread counts spanning 1 to `num_cpus`."""
+    return sorted({1, max(num_cpus // 4, 1), max(num_cpus // 2, 1), num_cpus})
+
+
+def autotune(
+    sarcasm_generator, sample_events, thread_counts=None, base_config=None
+) -> ResourceConfig:
+    """Pick the COMET and sentiment thread counts with the best throughput
+    on this host, by timing `sarcasm_generator` on `sample_events`. The
+    COMET thread counts of `thread_counts` (by default, 1, a quarter, half
+    and all of the available cpus) are timed first, with as many sentiment
+    threads as cpus, then the sentiment thread counts with the best COMET
+    one, rather than every combination. The best configuration is applied
+    to `sarcasm_generator` and returned.
+
+    The response store, the caches and the retrieval index are bypassed
+    while timing (see `max.warmup`), so the timings measure the models
+    rather than lookups.
+    """
+    from max.warmup import _without_caches
+
+    base_config = base_config or ResourceConfig()
+    num_cpus = len(base_config.cpu_affinity or available_cpus())
+    if thread_counts is None:
+        thread_counts = _candidate_thread_counts(num_cpus)
+
+    def throughput(config):
+        config.configure(sarcasm_generator)
+        start_time = time.perf_counter()
+        for event in sample_events:
+            sarcasm_generator.generate_responses(event)
+        events_per_second = \
+            len(sample_events) / (time.perf_counter() - start_time)
+        logger.info(
+            f"Autotune: comet_threads={config.comet_threads}, "
+            f"sentiment_threads={config.sentiment_threads}: "
+            f"{events_per_second:.2f} events/s"
+        )
+        return events_per_second
+
+    with _without_caches(sarcasm_generator):
+        # Warm up, so that the first configuration does not pay one-off
+        # costs.
+        base_config.configure(sarcasm_generator)
+        sarcasm_generator.generate_responses(sample_events[0])
+
+        best_config = replace(base_config, sentiment_threads=num_cpus)
+        for param in ['comet_threads', 'sentiment_threads']:
+            timings = {}
+            for num_threads in thread_counts:
+                config = replace(best_config, **{param: num_threads})
+                timings[num_threads] = throughput(config)
+            best_config = replace(
+                best_config, **{param: max(timings, key=timings.get)}
+            )
+
+    logger.info(f"Autotune: picked {best_config}")
+    best_config.configure(sarcasm_generator)
+    return best_config
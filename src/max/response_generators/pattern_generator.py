@@ -1,18 +1,42 @@
+import functools
+import pathlib
 import random
 
 import spacy
 
 from .generator import ResponseGenerator
+from .templates import ResponseTemplates
 from max import ExplainableSarcasticResponse
+from max.cache import get_or_compute_many
+from max.types import CompactSarcasticResponse, ResponseContext
 
 
 nlp = spacy.load('en_core_web_sm')
 
+# Bumped when `_inflect_first_verb` changes, so that cached inflections are
+# not reused.
+CACHE_VERSION = 1
+
+DEFAULT_TEMPLATE_PATH = (
+    # /src/max/response_generators/ -> /
+    pathlib.Path(__file__).absolute().parent.parent.parent.parent
+    / 'resources' / 'response_templates.json'
+)
+
 
 class PatternResponseGenerator(ResponseGenerator):
-    def __init__(self, patterns, valid_relation_types):
+    def __init__(
+        self, patterns, valid_relation_types, compact=False, templates=None,
+        cache=None
+    ):
         self.patterns = patterns
         self.valid_relation_types = valid_relation_types
+        # The `ResponseTemplates` the patterns render, if any.
+        self.templates = templates
+        # Optional `max.cache.Cache` of the inflections of the templates.
+        self.cache = cache
+        # Whether to generate `CompactSarcasticResponse` instances.
+        self.compact = compact
 
     def generate_responses(self, event, failed_expectation, cs_obt):
         """Generate explainable sarcastic responses from the give commonsense
@@ -27,13 +51,15 @@ class PatternResponseGenerator(ResponseGenerator):
                 explainable sarcastic response will be constructed.
 
         Return:
-            `ExplainableSarcasticResponse`:
-                An object containing the relation, subject and object;
+            `List[ExplainableSarcasticResponse]`:
+                Objects containing the relation, subject and object;
                 the norm violated (which, in this implementation is always
                 the maxim of quality), the failed expectation, and the
-                response texts.
+                response texts. `CompactSarcasticResponse` objects if
+                `self.compact` is set.
         """
         responses = []
+        context = ResponseContext(event, failed_expectation)
         def _generate_responses_for_target(target, pattern_name):
             for relation_type in self.valid_relation_types:
                 if len(target[relation_type]) == 0:
@@ -44,15 +70,22 @@ class PatternResponseGenerator(ResponseGenerator):
                 generator = self.patterns[pattern_name][relation_type]
                 texts = generator(relation_object)
 
-                responses.append(ExplainableSarcasticResponse(
-                    event=event,
-                    failed_expectation=failed_expectation,
-                    relation_type=relation_type,
-                    relation_subject="event",
-                    relation_object=relation_object,
-                    norm_violated="maxim of quality",
-                    response_texts=texts
-                ))
+                if self.compact:
+                    response = CompactSarcasticResponse(
+                        context, relation_type, "event", relation_object,
+                        "maxim of quality", texts
+                    )
+                else:
+                    response = ExplainableSarcasticResponse(
+                        event=event,
+                        failed_expectation=failed_expectation,
+                        relation_type=relation_type,
+                        relation_subject="event",
+                        relation_object=relation_object,
+                        norm_violated="maxim of quality",
+                        response_texts=texts
+                    )
+                responses.append(response)
         _generate_responses_for_target(cs_obt.event_obts, "event")
         if cs_obt.failed_expectation_obts is not None:
             _generate_responses_for_target(
@@ -60,8 +93,65 @@ class PatternResponseGenerator(ResponseGenerator):
             )
         return responses
 
+    def set_cache(self, cache):
+        """Cache the inflections of the templates in `cache`, a namespaced
+        `max.cache.Cache` such as `self.cache`, or not at all if None.
+        """
+        self.cache = cache
+        if self.templates is not None:
+            self.templates.inflect_batch = functools.partial(
+                get_inflections, cache=cache
+            )
+
+    @classmethod
+    def default(cls, compact=False, seed=None, cache=None):
+        return cls.from_templates(
+            DEFAULT_TEMPLATE_PATH, compact=compact, seed=seed, cache=cache
+        )
+
+    @classmethod
+    def from_templates(
+        cls, template_path, compact=False, seed=None, cache=None
+    ):
+        """Build a generator whose patterns are the templates compiled from
+        `template_path`; see `ResponseTemplates`. Fragments are picked with a
+        random number generator seeded with `seed`, for reproducibility.
+        Inflections are cached in `cache`, a `max.cache.Cache`, if set.
+        """
+        if cache is not None:
+            cache = cache.namespace(
+                'inflections', CACHE_VERSION, nlp.meta['name'],
+                nlp.meta['version']
+            )
+        templates = ResponseTemplates.load(
+            template_path, functools.partial(get_inflections, cache=cache),
+            seed=seed
+        )
+        patterns = dict(
+            event={
+                relation_type: functools.partial(
+                    templates.render, relation_type, P=True
+                )
+                for relation_type in templates.relation_types
+            },
+            failed_expectation={
+                relation_type: functools.partial(
+                    templates.render, relation_type, P=False
+                )
+                for relation_type in templates.relation_types
+            }
+        )
+        valid_relation_types = ['xNeed', 'xAttr', 'xReact', 'xEffect']
+        return cls(
+            patterns, valid_relation_types, compact=compact,
+            templates=templates, cache=cache
+        )
+
     @classmethod
-    def default(cls):
+    def from_functions(cls, compact=False):
+        """Build a generator whose patterns are the `gen_*_complete`
+        functions below.
+        """
         patterns = dict(
             event=dict(
                 xNeed=gen_xNeed_complete,
@@ -77,7 +167,7 @@ class PatternResponseGenerator(ResponseGenerator):
             )
         )
         valid_relation_types = ['xNeed', 'xAttr', 'xReact', 'xEffect']
-        return cls(patterns, valid_relation_types)
+        return cls(patterns, valid_relation_types, compact=compact)
 
 
 interjs = ['Yay!', 'Brilliant!']
@@ -167,10 +257,28 @@ def gen_xEffect_complete(obt, P=True):
 
 
 def get_inflection(obt, tag, context=''):
+    return _inflect_first_verb(nlp(context + ' ' + obt), tag, context)
+
+
+def get_inflections(obts, tag, context='', cache=None):
+    """Same as `get_inflection`, for a list of objects processed together.
+    Objects are looked up in `cache`, a `max.cache.Cache`, if set.
+    """
+    return get_or_compute_many(
+        cache, obts,
+        lambda obts: [
+            _inflect_first_verb(doc, tag, context)
+            for doc in nlp.pipe([context + ' ' + obt for obt in obts])
+        ],
+        key=lambda obt: f"{tag}\n{context}\n{obt}"
+    )
+
+
+def _inflect_first_verb(doc, tag, context):
     toks = []
     found_verb = False
 
-    for tok in nlp(context + ' ' + obt):
+    for tok in doc:
         if tok.pos_ in ['VERB', 'AUX'] and found_verb is False:
             found_verb = True
             toks.append(tok._.inflect(tag))
@@ -0,0 +1,173 @@
+import itertools
+import json
+import random
+import re
+
+from typing import Callable, Dict, List, Tuple
+
+
+# {name}, {obt:TAG} or {obt:TAG:CONTEXT}
+SLOT_RE = re.compile(r'\{(\w+)(?::(\w+))?(?::([^}]*))?\}')
+POLARITIES = {True: 'P', False: 'not_P'}
+
+
+class CompiledTemplate:
+    """A template with all combinations of fragment choices expanded ahead
+    of time into format strings, whose only remaining placeholders are the
+    relation object slots.
+
+    For instance, with fragments interj=["Yay!", "Brilliant!"], the
+    template "{interj} Good job not {obt:VBG:I}." compiles to the skeletons
+    ["Yay! Good job not {0}.", "Brilliant! Good job not {0}."] and the
+    object slots [("VBG", "I")].
+    """
+    def __init__(self, skeletons: List[str], obt_slots: List[Tuple]):
+        self.skeletons = skeletons
+        self.obt_slots = obt_slots
+
+    @classmethod
+    def compile(cls, template: str, fragments: Dict[str, List[str]]):
+        literals = []
+        slots = []
+        last_end = 0
+        for match in SLOT_RE.finditer(template):
+            literals.append(template[last_end:match.start()])
+            name, tag, context = match.groups()
+            if name == 'obt':
+                slots.append(('obt', (tag, context or '')))
+            elif name in fragments:
+                slots.append(('fragment', name))
+            else:
+                raise ValueError(
+                    f'Unknown slot "{name}" in template "{template}"'
+                )
+            last_end = match.end()
+        literals.append(template[last_end:])
+        literals = [
+            literal.replace('{', '{{').replace('}', '}}')
+            for literal in literals
+        ]
+
+        obt_slots = [value for kind, value in slots if kind == 'obt']
+        fragment_choices = [
+            [
+                choice.replace('{', '{{').replace('}', '}}')
+                for choice in fragments[value]
+            ]
+            for kind, value in slots if kind == 'fragment'
+        ]
+        skeletons = []
+        for choices in itertools.product(*fragment_choices):
+            choices = iter(choices)
+            obt_num = itertools.count()
+            parts = [literals[0]]
+            for (kind, _), literal in zip(slots, literals[1:]):
+                if kind == 'obt':
+                    parts.append(f'{{{next(obt_num)}}}')
+                else:
+                    parts.append(next(choices))
+                parts.append(literal)
+            skeletons.append(''.join(parts))
+        return cls(skeletons, obt_slots)
+
+
+class ResponseTemplates:
+    """Response templates compiled from a declarative json file.
+
+    The file maps fragment names to lists of alternatives, and relation
+    types to lists of templates. Each template has a "P" and a "not_P"
+    variant: the former is used for objects of the event, the latter for
+    objects of the failed expectation. Templates refer to fragments by name,
+    e.g. "{interj}", and to the relation object as "{obt}", optionally
+    inflected, e.g. "{obt:VBG:I}" for the VBG form of the first verb in
+    the object, in the context of the subject "I".
+    See `resources/response_templates.json`.
+
+    Args:
+        templates: relation type -> polarity -> list of `CompiledTemplate`
+        inflect_batch (`Callable[[List[str], str, str], List[str]]`):
+            inflects a list of objects given a tag and a context, such as
+            `max.response_generators.pattern_generator.get_inflections`
+        seed (`int`):
+            seed of the random number generator used to pick fragments
+    """
+    def __init__(
+        self,
+        templates: Dict[str, Dict[str, List[CompiledTemplate]]],
+        inflect_batch: Callable,
+        seed=None
+    ):
+        self.templates = templates
+        self.inflect_batch = inflect_batch
+        self.rng = random.Random(seed)
+
+    @property
+    def relation_types(self):
+        return list(self.templates.keys())
+
+    def seed(self, seed):
+        self.rng.seed(seed)
+
+    def _inflect(self, templates, obts):
+        """Compute all the inflections needed by `templates`, for all
+        `obts`, with one call to `inflect_batch` per (tag, context).
+        """
+        inflections = {}
+        for template in templates:
+            for tag, context in template.obt_slots:
+                if tag is not None and (tag, context) not in inflections:
+                    inflections[(tag, context)] = self.inflect_batch(
+                        obts, tag, context
+                    )
+        return inflections
+
+    def _fill(self, template, skeleton, obt_num, obt, inflections):
+        return skeleton.format(*[
+            obt if tag is None else inflections[(tag, context)][obt_num]
+            for tag, context in template.obt_slots
+        ])
+
+    def render(self, relation_type, obt, P=True) -> List[str]:
+        """Render one response per template, picking fragments at random."""
+        templates = self.templates[relation_type][POLARITIES[P]]
+        inflections = self._inflect(templates, [obt])
+        return [
+            self._fill(
+                template, self.rng.choice(template.skeletons), 0, obt,
+                inflections
+            )
+            for template in templates
+        ]
+
+    def render_all(self, relation_type, obts, P=True) -> List[List[str]]:
+        """Render every variant of every template for each of `obts`.
+
+        Returns one list of responses per object.
+        """
+        templates = self.templates[relation_type][POLARITIES[P]]
+        inflections = self._inflect(templates, obts)
+        return [
+            [
+                self._fill(template, skeleton, obt_num, obt, inflections)
+                for template in templates
+                for skeleton in template.skeletons
+            ]
+            for obt_num, obt in enumerate(obts)
+        ]
+
+    @classmethod
+    def load(cls, template_path, inflect_batch, seed=None):
+        with open(template_path, 'r', encoding='utf-8') as fp:
+            spec = json.load(fp)
+        fragments = spec['fragments']
+        templates = {
+            relation_type: {
+                polarity: [
+                    CompiledTemplate.compile(template[polarity], fragments)
+                    for template in relation_templates
+                ]
+                for polarity in POLARITIES.values()
+            }
+            for relation_type, relation_templates in spec['templates'].items()
+        }
+        return cls(templates, inflect_batch, seed=seed)
@@ -0,0 +1,268 @@
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import pathlib
+import struct
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from max import ExplainableSarcasticResponse
+from max.canonicalization import canonicalize
+from max.resources import ResourceConfig
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+# Bumped when keys change, e.g. with canonicalization.
+MAGIC = b'MAXRS003'
+HEADER = struct.Struct('<8sQ')
+# key offset, key length, value offset, value length
+ENTRY = struct.Struct('<QIQI')
+
+
+class ResponseStore:
+    """Read-only, memory-mapped store of sarcastic responses keyed by
+    canonical event (see `max.canonicalization.CanonicalEvent.key`).
+
+    The file starts with a header (magic, number of records), followed by a
+    table of fixed-width entries sorted by key, followed by the keys and
+    values. Each value is the json of
+    {"event": ..., "num_responses": ..., "responses": [...]}, where "event"
+    is the surface form the responses were generated from, and "responses"
+    holds the lists of responses `SarcasmGenerator.generate_responses`
+    returned with "num_responses": that many per failed expectation.
+    Lookups are binary searches over the mapped table, so opening a store is
+    cheap regardless of its size.
+    """
+    def __init__(self, store_path):
+        self.store_path = pathlib.Path(store_path)
+        with open(self.store_path, 'rb') as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._num_records = HEADER.unpack_from(self._mm, 0)
+        if magic[:5] == MAGIC[:5] and magic != MAGIC:
+            raise ValueError(
+                f"{store_path} was built by another version; rebuild it"
+            )
+        if magic != MAGIC:
+            raise ValueError(f"{store_path} is not a response store")
+
+    def __len__(self):
+        return self._num_records
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def close(self):
+        self._mm.close()
+
+    def preload(self):
+        """Read the whole store into the page cache, so that the first
+        lookups do not wait for the disk.
+        """
+        if hasattr(self._mm, 'madvise'):
+            self._mm.madvise(mmap.MADV_WILLNEED)
+        for offset in range(0, len(self._mm), mmap.PAGESIZE):
+            self._mm[offset]
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self._mm, HEADER.size + i * ENTRY.size)
+
+    def _key_at(self, i):
+        key_offset, key_len, _, _ = self._entry(i)
+        return self._mm[key_offset:key_offset + key_len]
+
+    def _find(self, key) -> Optional[int]:
+        key = key.encode('utf-8')
+        lo, hi = 0, self._num_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._num_records and self._key_at(lo) == key:
+            return lo
+        return None
+
+    def _raw_value(self, i):
+        _, _, value_offset, value_len = self._entry(i)
+        return self._mm[value_offset:value_offset + value_len]
+
+    def get_record(self, key) -> Optional[dict]:
+        i = self._find(key)
+        if i is None:
+            return None
+        return json.loads(self._raw_value(i))
+
+    def get(
+        self, key, num_responses: int = 1
+    ) -> Optional[List[List[ExplainableSarcasticResponse]]]:
+        """Return the stored responses for `key`, as
+        `SarcasmGenerator.generate_responses` would with `num_responses`, or
+        None if absent or stored with fewer responses per expectation.
+        """
+        record = self.get_record(key)
+        if record is None or record['num_responses'] < num_responses:
+            return None
+        # The lists of each expectation are consecutive.
+        return [
+            [
+                ExplainableSarcasticResponse(**response)
+                for response in responses
+            ]
+            for i, responses in enumerate(record['responses'])
+            if i % record['num_responses'] < num_responses
+        ]
+
+    def raw_items(self) -> Iterator[Tuple[str, bytes]]:
+        """Iterate over (key, json-encoded record) pairs, in key order."""
+        for i in range(self._num_records):
+            yield self._key_at(i).decode('utf-8'), self._raw_value(i)
+
+
+def write_response_store(store_path, records: Dict[str, bytes]):
+    """Write `records`, a dictionary from key to json-encoded record, as a
+    response store at `store_path`. The file is replaced atomically.
+    """
+    encoded = sorted(
+        (key.encode('utf-8'), value) for key, value in records.items()
+    )
+    store_path = pathlib.Path(store_path)
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = store_path.with_name(store_path.name + '.tmp')
+
+    data_offset = HEADER.size + len(encoded) * ENTRY.size
+    with open(tmp_path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, len(encoded)))
+        offset = data_offset
+        for key, value in encoded:
+            fp.write(ENTRY.pack(
+                offset, len(key), offset + len(key), len(value)
+            ))
+            offset += len(key) + len(value)
+        for key, value in encoded:
+            fp.write(key)
+            fp.write(value)
+    os.replace(tmp_path, store_path)
+
+
+def encode_record(event, response_lst, num_responses=1):
+    """Encode the responses to `event`, as returned by
+    `SarcasmGenerator.generate_responses` with `num_responses`, as a store
+    value.
+    """
+    return json.dumps(
+        {
+            "event": event,
+            "num_responses": num_responses,
+            "responses": [
+                [r.to_json() for r in responses] for responses in response_lst
+            ]
+        },
+        separators=(',', ':')
+    ).encode('utf-8')
+
+
+_worker_sarcasm_generator = None
+
+
+def _init_worker(sarcasm_generator_factory, resource_config, num_workers):
+    global _worker_sarcasm_generator
+    # Pool workers are numbered from 1.
+    worker_index = multiprocessing.current_process()._identity[0] - 1
+    resource_config = resource_config.for_worker(worker_index, num_workers)
+    resource_config.apply()
+    _worker_sarcasm_generator = sarcasm_generator_factory()
+    resource_config.configure(_worker_sarcasm_generator)
+
+
+def _process_event(args):
+    key, event, num_responses = args
+    response_lst = _worker_sarcasm_generator.generate_responses(
+        event, num_responses=num_responses
+    )
+    return key, encode_record(event, response_lst, num_responses)
+
+
+def build_response_store(
+    catalogue_path, store_path, sarcasm_generator_factory, num_workers=1,
+    num_responses=1, resource_config=None
+):
+    """Run the sarcasm generation pipeline over a catalogue of events, one
+    per line, and save the responses as a `ResponseStore` at `store_path`.
+
+    If a store already exists at `store_path`, the build is incremental:
+    only events that are new, whose surface form changed, or that were
+    stored with another `num_responses`, are processed;
+    events no longer in the catalogue are dropped.
+
+    Args:
+        catalogue_path (`str`):
+            a text file with one event per line
+        store_path (`str`):
+            where to save the store
+        sarcasm_generator_factory (`Callable[[], SarcasmGenerator]`):
+            a picklable function that builds a `SarcasmGenerator`; called
+            once per worker process
+        num_workers (`int`):
+            the number of worker processes. Each loads its own models, so
+            this is bounded by memory rather than by the number of cores
+        num_responses (`int`):
+            passed to `SarcasmGenerator.generate_responses`; lookups can ask
+            for at most as many
+        resource_config (`ResourceConfig`):
+            split across workers with `ResourceConfig.for_worker`; by
+            default, each worker gets an even share of the available cpus
+
+    Returns:
+        `Tuple[int, int]`: the number of events processed and reused
+    """
+    catalogue = {}
+    with open(catalogue_path, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            event = line.strip()
+            if len(event) > 0:
+                catalogue.setdefault(canonicalize(event).key, event)
+
+    records = {}
+    old_store = None
+    if pathlib.Path(store_path).exists():
+        try:
+            old_store = ResponseStore(store_path)
+        except ValueError as e:
+            logger.warning(f"Not reusing {store_path}: {e}")
+    if old_store is not None:
+        for key, raw_value in old_store.raw_items():
+            record = json.loads(raw_value)
+            if key in catalogue and record['event'] == catalogue[key] and \
+                    record['num_responses'] == num_responses:
+                records[key] = bytes(raw_value)
+        old_store.close()
+
+    todo = [
+        (key, event, num_responses)
+        for key, event in catalogue.items()
+        if key not in records
+    ]
+    logger.info(
+        f"Processing {len(todo)} events, reusing {len(records)} events"
+    )
+
+    if len(todo) > 0:
+        num_workers = min(num_workers, len(todo))
+        resource_config = resource_config or ResourceConfig()
+        with multiprocessing.Pool(
+            num_workers, initializer=_init_worker,
+            initargs=(sarcasm_generator_factory, resource_config, num_workers)
+        ) as pool:
+            for it_num, (key, value) in enumerate(
+                pool.imap_unordered(_process_event, todo)
+            ):
+                records[key] = value
+                if (it_num + 1) % 100 == 0:
+                    logger.info(f"Processed {it_num + 1} / {len(todo)}")
+
+    write_response_store(store_path, records)
+    return len(todo), len(records) - len(todo)
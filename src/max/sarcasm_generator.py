@@ -1,10 +1,13 @@
+import contextlib
 import logging
 
-from typing import List
+from typing import Iterable, Iterator, List
 
 from max import (
-    ExplainableSarcasticResponse
+    CommonsenseBuilderResponse, ExplainableSarcasticResponse
 )
+from max.canonicalization import canonicalize, restore_surface
+from max.memory import spacy_memory_zones, spacy_processors
 
 
 logger = logging.getLogger('sarcasm_generator')
@@ -12,11 +15,30 @@ logger = logging.getLogger('sarcasm_generator')
 
 class SarcasmGenerator:
     def __init__(
-        self, expectation_extractor, commonsense_builder, response_generator
+        self, expectation_extractor, commonsense_builder, response_generator,
+        response_store=None, lean=False, profiler=None, latency_tracker=None
     ):
         self.expectation_extractor = expectation_extractor
         self.commonsense_builder = commonsense_builder
         self.response_generator = response_generator
+        # Optional `ResponseStore` with precomputed responses, answered from
+        # before running the pipeline.
+        self.response_store = response_store
+        # In lean mode, raw commonsense is not built, and the strings spacy
+        # adds to its vocabularies while processing an event are freed
+        # afterwards, so memory stays flat over long runs.
+        self.lean = lean
+        self._spacy_processors = spacy_processors(self) if lean else []
+        # Optional `StageProfiler`, which profiles the stages of a sample of
+        # the events.
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.instrument(self)
+        # Optional `LatencyTracker`, which keeps latency histograms of the
+        # events and of the model calls.
+        self.latency_tracker = latency_tracker
+        if latency_tracker is not None:
+            latency_tracker.instrument(self)
 
     def generate_responses(
         self, event: str, num_responses: int = 1
@@ -41,6 +63,153 @@ class SarcasmGenerator:
                 latter two can be used to generate an explanation as to why the
                 response is sarcastic.
         """
+        # The pipeline runs on the canonical form of the event, so that
+        # equivalent events share cached results; the responses refer to the
+        # event as given.
+        canonical_event = canonicalize(event)
+        profile_event = self.profiler.profile_event() \
+            if self.profiler is not None else contextlib.nullcontext()
+        with profile_event:
+            response_lst = None
+            if self.response_store is not None:
+                response_lst = self.response_store.get(
+                    canonical_event.key, num_responses
+                )
+                if response_lst is not None:
+                    logger.info("Found responses in the response store")
+
+            if response_lst is None and self.lean:
+                with spacy_memory_zones(self._spacy_processors):
+                    response_lst = self._generate_responses(
+                        canonical_event.key, num_responses
+                    )
+            elif response_lst is None:
+                response_lst = self._generate_responses(
+                    canonical_event.key, num_responses
+                )
+            return restore_surface(response_lst, canonical_event.surface)
+
+    def generate_responses_batch(
+        self, events: List[str], num_responses: int = 1
+    ) -> List[List[List[ExplainableSarcasticResponse]]]:
+        """Same as `generate_responses`, for a list of events processed
+        together, so that the models can batch across events: the
+        expectations of all the events are extracted together, the
+        commonsense of all the distinct events and expectations is built in
+        one call to the commonsense builder, and all the contradiction
+        checks are scored together. Events of a batch are not profiled.
+
+        Args:
+            events (`List[str]`):
+                the events
+            num_responses (`int`):
+                the number of sarcastic responses to generate per
+                expectation
+
+        Returns:
+            `List[List[List[ExplainableSarcasticResponse]]]`:
+                for each event, the responses `generate_responses` returns
+        """
+        canonical_events = [canonicalize(event) for event in events]
+        key_to_response_lst = {}
+        if self.response_store is not None:
+            for canonical_event in canonical_events:
+                key = canonical_event.key
+                if key in key_to_response_lst:
+                    continue
+                response_lst = self.response_store.get(key, num_responses)
+                if response_lst is not None:
+                    key_to_response_lst[key] = response_lst
+            logger.info(
+                f"Found responses to {len(key_to_response_lst)} events in "
+                "the response store"
+            )
+
+        keys = list(dict.fromkeys(
+            canonical_event.key for canonical_event in canonical_events
+            if canonical_event.key not in key_to_response_lst
+        ))
+        if len(keys) > 0 and self.lean:
+            with spacy_memory_zones(self._spacy_processors):
+                key_to_response_lst.update(
+                    self._generate_responses_batch(keys, num_responses)
+                )
+        elif len(keys) > 0:
+            key_to_response_lst.update(
+                self._generate_responses_batch(keys, num_responses)
+            )
+        return [
+            restore_surface(
+                key_to_response_lst[canonical_event.key],
+                canonical_event.surface
+            )
+            for canonical_event in canonical_events
+        ]
+
+    def generate_responses_iter(
+        self, events: Iterable[str], num_responses: int = 1,
+        batch_size: int = 32
+    ) -> Iterator[List[List[ExplainableSarcasticResponse]]]:
+        """Generate responses for each event with `generate_responses_batch`,
+        `batch_size` events at a time, yielding the result for each event in
+        input order.
+        """
+        batch = []
+        for event in events:
+            batch.append(event)
+            if len(batch) == batch_size:
+                yield from self.generate_responses_batch(batch, num_responses)
+                batch = []
+        if len(batch) > 0:
+            yield from self.generate_responses_batch(batch, num_responses)
+
+    def _generate_responses_batch(self, events, num_responses):
+        logger.info(f"Extracting expectations for {len(events)} events")
+        expectation_lsts = \
+            self.expectation_extractor.extract_expectations_batch(
+                events, use_antonyms=True
+            )
+        pairs = [
+            (event, failed_expectation)
+            for event, expectation_lst in zip(events, expectation_lsts)
+            for failed_expectation in expectation_lst
+        ]
+        logger.info(f"Extracted {len(pairs)} expectations")
+
+        # The commonsense of an event is built once for all its
+        # expectations, and that of an input shared by several events once.
+        inputs = list(dict.fromkeys(
+            input for pair in pairs for input in pair
+        ))
+        logger.info(f"Building commonsense for {len(inputs)} inputs")
+        input_to_cs = dict(zip(
+            inputs,
+            self.commonsense_builder.build_comet_commonsense_batch(
+                inputs, 'beam-10'
+            )
+        ))
+        cs_pairs = self.commonsense_builder.remove_comet_overlap_batch([
+            (dict(input_to_cs[event]), input_to_cs[failed_expectation])
+            for event, failed_expectation in pairs
+        ])
+
+        logger.info("Generating responses")
+        key_to_response_lst = {event: [] for event in events}
+        for (event, failed_expectation), (in_cs, exp_cs) in zip(
+            pairs, cs_pairs
+        ):
+            cs_obt = CommonsenseBuilderResponse(
+                event_obts=in_cs, failed_expectation_obts=exp_cs
+            )
+            for _ in range(num_responses):
+                key_to_response_lst[event].append(
+                    self.response_generator.generate_responses(
+                        event, failed_expectation, cs_obt
+                    )
+                )
+        return key_to_response_lst
+
+    def _generate_responses(self, event, num_responses):
         response_lst = []
 
         logger.info("Extracting expectations")
@@ -55,9 +224,15 @@ class SarcasmGenerator:
                 f"Expectation {it_num + 1} / {len(expectation_lst)}: "
                 "building commonsense"
             )
-            cs_obt, raw_cs_obt = self.commonsense_builder.build_commonsense(
-                event, failed_expectation
-            )
+            if self.lean:
+                cs_obt, _ = self.commonsense_builder.build_commonsense(
+                    event, failed_expectation, keep_raw=False
+                )
+            else:
+                cs_obt, raw_cs_obt = \
+                    self.commonsense_builder.build_commonsense(
+                        event, failed_expectation
+                    )
             logger.info(
                 f"Expectation {it_num + 1} / {len(expectation_lst)}: "
                 'generating responses'
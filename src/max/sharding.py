@@ -0,0 +1,217 @@
+import heapq
+import json
+import logging
+import os
+import pathlib
+import zlib
+
+from typing import Iterator, List, Tuple
+
+from max import ExplainableSarcasticResponse
+from max.canonicalization import canonicalize
+from max.pipeline import PipelinedSarcasmGenerator
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+
+def shard_of(event, num_shards):
+    """The shard an event belongs to. Stable across processes and hosts,
+    unlike `hash`, and identical for events with the same canonical form
+    (see `max.canonicalization`), so that repeated events are processed on
+    the same node.
+    """
+    return zlib.crc32(canonicalize(event).key.encode('utf-8')) % num_shards
+
+
+def shard_path(shard_dir, shard_index, num_shards):
+    return pathlib.Path(shard_dir) / \
+        f"shard-{shard_index:05d}-of-{num_shards:05d}.jsonl"
+
+
+def shard_done_path(shard_dir, shard_index, num_shards):
+    path = shard_path(shard_dir, shard_index, num_shards)
+    return path.with_name(path.name + '.done')
+
+
+def read_shard_events(
+    event_file_path, shard_index, num_shards
+) -> Iterator[Tuple[int, str]]:
+    """Iterate over the (line number, event) pairs of the events of shard
+    `shard_index` in `event_file_path`.
+    """
+    with open(event_file_path, 'r', encoding='utf-8') as fp:
+        for line_num, line in enumerate(fp):
+            event = line.strip()
+            if shard_of(event, num_shards) == shard_index:
+                yield line_num, event
+
+
+def read_shard(path) -> Iterator[dict]:
+    """Iterate over the complete records of a shard output file, each a
+    dictionary with the line number and the text of the event, and its
+    responses. A partially written last record is ignored.
+    """
+    with open(path, 'rb') as fp:
+        for line in fp:
+            if not line.endswith(b'\n'):
+                break
+            yield json.loads(line)
+
+
+def _recover_shard(path) -> Tuple[int, int]:
+    """Truncate a partially written last record off the shard output file
+    at `path`, and return the line number of the last complete record (-1
+    if none) and the number of complete records.
+    """
+    last_line_num = -1
+    num_records = 0
+    offset = 0
+    with open(path, 'rb') as fp:
+        for line in fp:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                last_line_num = json.loads(line)['line']
+            except (json.JSONDecodeError, KeyError):
+                break
+            num_records += 1
+            offset += len(line)
+    if offset < os.path.getsize(path):
+        logger.warning(f"Truncating a partial record off {path}")
+        os.truncate(path, offset)
+    return last_line_num, num_records
+
+
+def process_shard(
+    sarcasm_generator, event_file_path, shard_dir, shard_index, num_shards,
+    pipelined=False, batch_size=1
+):
+    """Generate responses for the events of shard `shard_index` out of
+    `num_shards`, as `main_batch` would, and append them to the shard's
+    output file in `shard_dir`, one json record per line, in input order.
+
+    Each record is flushed as soon as it is written, so the run is
+    resumable: if the output file exists, events up to its last complete
+    record are skipped. Once all events are processed, a done marker is
+    written next to the output file.
+
+    Returns:
+        `Tuple[int, int]`: the number of events processed and skipped
+    """
+    shard_dir = pathlib.Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    path = shard_path(shard_dir, shard_index, num_shards)
+    last_line_num, num_skipped = \
+        _recover_shard(path) if path.exists() else (-1, 0)
+
+    todo = [
+        (line_num, event)
+        for line_num, event in read_shard_events(
+            event_file_path, shard_index, num_shards
+        )
+        if line_num > last_line_num
+    ]
+    logger.info(
+        f"Shard {shard_index} / {num_shards}: processing {len(todo)} events, "
+        f"skipping {num_skipped} already processed"
+    )
+
+    events = (event for _, event in todo)
+    if pipelined:
+        response_lsts = PipelinedSarcasmGenerator(
+            sarcasm_generator
+        ).generate_responses_iter(events, num_responses=1)
+    elif batch_size > 1:
+        response_lsts = sarcasm_generator.generate_responses_iter(
+            events, num_responses=1, batch_size=batch_size
+        )
+    else:
+        response_lsts = (
+            sarcasm_generator.generate_responses(event, num_responses=1)
+            for event in events
+        )
+
+    with open(path, 'a', encoding='utf-8') as fp:
+        for (line_num, event), response_lst in zip(todo, response_lsts):
+            responses = response_lst[0] if len(response_lst) > 0 else []
+            fp.write(json.dumps({
+                "line": line_num,
+                "event": event,
+                "responses": [r.to_json() for r in responses]
+            }) + '\n')
+            fp.flush()
+
+    shard_done_path(shard_dir, shard_index, num_shards).touch()
+    return len(todo), num_skipped
+
+
+def merge_shards(
+    event_file_path, shard_dir, num_shards, writer, allow_missing=False
+) -> List[int]:
+    """Write the responses from all the shard outputs in `shard_dir` to
+    `writer` (see `max.writers`), in the order of `event_file_path`.
+
+    Shards are read in a streaming merge, so memory does not depend on
+    the number of events.
+
+    Args:
+        event_file_path (`str`):
+            the event file the shards were built from
+        shard_dir (`str`):
+            the directory holding the shard outputs
+        num_shards (`int`):
+            the number of shards
+        writer:
+            a response writer, e.g. `JsonResponseWriter`
+        allow_missing (`bool`):
+            if True, events without responses are skipped; otherwise a
+            `ValueError` is raised once the other events are written
+
+    Returns:
+        `List[int]`: the line numbers of the events without responses
+    """
+    for shard_index in range(num_shards):
+        if not shard_done_path(shard_dir, shard_index, num_shards).exists():
+            logger.warning(f"Shard {shard_index} / {num_shards} is not done")
+
+    records = heapq.merge(
+        *[
+            read_shard(shard_path(shard_dir, shard_index, num_shards))
+            for shard_index in range(num_shards)
+            if shard_path(shard_dir, shard_index, num_shards).exists()
+        ],
+        key=lambda record: record['line']
+    )
+    record = next(records, None)
+    missing = []
+    with open(event_file_path, 'r', encoding='utf-8') as fp:
+        for line_num, line in enumerate(fp):
+            if record is None or record['line'] != line_num:
+                missing.append(line_num)
+                continue
+            if record['event'] != line.strip():
+                raise ValueError(
+                    f"Line {line_num + 1} of {event_file_path} does not match "
+                    "the shard outputs; was the event file changed?"
+                )
+            writer.write([
+                ExplainableSarcasticResponse(**response)
+                for response in record['responses']
+            ])
+            record = next(records, None)
+    if record is not None:
+        raise ValueError(
+            f"The shard outputs have responses for line {record['line']}, "
+            f"past the end of {event_file_path}"
+        )
+
+    if len(missing) > 0:
+        message = (
+            f"{len(missing)} events have no responses, e.g. on lines "
+            f"{', '.join(str(line_num + 1) for line_num in missing[:10])}"
+        )
+        if not allow_missing:
+            raise ValueError(message)
+        logger.warning(message)
+    return missing
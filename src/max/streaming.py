@@ -0,0 +1,177 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+INPUT_FORMATS = ['text', 'jsonl']
+
+_END = object()
+
+
+class _Request:
+    """An event read from the input, or the error that prevented reading
+    it.
+    """
+    def __init__(self, line_num, event=None, id=None, error=None):
+        self.line_num = line_num
+        self.event = event
+        self.id = id
+        self.error = error
+
+
+def parse_request(line_num: int, line: str, input_format: str) -> _Request:
+    """Parse a line of input: in the text format, the event itself; in the
+    jsonl format, either a json string, or an object with an "event" and
+    an optional "id", echoed in the output to match responses to requests.
+    """
+    if input_format == 'text':
+        return _Request(line_num, event=line.strip())
+    try:
+        request = json.loads(line)
+        if isinstance(request, str):
+            return _Request(line_num, event=request)
+        if isinstance(request, dict) and \
+                isinstance(request.get('event'), str):
+            return _Request(
+                line_num, event=request['event'], id=request.get('id')
+            )
+        id = request.get('id') if isinstance(request, dict) else None
+        return _Request(
+            line_num, id=id,
+            error='Expected a json string or an object with an "event"'
+        )
+    except json.JSONDecodeError as e:
+        return _Request(line_num, error=f"Invalid json: {e}")
+
+
+def micro_batches(
+    lines: Iterable[str], batch_size: int, flush_interval: float
+) -> Iterator[List[Tuple[int, str]]]:
+    """Group the non-blank lines of `lines`, with their line numbers, into
+    batches of at most `batch_size` lines. A batch is yielded once full,
+    once `flush_interval` seconds have passed since its first line was
+    read, or at the end of the input, whichever comes first, so a trickle
+    of lines is not held back waiting for a full batch. Lines read by then
+    join the batch even if `flush_interval` is 0.
+
+    Lines are read in a background thread, so that lines arriving while a
+    batch is processed are ready for the next one.
+    """
+    lines_queue = queue.Queue()
+
+    def read():
+        try:
+            for line_num, line in enumerate(lines):
+                if line.strip() != '':
+                    lines_queue.put((line_num, line))
+        finally:
+            lines_queue.put(_END)
+
+    reader = threading.Thread(target=read, name="stream-reader", daemon=True)
+    reader.start()
+    done = False
+    while not done:
+        item = lines_queue.get()
+        if item is _END:
+            break
+        batch = [item]
+        deadline = time.monotonic() + flush_interval
+        while len(batch) < batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    item = lines_queue.get(timeout=timeout)
+                else:
+                    # Lines that are already read still join the batch.
+                    item = lines_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _END:
+                done = True
+                break
+            batch.append(item)
+        yield batch
+
+
+def _response_record(
+    request: _Request, response_lst=None, error: Optional[str] = None
+) -> dict:
+    record = {"line": request.line_num}
+    if request.id is not None:
+        record["id"] = request.id
+    if request.event is not None:
+        record["event"] = request.event
+    if error is not None:
+        record["error"] = error
+    else:
+        responses = response_lst[0] if len(response_lst) > 0 else []
+        record["responses"] = [r.to_json() for r in responses]
+    return record
+
+
+def stream_responses(
+    sarcasm_generator, in_fp, out_fp, input_format: str = 'text',
+    batch_size: int = 1, flush_interval: float = 0.05
+) -> int:
+    """Read events from `in_fp` and write the responses to each to
+    `out_fp`, one json object per line, as soon as they are generated.
+
+    Events are processed in micro-batches (see `micro_batches`) with
+    `SarcasmGenerator.generate_responses_batch`, or one at a time with
+    `generate_responses` if `batch_size` is 1. The output is flushed after
+    each batch, in input order. Each output line holds the line number of
+    the event, its "id" if given (see `parse_request`), the event and its
+    "responses", or an "error" if the line could not be read or the
+    responses could not be generated; errors do not stop the stream.
+
+    Returns:
+        `int`: the number of events read
+    """
+    assert input_format in INPUT_FORMATS, input_format
+    num_events = 0
+    for batch in micro_batches(in_fp, batch_size, flush_interval):
+        requests = [
+            parse_request(line_num, line, input_format)
+            for line_num, line in batch
+        ]
+        valid_requests = [
+            request for request in requests if request.error is None
+        ]
+        events = [request.event for request in valid_requests]
+        num_events += len(events)
+        records = {}
+        try:
+            if len(events) == 1:
+                response_lsts = [sarcasm_generator.generate_responses(
+                    events[0], num_responses=1
+                )]
+            elif len(events) > 1:
+                response_lsts = sarcasm_generator.generate_responses_batch(
+                    events, num_responses=1
+                )
+            else:
+                response_lsts = []
+            for request, response_lst in zip(valid_requests, response_lsts):
+                records[request.line_num] = \
+                    _response_record(request, response_lst)
+        except Exception as e:
+            logger.exception(
+                f"Failed to generate responses for {len(events)} events"
+            )
+            for request in valid_requests:
+                records[request.line_num] = _response_record(
+                    request, error=f"{type(e).__name__}: {e}"
+                )
+        for request in requests:
+            record = records.get(request.line_num)
+            if record is None:
+                record = _response_record(request, error=request.error)
+            out_fp.write(json.dumps(record) + '\n')
+        out_fp.flush()
+    return num_events
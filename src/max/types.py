@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from enum import Enum
 from typing import List, Dict, Optional
 
 
@@ -26,6 +27,113 @@ class ExplainableSarcasticResponse(object):
             "response_texts": self.response_texts
         }
 
+class RelationType(str, Enum):
+    xIntent = 'xIntent'
+    xNeed = 'xNeed'
+    xAttr = 'xAttr'
+    xWant = 'xWant'
+    xReact = 'xReact'
+    xEffect = 'xEffect'
+
+
+class RelationSubject(str, Enum):
+    event = 'event'
+    failed_expectation = 'failed_expectation'
+
+
+class Norm(str, Enum):
+    maxim_of_quality = 'maxim of quality'
+
+
+class ResponseContext(object):
+    """The event and failed expectation shared by all the responses
+    generated for them.
+    """
+    __slots__ = ('event', 'failed_expectation')
+
+    def __init__(self, event: str, failed_expectation: str):
+        self.event = event
+        self.failed_expectation = failed_expectation
+
+
+class CompactSarcasticResponse(object):
+    """Memory-efficient equivalent of `ExplainableSarcasticResponse`.
+
+    Instances have no `__dict__`, refer to a `ResponseContext` shared with
+    the other responses to the same event and expectation, and hold enum
+    members instead of strings for the relation type, subject and norm.
+    """
+    __slots__ = (
+        'context', 'relation_type', 'relation_subject', 'relation_object',
+        'norm_violated', 'response_texts'
+    )
+
+    def __init__(
+        self,
+        context: ResponseContext,
+        relation_type: RelationType,
+        relation_subject: RelationSubject,
+        relation_object: str,
+        norm_violated: Norm,
+        response_texts: List[str]
+    ):
+        self.context = context
+        self.relation_type = RelationType(relation_type)
+        self.relation_subject = RelationSubject(relation_subject)
+        self.relation_object = relation_object
+        self.norm_violated = Norm(norm_violated)
+        self.response_texts = response_texts
+
+    @property
+    def event(self):
+        return self.context.event
+
+    @property
+    def failed_expectation(self):
+        return self.context.failed_expectation
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactSarcasticResponse):
+            return NotImplemented
+        return self.to_json() == other.to_json()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_json()})"
+
+    def to_json(self):
+        return {
+            "event": self.context.event,
+            "failed_expectation": self.context.failed_expectation,
+            "relation_type": self.relation_type.value,
+            "relation_subject": self.relation_subject.value,
+            "relation_object": self.relation_object,
+            "norm_violated": self.norm_violated.value,
+            "response_texts": self.response_texts
+        }
+
+    def to_response(self) -> ExplainableSarcasticResponse:
+        return ExplainableSarcasticResponse(**self.to_json())
+
+    @classmethod
+    def from_response(
+        cls,
+        response: ExplainableSarcasticResponse,
+        context: Optional[ResponseContext] = None
+    ):
+        if context is None:
+            context = ResponseContext(
+                response.event, response.failed_expectation
+            )
+        return cls(
+            context,
+            response.relation_type,
+            response.relation_subject,
+            response.relation_object,
+            response.norm_violated,
+            response.response_texts
+        )
+
+
 @dataclass
 class CommonsenseBuilderResponse(object):
     """
@@ -0,0 +1,170 @@
+import contextlib
+import json
+import logging
+import math
+import pathlib
+import time
+
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+from max.resources import _commonsense_builders
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+# Events covering the patterns of `PatternNegationExpectationExtractor`, of
+# various lengths, so that the models see a range of input shapes.
+WARMUP_EVENTS = [
+    'Ben won the marathon',
+    'Ben does not win marathons',
+    'I ran out of characters',
+    'Ben is not winning the race this year',
+    'Ben wins marathons',
+    'Ben was late for the meeting with his new manager',
+    'Ben did eat the cake',
+    'Ben forgot his keys',
+]
+
+
+@dataclass
+class WarmupReport:
+    # Seconds spent paging the on-disk caches in.
+    preload_time: float = 0.0
+    # Mean seconds per event, for each round of warm-up events.
+    round_latencies: List[float] = field(default_factory=list)
+    # Whether the latency settled before the maximum number of rounds.
+    steady: bool = False
+
+
+def preload_caches(sarcasm_generator):
+    """Read the on-disk caches of `sarcasm_generator` (response store,
+    retrieval index) into memory.
+    """
+    if sarcasm_generator.response_store is not None:
+        sarcasm_generator.response_store.preload()
+    for builder in _commonsense_builders(sarcasm_generator):
+        if hasattr(builder, 'preload'):
+            builder.preload()
+
+
+@contextlib.contextmanager
+def _patched(obj, attr, value):
+    original = getattr(obj, attr)
+    setattr(obj, attr, value)
+    try:
+        yield
+    finally:
+        setattr(obj, attr, original)
+
+
+@contextlib.contextmanager
+def _without_caches(sarcasm_generator):
+    """Bypass the response store and the caches of the components of
+    `sarcasm_generator`, and reuse nothing from, and insert nothing into,
+    its retrieval index, so that every stage does the work it does for a
+    new event, and the caches are left as they were.
+    """
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(
+            _patched(sarcasm_generator, 'response_store', None)
+        )
+        components = [sarcasm_generator.expectation_extractor]
+        for builder in _commonsense_builders(sarcasm_generator):
+            components.append(builder)
+            sentiment_analyser = getattr(builder, 'sentiment_analyser', None)
+            if sentiment_analyser is not None:
+                components.append(sentiment_analyser)
+        for component in components:
+            if getattr(component, 'cache', None) is not None:
+                stack.enter_context(_patched(component, 'cache', None))
+            if hasattr(component, 'insert_misses'):
+                # Retrieval builders: neighbours are still searched for.
+                stack.enter_context(
+                    _patched(component, 'threshold', math.inf)
+                )
+                stack.enter_context(
+                    _patched(component, 'insert_misses', False)
+                )
+        response_generator = sarcasm_generator.response_generator
+        if getattr(response_generator, 'cache', None) is not None:
+            cache = response_generator.cache
+            response_generator.set_cache(None)
+            stack.callback(response_generator.set_cache, cache)
+        yield
+
+
+def warm_up(
+    sarcasm_generator,
+    events: Optional[List[str]] = None,
+    min_rounds: int = 2,
+    max_rounds: int = 10,
+    tolerance: float = 0.1,
+    ready_file: Optional[str] = None
+) -> WarmupReport:
+    """Pay the one-off costs of `sarcasm_generator` before serving: page in
+    its on-disk caches, then run rounds of `events` through every stage,
+    bypassing the response store, the caches and the retrieval index (see
+    `_without_caches`), until the mean latency of a round is within
+    `tolerance` of the previous round's, or for `max_rounds` rounds.
+
+    Args:
+        sarcasm_generator (`SarcasmGenerator`):
+            the generator to warm up
+        events (`List[str]`):
+            the events of each round; defaults to `WARMUP_EVENTS`
+        min_rounds (`int`):
+            the minimum number of rounds
+        max_rounds (`int`):
+            the maximum number of rounds
+        tolerance (`float`):
+            the relative change in latency between rounds under which the
+            latency is considered steady
+        ready_file (`str`):
+            if set, removed when the warm-up starts, and written with the
+            report once it ends, e.g. for a readiness probe
+
+    Returns:
+        `WarmupReport`: the latency of each round
+    """
+    events = events or WARMUP_EVENTS
+    if ready_file is not None:
+        pathlib.Path(ready_file).unlink(missing_ok=True)
+    report = WarmupReport()
+
+    start_time = time.perf_counter()
+    preload_caches(sarcasm_generator)
+    report.preload_time = time.perf_counter() - start_time
+
+    with _without_caches(sarcasm_generator):
+        for _ in range(max_rounds):
+            start_time = time.perf_counter()
+            for event in events:
+                sarcasm_generator.generate_responses(event)
+            latency = (time.perf_counter() - start_time) / len(events)
+            report.round_latencies.append(latency)
+            logger.info(
+                f"Warm-up round {len(report.round_latencies)}: "
+                f"{latency * 1000:.1f}ms per event"
+            )
+            if len(report.round_latencies) >= max(min_rounds, 2) and \
+                    abs(latency - report.round_latencies[-2]) \
+                    <= tolerance * report.round_latencies[-2]:
+                report.steady = True
+                break
+
+    if not report.steady:
+        logger.warning(
+            f"Latency did not settle within {max_rounds} warm-up rounds"
+        )
+    logger.info(
+        f"Ready after {len(report.round_latencies)} warm-up rounds, "
+        f"first {report.round_latencies[0] * 1000:.1f}ms per event, "
+        f"last {report.round_latencies[-1] * 1000:.1f}ms per event"
+    )
+    if ready_file is not None:
+        tmp_path = pathlib.Path(f"{ready_file}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump(asdict(report), fp)
+        tmp_path.replace(ready_file)
+    return report
@@ -0,0 +1,126 @@
+import json
+import operator
+
+from typing import Iterable, Iterator
+
+
+RESPONSE_FIELDS = [
+    "event", "failed_expectation", "relation_type", "relation_subject",
+    "relation_object", "norm_violated", "response_texts"
+]
+# Columns with few distinct values, stored dictionary-encoded.
+DICTIONARY_FIELDS = [
+    "event", "failed_expectation", "relation_type", "relation_subject",
+    "norm_violated"
+]
+_get_response_fields = operator.attrgetter(*RESPONSE_FIELDS)
+
+
+class JsonResponseWriter:
+    """Writes the responses to each event as an indented json list."""
+    def __init__(self, output_file_path):
+        self.fp = open(output_file_path, 'w', encoding='utf-8')
+
+    def write(self, responses: Iterable):
+        json.dump([r.to_json() for r in responses], self.fp, indent=2)
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ParquetResponseWriter:
+    """Writes responses to a Parquet file, one row per response.
+
+    Rows are buffered and written in row groups of `row_group_size`, so
+    memory stays bounded for large batches. Columns that repeat across
+    responses (event, failed expectation, relation type and subject, norm)
+    are dictionary-encoded. Requires pyarrow.
+
+    Accepts both `ExplainableSarcasticResponse` and
+    `CompactSarcasticResponse` objects.
+    """
+    def __init__(
+        self, output_file_path, row_group_size=100_000, compression='zstd'
+    ):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError(
+                "ParquetResponseWriter requires pyarrow: pip install pyarrow"
+            ) from e
+        self.pa = pa
+        self.schema = pa.schema([
+            (field, pa.list_(pa.string()))
+            if field == "response_texts"
+            else (field, pa.dictionary(pa.int32(), pa.string()))
+            if field in DICTIONARY_FIELDS
+            else (field, pa.string())
+            for field in RESPONSE_FIELDS
+        ])
+        self.writer = pq.ParquetWriter(
+            output_file_path, self.schema, compression=compression
+        )
+        self.row_group_size = row_group_size
+        self.columns = {field: [] for field in RESPONSE_FIELDS}
+        self.num_buffered = 0
+
+    def write(self, responses: Iterable):
+        # The fields are read directly rather than through `to_json`, which
+        # builds a dictionary per response. The enums of
+        # `CompactSarcasticResponse` are strings, which pyarrow takes as is.
+        rows = [_get_response_fields(r) for r in responses]
+        for field, values in zip(RESPONSE_FIELDS, zip(*rows)):
+            self.columns[field].extend(values)
+        self.num_buffered += len(rows)
+        if self.num_buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.num_buffered == 0:
+            return
+        arrays = [
+            self.pa.array(self.columns[field]).dictionary_encode()
+            if field in DICTIONARY_FIELDS
+            else self.pa.array(self.columns[field], type=field_type.type)
+            for field, field_type in zip(RESPONSE_FIELDS, self.schema)
+        ]
+        # dictionary_encode picks int32 indices, matching the schema.
+        self.writer.write_table(
+            self.pa.Table.from_arrays(arrays, schema=self.schema)
+        )
+        self.columns = {field: [] for field in RESPONSE_FIELDS}
+        self.num_buffered = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_parquet_responses(input_file_path) -> Iterator[dict]:
+    """Iterate over the responses in a file written by
+    `ParquetResponseWriter`, as dictionaries (see `to_json`).
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(input_file_path)
+    for batch in parquet_file.iter_batches():
+        yield from batch.to_pylist()
+
+
+RESPONSE_WRITERS = {
+    "json": JsonResponseWriter,
+    "parquet": ParquetResponseWriter
+}
@@ -0,0 +1,92 @@
+import argparse
+import itertools
+import logging
+import sys
+
+from max import (
+    PatternNegationExpectationExtractor, CometCommonsenseBuilder,
+    PatternResponseGenerator, SarcasmGenerator
+)
+from max.memory import MemoryMonitor
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Run the pipeline over many distinct synthetic events and check "
+            "that memory stays flat."
+        )
+    )
+    parser.add_argument(
+        "--event_file_path",
+        type=str,
+        default="input/events.txt",
+        help="Events from which synthetic events are derived."
+    )
+    parser.add_argument(
+        "--num_events",
+        type=int,
+        default=10000,
+        help="Number of synthetic events to process."
+    )
+    parser.add_argument(
+        "--sample_every",
+        type=int,
+        default=500,
+        help="Sample the resident set size every this many events."
+    )
+    parser.add_argument(
+        "--lean",
+        action="store_true",
+        help="Run the sarcasm generator in lean mode."
+    )
+    parser.add_argument(
+        "--max_growth_mb_per_1k_events",
+        type=float,
+        default=1.0,
+        help=(
+            "Fail if memory grows faster than this, once the first quarter "
+            "of the run is over."
+        )
+    )
+    return parser.parse_args()
+
+
+def synthetic_events(event_file_path, num_events):
+    """Vary the subject of each seed event, so that every synthetic event
+    brings new strings, as a large real input would.
+    """
+    with open(event_file_path, 'r', encoding='utf-8') as fp:
+        seed_events = [line.strip() for line in fp if len(line.strip()) > 0]
+    for it_num, event in zip(range(num_events), itertools.cycle(seed_events)):
+        subject, _, rest = event.partition(' ')
+        yield f"{subject}{it_num} {rest}"
+
+
+def main(args):
+    sarcasm_generator = SarcasmGenerator(
+        PatternNegationExpectationExtractor.default(),
+        CometCommonsenseBuilder.default(),
+        PatternResponseGenerator.default(),
+        lean=args.lean
+    )
+    memory_monitor = MemoryMonitor(every=args.sample_every)
+    for event in synthetic_events(args.event_file_path, args.num_events):
+        sarcasm_generator.generate_responses(event)
+        memory_monitor.step()
+    report = memory_monitor.report()
+    if report["growth_per_1k_events_mb"] > args.max_growth_mb_per_1k_events:
+        logger.error(
+            f"Memory grew by {report['growth_per_1k_events_mb']:.2f} MB per "
+            f"1000 events, more than {args.max_growth_mb_per_1k_events} MB"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level="INFO")
+    sys.exit(main(parse_args()))
@@ -0,0 +1,81 @@
+import argparse
+import logging
+import os
+import pathlib
+
+from max.sharding import merge_shards
+from max.writers import RESPONSE_WRITERS
+
+
+logger = logging.getLogger('sarcasm_generator')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Merge the shard outputs of src/main.py --num_shards into a "
+            "single output file, in the order of the event file."
+        )
+    )
+    parser.add_argument(
+        "--event_file_path",
+        type=str,
+        required=True,
+        help="The event file the shards were built from."
+    )
+    parser.add_argument(
+        "--shard_dir",
+        type=str,
+        required=True,
+        help="The directory holding the shard outputs."
+    )
+    parser.add_argument(
+        "--num_shards",
+        type=int,
+        required=True,
+        help="The number of shards."
+    )
+    parser.add_argument(
+        "--output_file_path",
+        type=str,
+        required=True,
+        help="Where to save the merged responses."
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        choices=list(RESPONSE_WRITERS.keys()),
+        default="json",
+        help="Format of the output file."
+    )
+    parser.add_argument(
+        "--allow_missing",
+        action="store_true",
+        help=(
+            "Write the output even if some events have no responses, e.g. "
+            "because a shard failed. By default, the merge fails instead."
+        )
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level="INFO")
+    args = parse_args()
+    output_file_path = pathlib.Path(args.output_file_path)
+    # Write to a temporary file, so that a failed merge leaves no output.
+    tmp_path = output_file_path.with_name(output_file_path.name + '.tmp')
+    try:
+        with RESPONSE_WRITERS[args.output_format](tmp_path) as writer:
+            missing = merge_shards(
+                args.event_file_path, args.shard_dir, args.num_shards, writer,
+                allow_missing=args.allow_missing
+            )
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, output_file_path)
+    logger.info(
+        f"Saved responses to {output_file_path} "
+        f"({len(missing)} events missing)"
+    )
@@ -0,0 +1,39 @@
+import argparse
+import logging
+
+from max.commonsense_builders.sentiment_service import serve_sentiment
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--socket_path",
+        type=str,
+        required=True,
+        help="The Unix socket to serve sentiment scores on."
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=256,
+        help="Maximum number of texts scored together."
+    )
+    parser.add_argument(
+        "--max_wait",
+        type=float,
+        default=0.002,
+        help=(
+            "How long, in seconds, a request waits for requests from other "
+            "processes to be scored with."
+        )
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level="INFO")
+    args = parse_args()
+    serve_sentiment(
+        args.socket_path, max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait
+    )
@@ -0,0 +1,127 @@
+import pathlib
+import tempfile
+import unittest
+
+import spacy
+
+from spacy.tokens import Doc
+
+from max.commonsense_builders.atomic_builder import (
+    AtomicIndexCommonsenseBuilder, build_atomic_index, load_atomic_index,
+    normalize_event
+)
+
+
+ATOMIC_CSV = '''event,oEffect,oReact,oWant,xAttr,xEffect,xIntent,xNeed,xReact,xWant,prefix,split
+PersonX wins the marathon,"[]","[]","[]","[""athletic"", ""fast""]","[""gets a medal""]","[""to win""]","[""to train""]","[""proud""]","[""to celebrate""]","[]",trn
+PersonX loses the marathon,"[]","[]","[]","[""none""]","[""cries""]","[]","[]","[""sad""]","[]","[]",trn
+'''
+
+
+class EchoBuilder:
+    def __init__(self):
+        self.inputs = []
+        self.batches = []
+
+    def build_comet_commonsense(self, input, sampling):
+        self.inputs.append(input)
+        return {'xAttr': ['echo']}
+
+    def build_comet_commonsense_batch(self, inputs, sampling):
+        self.batches.append(inputs)
+        return [self.build_comet_commonsense(i, sampling) for i in inputs]
+
+    def remove_comet_overlap(self, in_cs, exp_cs=None):
+        return in_cs, exp_cs
+
+
+class TestAtomicIndexCommonsenseBuilder(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        tmp_path = pathlib.Path(self.tmp_dir.name)
+        (tmp_path / 'atomic.csv').write_text(ATOMIC_CSV, encoding='utf-8')
+        spacy_processor = spacy.load('en_core_web_sm')
+        build_atomic_index(
+            [tmp_path / 'atomic.csv'], tmp_path / 'index.pickle',
+            spacy_processor
+        )
+        self.fallback_builder = EchoBuilder()
+        self.builder = AtomicIndexCommonsenseBuilder(
+            load_atomic_index(tmp_path / 'index.pickle'), spacy_processor,
+            self.fallback_builder
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_build_comet_commonsense(self):
+        for event in [
+            'PersonX wins the marathon', 'Ben won the marathon',
+            'ben won the marathon.'
+        ]:
+            obts = self.builder.build_comet_commonsense(event, 'beam-10')
+            self.assertListEqual(obts['xAttr'], ['athletic', 'fast'])
+            self.assertListEqual(obts['xEffect'], ['gets a medal'])
+        self.assertListEqual(self.fallback_builder.inputs, [])
+
+        obts = self.builder.build_comet_commonsense(
+            'Ben lost the marathon', 'beam-10'
+        )
+        self.assertListEqual(obts['xAttr'], ['echo'])
+        self.assertListEqual(
+            self.fallback_builder.inputs, ['Ben lost the marathon']
+        )
+
+    def test_build_commonsense(self):
+        cs_obt, raw_cs_obt = self.builder.build_commonsense(
+            'Ben won the marathon', 'Ben lost the marathon'
+        )
+        self.assertListEqual(cs_obt.event_obts['xAttr'], ['athletic', 'fast'])
+        self.assertListEqual(
+            cs_obt.failed_expectation_obts['xAttr'], ['echo']
+        )
+        self.assertListEqual(
+            raw_cs_obt.event_obts['xAttr'], ['athletic', 'fast']
+        )
+        _, raw_cs_obt = self.builder.build_commonsense(
+            'Ben won the marathon', keep_raw=False
+        )
+        self.assertIsNone(raw_cs_obt)
+
+    def test_no_xattr(self):
+        # Events without xAttr objects are left to the fallback builder.
+        obts = self.builder.build_comet_commonsense(
+            'PersonX loses the marathon', 'beam-10'
+        )
+        self.assertListEqual(obts['xAttr'], ['echo'])
+
+    def test_normalize_event(self):
+        vocab = spacy.load('en_core_web_sm').vocab
+        sp_obt = Doc(
+            vocab, words=['My', 'brother', 'won', 'the', 'marathon', '.'],
+            lemmas=['my', 'brother', 'win', 'the', 'marathon', '.'],
+            heads=[1, 2, 2, 4, 2, 2],
+            deps=['poss', 'nsubj', 'ROOT', 'det', 'dobj', 'punct']
+        )
+        self.assertEqual(normalize_event(sp_obt), 'personx win the marathon')
+
+    def test_build_comet_commonsense_batch(self):
+        obts_lst = self.builder.build_comet_commonsense_batch([
+            'Ben lost the marathon', 'Ben won the marathon',
+            'Ben ate the cake'
+        ], 'beam-10')
+        self.assertListEqual(
+            [obts['xAttr'] for obts in obts_lst],
+            [['echo'], ['athletic', 'fast'], ['echo']]
+        )
+        # The misses go to the fallback builder in one batch.
+        self.assertListEqual(
+            self.fallback_builder.batches,
+            [['Ben lost the marathon', 'Ben ate the cake']]
+        )
+        self.assertEqual(self.builder.num_hits, 1)
+        self.assertEqual(self.builder.num_misses, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
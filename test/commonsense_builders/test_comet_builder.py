@@ -0,0 +1,60 @@
+import random
+import unittest
+
+from max.commonsense_builders.comet_builder import (
+    ObtVocabulary, obt_in, obts_diff, obts_inters, obts_unique
+)
+
+
+WORDS = [
+    'win', 'winning', 'the', 'race', 'to', 'a', 'medal', 'get', 'gets',
+    'happy', 'be', 'you', 'train', 'hard', 'ning', 'rac'
+]
+
+
+def random_obts(rng, num_obts):
+    return [
+        ' '.join(rng.choices(WORDS, k=rng.randint(0, 4)))
+        for _ in range(num_obts)
+    ] + ['none', 'the', 'win', 'win the race']
+
+
+class TestObtVocabulary(unittest.TestCase):
+    def test_same_as_obt_eq(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            obts1 = random_obts(rng, rng.randint(0, 30))
+            obts2 = random_obts(rng, rng.randint(0, 30))
+            vocab = ObtVocabulary(obts1 + obts2)
+            self.assertListEqual(vocab.unique(obts1), obts_unique(obts1))
+            self.assertListEqual(
+                vocab.inters(obts1, obts2), obts_inters(obts1, obts2)
+            )
+            self.assertListEqual(
+                vocab.diff(obts1, obts2), obts_diff(obts1, obts2)
+            )
+            bits = vocab.bits(obts2)
+            for obt in obts1:
+                self.assertEqual(
+                    vocab.eq_any(obt, bits), obt_in(obt, obts2)
+                )
+
+    def test_affixes(self):
+        vocab = ObtVocabulary([
+            'win', 'win the race', 'the race', 'winning', 'ace', 'lose',
+            'the'
+        ])
+        bits = vocab.bits(['win the race'])
+        # Equal after removing stop words, prefix and suffix.
+        for obt in ['win', 'the race', 'ace', 'the']:
+            self.assertTrue(vocab.eq_any(obt, bits), obt)
+        for obt in ['winning', 'lose']:
+            self.assertFalse(vocab.eq_any(obt, bits), obt)
+        self.assertListEqual(
+            vocab.unique(['lose', 'win the race', 'the race', 'ace']),
+            ['lose', 'win the race']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import tempfile
+import threading
+import unittest
+
+import spacy
+
+from spacy.tokens import Doc
+
+from max.commonsense_builders.retrieval_builder import (
+    EventVectorIndex, RetrievalCommonsenseBuilder, embed_text
+)
+
+
+LEMMAS = {'won': 'win', 'wins': 'win', 'did': 'do'}
+
+
+class LemmaProcessor:
+    """Whitespace tokenizer with a fixed lemma table, standing in for
+    spacy.
+    """
+    def __init__(self):
+        self.vocab = spacy.blank('en').vocab
+        self.num_calls = 0
+
+    def __call__(self, text):
+        self.num_calls += 1
+        words = text.split()
+        return Doc(
+            self.vocab, words=words,
+            lemmas=[LEMMAS.get(word.lower(), word.lower()) for word in words]
+        )
+
+
+class EchoBuilder:
+    def __init__(self):
+        self.inputs = []
+
+    def build_comet_commonsense(self, input, sampling):
+        self.inputs.append(input)
+        return {'xAttr': [input]}
+
+
+class TestEventVectorIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_search(self):
+        index = EventVectorIndex.load(self.tmp_dir.name)
+        for key in ['personx win the marathon', 'personx eat a cake']:
+            index.add(key, embed_text(key), {'xAttr': [key]})
+
+        similarity, key, obts = index.search(
+            embed_text('personx win the marathon')
+        )[0]
+        self.assertAlmostEqual(similarity, 1.0, places=5)
+        self.assertEqual(key, 'personx win the marathon')
+
+        similarity, key, obts = index.search(
+            embed_text('personx bake a cake')
+        )[0]
+        self.assertLess(similarity, 0.9)
+        self.assertEqual(key, 'personx eat a cake')
+
+    def test_save_and_load(self):
+        index = EventVectorIndex.load(self.tmp_dir.name)
+        index.add(
+            'personx win the marathon',
+            embed_text('personx win the marathon'),
+            {'xAttr': ['athletic']}
+        )
+        index.save()
+        index.add(
+            'personx eat a cake', embed_text('personx eat a cake'),
+            {'xAttr': ['hungry']}
+        )
+        # Unsaved events are not visible to other readers.
+        self.assertEqual(len(EventVectorIndex.load(self.tmp_dir.name)), 1)
+
+        index.save()
+        index = EventVectorIndex.load(self.tmp_dir.name)
+        self.assertEqual(len(index), 2)
+        _, key, obts = index.search(embed_text('personx eat a cake'))[0]
+        self.assertEqual(key, 'personx eat a cake')
+        self.assertDictEqual(obts, {'xAttr': ['hungry']})
+
+
+class TestRetrievalCommonsenseBuilder(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fallback_builder = EchoBuilder()
+        # A low threshold, so that an event and its negation are neighbours.
+        self.builder = RetrievalCommonsenseBuilder(
+            EventVectorIndex.load(self.tmp_dir.name), LemmaProcessor(),
+            self.fallback_builder, threshold=0.5
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_negation(self):
+        for event in [
+            'Ben won the race', 'Ben did not win the race',
+            'Ben wins the race', 'Ben did not win the race'
+        ]:
+            self.builder.build_comet_commonsense(event, 'beam-10')
+        # The negated event is not answered with the commonsense of the
+        # positive one, nor the other way around.
+        self.assertListEqual(
+            self.fallback_builder.inputs,
+            ['Ben won the race', 'Ben did not win the race']
+        )
+        self.assertListEqual(
+            self.builder.build_comet_commonsense(
+                'Ben did not win the race', 'beam-10'
+            )['xAttr'],
+            ['Ben did not win the race']
+        )
+        self.assertListEqual(
+            sorted(self.builder.index.keys),
+            ['personx do not win the race', 'personx win the race']
+        )
+        # Each input is normalized once, misses included.
+        self.assertEqual(self.builder.spacy_processor.num_calls, 5)
+
+    def test_concurrent(self):
+        self.builder.save_every = 2
+        events = [f"Ben won race {i}" for i in range(20)]
+
+        def run():
+            for event in events:
+                self.builder.build_comet_commonsense(event, 'beam-10')
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.builder.save()
+        self.assertEqual(
+            self.builder.num_hits + self.builder.num_misses, 4 * len(events)
+        )
+        # Each event is indexed once, with its own vector, whatever the
+        # interleaving of the insertions and saves.
+        index = EventVectorIndex.load(self.tmp_dir.name)
+        self.assertEqual(len(index), len(set(index.keys)))
+        self.assertEqual(len(index.vectors), len(index))
+        for key in index.keys:
+            similarity, neighbour_key, _ = index.search(embed_text(key))[0]
+            self.assertEqual(neighbour_key, key)
+
+
+if __name__ == '__main__':
+    unittest.main()
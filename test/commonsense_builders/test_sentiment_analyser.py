@@ -2,7 +2,7 @@ import pathlib
 import unittest
 
 from max.commonsense_builders.sentiment_analyser import (
-    SentimentAnalyser
+    SentimentAnalyser, length_bucketed_batches
 )
 
 
@@ -20,6 +20,36 @@ class TestSentimentAnalyser(unittest.TestCase):
             "negative"
         )
 
+    def test_get_sentiment_batch(self):
+        texts = [
+            "Thank you very much",
+            "I am very tired",
+            "I am very tired of waiting for the bus every single morning",
+            "Thanks"
+        ]
+        self.assertListEqual(
+            self.analyser.get_sentiment_batch(texts, batch_size=2),
+            [self.analyser.get_sentiment(text) for text in texts]
+        )
+
+
+class TestLengthBucketedBatches(unittest.TestCase):
+    def test_batch_size(self):
+        lengths = [5, 30, 4, 12, 6, 29]
+        self.assertListEqual(
+            list(length_bucketed_batches(lengths, batch_size=2)),
+            [[2, 0], [4, 3], [5, 1]]
+        )
+
+    def test_max_tokens(self):
+        lengths = [5, 30, 4, 12, 6, 29]
+        self.assertListEqual(
+            list(length_bucketed_batches(
+                lengths, batch_size=4, max_tokens=40
+            )),
+            [[2, 0, 4], [3], [5], [1]]
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,98 @@
+"""A local stand-in for a Redis server, speaking enough of its protocol
+(RESP) for `max.cache.RedisCache`: PING, SELECT, GET, MGET, SET (with EX
+and PX), DEL, FLUSHDB and DBSIZE.
+"""
+import socketserver
+import threading
+import time
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line.startswith(b'*'), line
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def write_bulk(self, value):
+        if value is None:
+            self.wfile.write(b'$-1\r\n')
+        else:
+            self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value))
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            server.commands.append(command.decode())
+            with server.lock:
+                if command == b'PING':
+                    self.wfile.write(b'+PONG\r\n')
+                elif command == b'SELECT':
+                    self.wfile.write(b'+OK\r\n')
+                elif command == b'GET':
+                    self.write_bulk(server.get(args[1]))
+                elif command == b'MGET':
+                    self.wfile.write(b'*%d\r\n' % (len(args) - 1))
+                    for key in args[1:]:
+                        self.write_bulk(server.get(key))
+                elif command == b'SET':
+                    expiry_time = None
+                    if len(args) == 5:
+                        unit = 1.0 if args[3].upper() == b'EX' else 0.001
+                        expiry_time = time.monotonic() + int(args[4]) * unit
+                    server.data[args[1]] = (args[2], expiry_time)
+                    self.wfile.write(b'+OK\r\n')
+                elif command == b'DEL':
+                    num_deleted = sum(
+                        server.data.pop(key, None) is not None
+                        for key in args[1:]
+                    )
+                    self.wfile.write(b':%d\r\n' % num_deleted)
+                elif command == b'FLUSHDB':
+                    server.data.clear()
+                    self.wfile.write(b'+OK\r\n')
+                elif command == b'DBSIZE':
+                    self.wfile.write(b':%d\r\n' % len(server.data))
+                else:
+                    self.wfile.write(
+                        b"-ERR unknown command '%s'\r\n" % args[0]
+                    )
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """Serves on a free local port, in a background thread, until `close`.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.data = {}
+        self.lock = threading.Lock()
+        self.commands = []
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def get(self, key):
+        value, expiry_time = self.data.get(key, (None, None))
+        if expiry_time is not None and expiry_time <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,68 @@
+import unittest
+
+from max.response_generators.templates import (
+    CompiledTemplate, ResponseTemplates
+)
+
+
+FRAGMENTS = {"interj": ["Yay!", "Brilliant!"], "compl": ["Good job"]}
+
+
+def upper_inflect_batch(obts, tag, context):
+    return [f"{obt.upper()} ({tag}, {context})" for obt in obts]
+
+
+class TestResponseTemplates(unittest.TestCase):
+    def setUp(self):
+        templates = {
+            "xNeed": {
+                "P": [CompiledTemplate.compile(
+                    "{interj} {compl} not {obt:VBG:I}.", FRAGMENTS
+                )],
+                "not_P": [CompiledTemplate.compile(
+                    "{interj} {compl} {obt}.", FRAGMENTS
+                )]
+            }
+        }
+        self.templates = ResponseTemplates(
+            templates, upper_inflect_batch, seed=0
+        )
+
+    def test_compile(self):
+        template = CompiledTemplate.compile(
+            "{interj} {compl} not {obt:VBG:I}, {obt}.", FRAGMENTS
+        )
+        self.assertListEqual(template.skeletons, [
+            "Yay! Good job not {0}, {1}.", "Brilliant! Good job not {0}, {1}."
+        ])
+        self.assertListEqual(template.obt_slots, [("VBG", "I"), (None, "")])
+        with self.assertRaises(ValueError):
+            CompiledTemplate.compile("{unknown} {obt}", FRAGMENTS)
+
+    def test_render(self):
+        texts = self.templates.render("xNeed", "train", P=True)
+        self.assertEqual(len(texts), 1)
+        self.assertIn(texts[0], [
+            "Yay! Good job not TRAIN (VBG, I).",
+            "Brilliant! Good job not TRAIN (VBG, I)."
+        ])
+
+        self.templates.seed(1)
+        texts = [self.templates.render("xNeed", "train", P=False)]
+        self.templates.seed(1)
+        self.assertListEqual(
+            texts, [self.templates.render("xNeed", "train", P=False)]
+        )
+
+    def test_render_all(self):
+        self.assertListEqual(
+            self.templates.render_all("xNeed", ["train", "rest"], P=False),
+            [
+                ["Yay! Good job train.", "Brilliant! Good job train."],
+                ["Yay! Good job rest.", "Brilliant! Good job rest."]
+            ]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+"""Deterministic, lightweight stand-ins for the COMET and sentiment models.
+
+They plug into the real `CometCommonsenseBuilder` and `SentimentAnalyser`,
+so everything but the models runs as in production, offline and in
+milliseconds. Each model call sleeps for a fixed cost plus a cost per item,
+like a real model, so that batching, caching and overlapping stages pay off
+in the same way.
+"""
+import time
+import zlib
+
+import spacy
+import torch
+
+from max import (
+    CometCommonsenseBuilder, PatternNegationExpectationExtractor,
+    PatternResponseGenerator, SarcasmGenerator
+)
+from max.commonsense_builders import SentimentAnalyser
+
+
+SENTIMENT_LABELS = ['negative', 'neutral', 'positive']
+POSITIVE_WORDS = {
+    'happy', 'proud', 'good', 'great', 'win', 'won', 'celebrate', 'smart',
+    'strong', 'successful', 'relieved', 'excited', 'fast', 'love', 'praise'
+}
+NEGATIVE_WORDS = {
+    'sad', 'tired', 'bad', 'angry', 'lose', 'lost', 'cry', 'lazy', 'weak',
+    'upset', 'disappointed', 'fail', 'failed', 'slow', 'hate', 'rest'
+}
+
+# Relation objects the COMET stand-in draws from, in COMET's raw format.
+COMET_OBJECTS = {
+    'xIntent': [
+        'to win', 'to be the best', 'to celebrate', 'to rest', 'none',
+        'to be happy', 'to get a job'
+    ],
+    'xNeed': [
+        'to train hard', 'to practice', 'to buy shoes', 'to be fast',
+        'to sign up', 'none', 'to go to the store'
+    ],
+    'xAttr': [
+        'happy', 'proud', 'tired', 'strong', 'lazy', 'smart', 'sad',
+        'successful'
+    ],
+    'xWant': [
+        'to celebrate', 'to rest', 'to go home', 'to cry', 'to sleep',
+        'to eat', 'none'
+    ],
+    'xReact': [
+        'happy', 'proud', 'sad', 'tired', 'excited', 'disappointed',
+        'relieved'
+    ],
+    'xEffect': [
+        'personx gets a medal', 'gets tired', 'person x cries', 'wins',
+        'loses weight', 'none', 'gets praised .'
+    ]
+}
+NUM_BEAMS = 5
+
+
+def stable_hash(text):
+    return zlib.crc32(text.encode('utf-8'))
+
+
+class _Encoding(dict):
+    def to(self, device):
+        return self
+
+
+class StubTokenizer:
+    """Whitespace tokenizer with the calling conventions of a Hugging Face
+    tokenizer, as used by `SentimentAnalyser`.
+    """
+    vocab_size = 2 ** 16
+
+    def token_id(self, token):
+        # 0 is padding.
+        return 1 + stable_hash(token.lower()) % (self.vocab_size - 1)
+
+    def __call__(self, texts, padding=False, return_tensors=None):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        input_ids = [
+            [self.token_id(token) for token in text.split()] or [1]
+            for text in texts
+        ]
+        if return_tensors is None:
+            return _Encoding(input_ids=input_ids[0] if single else input_ids)
+        max_len = max(len(ids) for ids in input_ids)
+        assert padding or len(set(len(ids) for ids in input_ids)) == 1
+        return _Encoding(
+            input_ids=torch.tensor([
+                ids + [0] * (max_len - len(ids)) for ids in input_ids
+            ]),
+            attention_mask=torch.tensor([
+                [1] * len(ids) + [0] * (max_len - len(ids))
+                for ids in input_ids
+            ])
+        )
+
+
+class StubSentimentModel:
+    """Scores a text by counting positive and negative words, ignoring
+    padding. Scores are integers, so they do not depend on batching.
+    """
+    def __init__(self, tokenizer, call_cost=0.001, item_cost=0.00005):
+        self.call_cost = call_cost
+        self.item_cost = item_cost
+        self.num_calls = 0
+        # Token id -> (negative, neutral, positive) votes.
+        self.weights = torch.zeros(
+            (tokenizer.vocab_size, 3), dtype=torch.float64
+        )
+        self.weights[:, 1] = 0.5
+        for word in POSITIVE_WORDS:
+            self.weights[tokenizer.token_id(word)] = torch.tensor(
+                [0.0, 0.0, 2.0], dtype=torch.float64
+            )
+        for word in NEGATIVE_WORDS:
+            self.weights[tokenizer.token_id(word)] = torch.tensor(
+                [2.0, 0.0, 0.0], dtype=torch.float64
+            )
+        # Break ties between positive and negative deterministically.
+        self.weights[:, 2] += 0.25
+
+    def __call__(self, input_ids, attention_mask=None):
+        self.num_calls += 1
+        time.sleep(self.call_cost + self.item_cost * input_ids.shape[0])
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        votes = self.weights[input_ids] * attention_mask.unsqueeze(-1)
+        return (votes.sum(dim=1),)
+
+
+def stub_sentiment_analyser(cache=None, **kwargs):
+    tokenizer = StubTokenizer()
+    if cache is not None:
+        cache = cache.namespace('sentiment', 'stub')
+    return SentimentAnalyser(
+        StubSentimentModel(tokenizer, **kwargs), tokenizer, SENTIMENT_LABELS,
+        cache=cache
+    )
+
+
+class StubCometCommonsenseBuilder(CometCommonsenseBuilder):
+    """`CometCommonsenseBuilder` whose model picks beams from
+    `COMET_OBJECTS` by hashing the input.
+    """
+    def __init__(
+        self, spacy_processor, sentiment_analyser, call_cost=0.005, cache=None
+    ):
+        super().__init__(
+            model=None, data_loader=None, text_encoder=None,
+            valid_relation_types=set(COMET_OBJECTS.keys()), opt=None,
+            spacy_processor=spacy_processor,
+            sentiment_analyser=sentiment_analyser, cache=cache
+        )
+        self.call_cost = call_cost
+        self.num_calls = 0
+
+    def run_comet(self, input, sampling):
+        self.num_calls += 1
+        return super().run_comet(input, sampling)
+
+    def run_comet_relation(self, input, sampling, relation_type):
+        time.sleep(self.call_cost / len(COMET_OBJECTS))
+        objects = COMET_OBJECTS[relation_type]
+        start = stable_hash(f"{sampling} {relation_type} {input}")
+        return [
+            objects[(start + i * 3) % len(objects)] for i in range(NUM_BEAMS)
+        ]
+
+    @classmethod
+    def default(cls, cache=None, sentiment_analyser=None, **kwargs):
+        if sentiment_analyser is None:
+            sentiment_analyser = stub_sentiment_analyser(cache=cache)
+        return cls(
+            spacy.load('en_core_web_sm'), sentiment_analyser,
+            cache=cache.namespace('comet', 'stub', NUM_BEAMS)
+            if cache is not None else None,
+            **kwargs
+        )
+
+
+class SeededResponseGenerator(PatternResponseGenerator):
+    """`PatternResponseGenerator` that seeds its choice of template
+    fragments with its input, so that responses do not depend on the order
+    in which inputs are processed, or on which inputs are skipped.
+    """
+    def generate_responses(self, event, failed_expectation, cs_obt):
+        self.templates.seed(stable_hash(f"{event}\n{failed_expectation}"))
+        return super().generate_responses(event, failed_expectation, cs_obt)
+
+
+def stub_sarcasm_generator(cache=None, sentiment_analyser=None, **kwargs):
+    """A `SarcasmGenerator` with the real extractor and response templates,
+    and stand-ins for the models, all caching in `cache` if set.
+    """
+    return SarcasmGenerator(
+        PatternNegationExpectationExtractor.default(cache=cache),
+        StubCometCommonsenseBuilder.default(
+            cache=cache, sentiment_analyser=sentiment_analyser
+        ),
+        SeededResponseGenerator.default(cache=cache),
+        **kwargs
+    )
@@ -0,0 +1,193 @@
+import pathlib
+import tempfile
+import threading
+import unittest
+
+from max.cache import (
+    LRUCache, RedisCache, SQLiteCache, get_or_compute_many, open_cache
+)
+
+from resp_server import RespServer
+
+
+VALUES = {
+    'Ben won the marathon': {'xAttr': ['fast', 'proud'], 'xNeed': []},
+    'beam-10\nI ran out of characters': ['Not I ran out of characters'],
+    'VBG\nI\ntrain for the marathon': 'training for the marathon',
+    'scores é': [0.25, 0.75],
+}
+
+
+class BackendTests:
+    """Behaviour common to all the backends; `make_cache` builds one."""
+    def make_cache(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get_set(self):
+        self.assertDictEqual(self.cache.get_many(list(VALUES)), {})
+        self.cache.set_many(VALUES)
+        self.assertDictEqual(
+            self.cache.get_many(list(VALUES) + ['missing']), VALUES
+        )
+        self.cache.set('Ben won the marathon', None)
+        self.assertIsNone(self.cache.get('Ben won the marathon', 'default'))
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        self.cache.clear()
+        self.assertDictEqual(self.cache.get_many(list(VALUES)), {})
+
+    def test_namespaces(self):
+        comet_v1 = self.cache.namespace('comet', 'model-v1')
+        comet_v2 = self.cache.namespace('comet', 'model-v2')
+        sentiment_v1 = self.cache.namespace('sentiment', 'model-v1')
+        comet_v1.set('Ben won the marathon', 1)
+        sentiment_v1.set('Ben won the marathon', 2)
+        self.assertEqual(comet_v1.get('Ben won the marathon'), 1)
+        self.assertEqual(sentiment_v1.get('Ben won the marathon'), 2)
+        # A new version does not read the entries of the previous one.
+        self.assertIsNone(comet_v2.get('Ben won the marathon'))
+        self.assertEqual(comet_v1.num_hits, 1)
+        self.assertEqual(comet_v2.num_misses, 1)
+
+    def test_get_or_compute_many(self):
+        computed = []
+
+        def compute(inputs):
+            computed.append(inputs)
+            return [input.upper() for input in inputs]
+
+        cache = self.cache.namespace('upper', 1)
+        self.assertListEqual(
+            get_or_compute_many(cache, ['a', 'b', 'a'], compute),
+            ['A', 'B', 'A']
+        )
+        self.assertListEqual(
+            get_or_compute_many(cache, ['c', 'b'], compute), ['C', 'B']
+        )
+        # Repeated and cached inputs are not computed again.
+        self.assertListEqual(computed, [['a', 'b'], ['c']])
+        self.assertListEqual(
+            get_or_compute_many(None, ['a'], compute), ['A']
+        )
+        self.assertListEqual(computed, [['a', 'b'], ['c'], ['a']])
+
+
+class TestLRUCache(BackendTests, unittest.TestCase):
+    def make_cache(self):
+        return LRUCache(max_entries=100)
+
+    def test_eviction(self):
+        cache = LRUCache(max_entries=2)
+        cache.set_many({'a': 1, 'b': 2})
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertDictEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+
+    def test_threads(self):
+        cache = LRUCache(max_entries=50)
+
+        def run(thread_num):
+            for i in range(200):
+                cache.set(f"{thread_num} {i}", i)
+                cache.get(f"{thread_num} {i - 1}")
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(cache), 50)
+
+
+class TestSQLiteCache(BackendTests, unittest.TestCase):
+    def make_cache(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmp_dir.name) / 'cache.db'
+        return SQLiteCache(self.path, max_entries=100)
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp_dir.cleanup()
+
+    def test_persistence(self):
+        self.cache.set_many(VALUES)
+        self.cache.close()
+        self.cache = SQLiteCache(self.path)
+        self.assertDictEqual(self.cache.get_many(list(VALUES)), VALUES)
+
+    def test_eviction(self):
+        cache = SQLiteCache(self.path, max_entries=20)
+        cache.set_many({f"old {i}": i for i in range(20)})
+        # Reading an entry makes it recently used.
+        self.assertEqual(cache.get('old 0'), 0)
+        cache.set_many({f"new {i}": i for i in range(5)})
+        # The 5 entries over the limit are evicted, and a tenth of the limit
+        # more, among the least recently used.
+        self.assertEqual(len(cache), 18)
+        self.assertEqual(cache.get('old 0'), 0)
+        self.assertEqual(
+            len(cache.get_many([f"old {i}" for i in range(1, 20)])), 12
+        )
+        self.assertDictEqual(
+            cache.get_many([f"new {i}" for i in range(5)]),
+            {f"new {i}": i for i in range(5)}
+        )
+        cache.close()
+
+
+class TestRedisCache(BackendTests, unittest.TestCase):
+    def make_cache(self):
+        self.server = RespServer()
+        return RedisCache(port=self.server.port)
+
+    def tearDown(self):
+        super().tearDown()
+        self.server.close()
+
+    def test_round_trips(self):
+        self.cache.set_many(VALUES)
+        self.cache.get_many(list(VALUES))
+        # One MGET for all the keys.
+        self.assertEqual(self.server.commands.count('MGET'), 1)
+
+    def test_ttl(self):
+        cache = RedisCache(port=self.server.port, ttl=60)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNotNone(self.server.data[b'a'][1])
+        cache.close()
+
+    def test_errors(self):
+        with self.assertRaises(RuntimeError):
+            self.cache.execute(['NOSUCHCOMMAND'])
+        # The connection is still usable after an error reply.
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+
+
+class TestOpenCache(unittest.TestCase):
+    def test_open_cache(self):
+        cache = open_cache('memory', max_entries=10)
+        self.assertIsInstance(cache, LRUCache)
+        self.assertEqual(cache.max_entries, 10)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = pathlib.Path(tmp_dir) / 'cache.db'
+            cache = open_cache(f"sqlite://{path}")
+            self.assertIsInstance(cache, SQLiteCache)
+            self.assertEqual(cache.path, str(path))
+            cache.close()
+        cache = open_cache('redis://cache.local:6380/2')
+        self.assertEqual(
+            (cache.host, cache.port, cache.db), ('cache.local', 6380, 2)
+        )
+        with self.assertRaises(ValueError):
+            open_cache('lmdb:///tmp/cache')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import dataclasses
+import unittest
+
+from max import CompactSarcasticResponse, ExplainableSarcasticResponse
+from max.canonicalization import canonicalize, restore_surface
+
+
+def make_response(event):
+    return ExplainableSarcasticResponse(
+        event=event,
+        failed_expectation=f"Not {event}",
+        relation_type="xNeed",
+        relation_subject="event",
+        relation_object="train for the marathon",
+        norm_violated="maxim of quality",
+        response_texts=["Brilliant! Well done not training for the marathon."]
+    )
+
+
+class TestCanonicalize(unittest.TestCase):
+    def test_equivalent_events(self):
+        for event in [
+            'Ben won the marathon',
+            'ben won the marathon ',
+            'Ben won the marathon.',
+            '  "Ben  won the marathon!!" ',
+            'BEN WON THE MARATHON',
+        ]:
+            canonical_event = canonicalize(event)
+            self.assertEqual(canonical_event.key, 'Ben won the marathon')
+            self.assertEqual(canonical_event.surface, event)
+
+    def test_fixes(self):
+        self.assertEqual(
+            canonicalize('Ben didnâ€™t win , again').key, "Ben didn't win, again"
+        )
+        self.assertEqual(canonicalize("i'm tired").key, "I'm tired")
+        self.assertEqual(
+            canonicalize('Ben moved to the U.S.').key, 'Ben moved to the U.S.'
+        )
+
+    def test_case_is_kept_where_meaningful(self):
+        self.assertEqual(canonicalize('iPhone broke').key, 'iPhone broke')
+        self.assertEqual(canonicalize('I love NYC').key, 'I love NYC')
+        self.assertNotEqual(
+            canonicalize('Ben won The Marathon').key,
+            canonicalize('Ben won the marathon').key
+        )
+
+
+class TestRestoreSurface(unittest.TestCase):
+    def test_restore_surface(self):
+        response_lst = [[make_response('Ben won the marathon')] * 2, []]
+        restored = restore_surface(response_lst, 'ben won the marathon.')
+        expected = dataclasses.replace(
+            make_response('Ben won the marathon'),
+            event='ben won the marathon.'
+        )
+        self.assertListEqual(restored, [[expected] * 2, []])
+        self.assertEqual(response_lst[0][0].event, 'Ben won the marathon')
+
+    def test_restore_surface_compact(self):
+        response = CompactSarcasticResponse.from_response(
+            make_response('Ben won the marathon')
+        )
+        response_lst = [[
+            response, CompactSarcasticResponse.from_response(
+                response, response.context
+            )
+        ]]
+        restored = restore_surface(response_lst, 'ben won the marathon.')
+        self.assertEqual(restored[0][0].event, 'ben won the marathon.')
+        self.assertEqual(
+            restored[0][0].failed_expectation, 'Not Ben won the marathon'
+        )
+        self.assertIs(restored[0][0].context, restored[0][1].context)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import threading
+import unittest
+
+from max import ExplainableSarcasticResponse
+from max.coalescing import CoalescingSarcasmGenerator
+
+
+def make_response(event):
+    return ExplainableSarcasticResponse(
+        event=event,
+        failed_expectation=f"Not {event}",
+        relation_type="xNeed",
+        relation_subject="event",
+        relation_object="train for the marathon",
+        norm_violated="maxim of quality",
+        response_texts=["Brilliant! Well done not training for the marathon."]
+    )
+
+
+class FakeSarcasmGenerator:
+    def __init__(self, release=None, fail=False):
+        self.release = release
+        self.fail = fail
+        self.events = []
+        self.lock = threading.Lock()
+
+    def generate_responses(self, event, num_responses=1):
+        with self.lock:
+            self.events.append(event)
+        if self.release is not None:
+            self.release.wait()
+        if self.fail:
+            raise ValueError(event)
+        return [[make_response(event)] * num_responses]
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+class TestCoalescingSarcasmGenerator(unittest.TestCase):
+    def run_concurrently(self, coalescer, events):
+        results = [None] * len(events)
+        errors = [None] * len(events)
+
+        def run(i):
+            try:
+                results[i] = coalescer.generate_responses(events[i])
+            except Exception as e:
+                errors[i] = e
+
+        threads = [
+            threading.Thread(target=run, args=(i,)) for i in range(len(events))
+        ]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def wait_for_waiters(self, coalescer, num_waiters):
+        while True:
+            with coalescer._lock:
+                if coalescer.num_coalesced + coalescer.num_computed \
+                        >= num_waiters:
+                    return
+
+    def test_coalesce_in_flight(self):
+        release = threading.Event()
+        sarcasm_generator = FakeSarcasmGenerator(release=release)
+        coalescer = CoalescingSarcasmGenerator(sarcasm_generator)
+        events = ['Ben won the marathon', ' ben  won the marathon.'] * 4
+        threads, results, errors = self.run_concurrently(coalescer, events)
+        self.wait_for_waiters(coalescer, len(events))
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(sarcasm_generator.events), 1)
+        self.assertEqual(coalescer.num_computed, 1)
+        self.assertEqual(coalescer.num_coalesced, len(events) - 1)
+        self.assertListEqual(errors, [None] * len(events))
+        # Each request gets the responses with its own surface form.
+        for event, result in zip(events, results):
+            self.assertEqual(result[0][0].event, event)
+            self.assertEqual(
+                result[0][0].failed_expectation,
+                results[0][0][0].failed_expectation
+            )
+
+    def test_failures_are_shared_and_not_cached(self):
+        release = threading.Event()
+        sarcasm_generator = FakeSarcasmGenerator(release=release, fail=True)
+        coalescer = CoalescingSarcasmGenerator(sarcasm_generator)
+        events = ['Ben won the marathon'] * 3
+        threads, results, errors = self.run_concurrently(coalescer, events)
+        self.wait_for_waiters(coalescer, len(events))
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+        self.assertEqual(len(sarcasm_generator.events), 1)
+        with self.assertRaises(ValueError):
+            coalescer.generate_responses('Ben won the marathon')
+        self.assertEqual(len(sarcasm_generator.events), 2)
+
+    def test_ttl(self):
+        clock = FakeClock()
+        sarcasm_generator = FakeSarcasmGenerator()
+        coalescer = CoalescingSarcasmGenerator(
+            sarcasm_generator, ttl=10.0, clock=clock
+        )
+        first = coalescer.generate_responses('Ben won the marathon')
+        clock.time = 9.0
+        self.assertListEqual(
+            coalescer.generate_responses('Ben won the marathon'), first
+        )
+        self.assertEqual(coalescer.num_cached, 1)
+        clock.time = 20.0
+        coalescer.generate_responses('Ben won the marathon')
+        self.assertEqual(len(sarcasm_generator.events), 2)
+        # The number of responses is part of the key.
+        coalescer.generate_responses('Ben won the marathon', num_responses=2)
+        self.assertEqual(len(sarcasm_generator.events), 3)
+
+    def test_results_are_not_shared(self):
+        coalescer = CoalescingSarcasmGenerator(FakeSarcasmGenerator())
+        first = coalescer.generate_responses('Ben won the marathon')
+        first.clear()
+        first = coalescer.generate_responses('Ben won the marathon')
+        self.assertEqual(coalescer.num_cached, 1)
+        self.assertEqual(len(first), 1)
+        first[0].clear()
+        self.assertEqual(
+            len(coalescer.generate_responses('Ben won the marathon')[0]), 1
+        )
+
+    def test_max_entries(self):
+        sarcasm_generator = FakeSarcasmGenerator()
+        coalescer = CoalescingSarcasmGenerator(
+            sarcasm_generator, max_entries=2
+        )
+        for event in ['a', 'b', 'a', 'c', 'a', 'b']:
+            coalescer.generate_responses(event)
+        self.assertListEqual(sarcasm_generator.events, ['a', 'b', 'c', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
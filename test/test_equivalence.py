@@ -0,0 +1,329 @@
+"""Checks that the batched, cached and parallel paths give the same results
+as the serial reference path, `SarcasmGenerator.generate_responses` called
+once per event, and that they call the models at least `MIN_CALL_RATIOS`
+times less per event.
+
+Wall-clock speedups depend on the load of the host, so they are only
+checked against `MIN_SPEEDUPS` if the environment variable
+`MAX_TIMING_TESTS` is set, e.g. on a dedicated benchmark host.
+
+Uses the stand-ins for the models in `stubs`, so it runs offline.
+"""
+import os
+import pathlib
+import tempfile
+import time
+import unittest
+
+from max.cache import LRUCache, SQLiteCache
+from max.canonicalization import canonicalize
+from max.coalescing import CoalescingSarcasmGenerator
+from max.pipeline import PipelinedSarcasmGenerator
+from max.response_store import (
+    ResponseStore, build_response_store, encode_record, write_response_store
+)
+
+from stubs import stub_sarcasm_generator
+
+
+EVENTS = [
+    'Ben won the marathon',
+    'Ben does not win marathons',
+    'I ran out of characters',
+    'Ben wins marathons',
+    'Ben did not eat the cake',
+    'Ben is not winning',
+    'Ben broke the record',
+    'Ben lost the game',
+    'ben won the marathon.',
+    'Ben was late',
+    'Ben forgot the keys',
+    'Ben did win the race',
+]
+
+# Minimum ratios of the model calls per event of the serial path to those
+# of each path.
+MIN_CALL_RATIOS = {
+    'pipelined': 1.1,
+    'batch': 2.5,
+    'coalescing': 4.0,
+    'sentiment_batch': 10.0,
+}
+
+# Minimum ratios of the throughput of each path to that of the serial path,
+# checked if `MAX_TIMING_TESTS` is set.
+MIN_SPEEDUPS = {
+    'pipelined': 1.1,
+    'batch': 1.5,
+    'coalescing': 2.0,
+    'cache': 5.0,
+    'response_store': 10.0,
+    'sentiment_batch': 3.0,
+}
+
+
+def model_calls(sarcasm_generator):
+    """The number of calls of the COMET and sentiment stand-ins."""
+    builder = sarcasm_generator.commonsense_builder
+    return builder.num_calls + builder.sentiment_analyser.model.num_calls
+
+
+class TestEquivalence(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Process-wide state, such as spacy's and the postprocessing's
+        # caches, is warmed up first, so that the serial timing does not
+        # depend on which tests ran before.
+        warmup_generator = stub_sarcasm_generator()
+        for event in EVENTS:
+            warmup_generator.generate_responses(event)
+        cls.sarcasm_generator = stub_sarcasm_generator()
+        start_time = time.perf_counter()
+        cls.reference = [
+            cls.sarcasm_generator.generate_responses(event)
+            for event in EVENTS
+        ]
+        cls.serial_time_per_event = \
+            (time.perf_counter() - start_time) / len(EVENTS)
+        cls.serial_calls_per_event = \
+            model_calls(cls.sarcasm_generator) / len(EVENTS)
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.tmp_path = pathlib.Path(cls.tmp_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def assertFewerCalls(self, name, sarcasm_generator, num_events):
+        calls_per_event = model_calls(sarcasm_generator) / num_events
+        self.assertGreaterEqual(
+            self.serial_calls_per_event,
+            MIN_CALL_RATIOS[name] * calls_per_event,
+            f"{name} makes {calls_per_event:.2f} model calls per event, "
+            f"the serial path {self.serial_calls_per_event:.2f}"
+        )
+
+    def assertSpeedup(self, name, elapsed, num_events):
+        if not os.environ.get('MAX_TIMING_TESTS'):
+            return
+        speedup = self.serial_time_per_event / (elapsed / num_events)
+        self.assertGreaterEqual(
+            speedup, MIN_SPEEDUPS[name],
+            f"{name} is only {speedup:.2f} times faster than the serial path"
+        )
+
+    def test_reference_is_not_trivial(self):
+        num_responses = sum(
+            len(responses)
+            for response_lst in self.reference for responses in response_lst
+        )
+        self.assertGreater(num_responses, len(EVENTS))
+
+    def test_pipelined(self):
+        sarcasm_generator = stub_sarcasm_generator()
+        pipelined_generator = PipelinedSarcasmGenerator(sarcasm_generator)
+        start_time = time.perf_counter()
+        response_lsts = pipelined_generator.generate_responses_batch(EVENTS)
+        elapsed = time.perf_counter() - start_time
+        self.assertListEqual(response_lsts, self.reference)
+        # The commonsense of an event is built once, not once per
+        # expectation.
+        self.assertFewerCalls('pipelined', sarcasm_generator, len(EVENTS))
+        self.assertSpeedup('pipelined', elapsed, len(EVENTS))
+
+    def test_batch(self):
+        sarcasm_generator = stub_sarcasm_generator()
+        start_time = time.perf_counter()
+        response_lsts = sarcasm_generator.generate_responses_batch(EVENTS)
+        elapsed = time.perf_counter() - start_time
+        self.assertListEqual(response_lsts, self.reference)
+        self.assertFewerCalls('batch', sarcasm_generator, len(EVENTS))
+        self.assertSpeedup('batch', elapsed, len(EVENTS))
+        # Batches that do not divide the events evenly.
+        self.assertListEqual(
+            list(sarcasm_generator.generate_responses_iter(
+                EVENTS, batch_size=5
+            )),
+            self.reference
+        )
+
+    def test_lean(self):
+        sarcasm_generator = stub_sarcasm_generator(lean=True)
+        self.assertListEqual(
+            [sarcasm_generator.generate_responses(e) for e in EVENTS],
+            self.reference
+        )
+
+    def test_coalescing(self):
+        sarcasm_generator = stub_sarcasm_generator()
+        coalescer = CoalescingSarcasmGenerator(sarcasm_generator)
+        events = EVENTS * 4
+        start_time = time.perf_counter()
+        response_lsts = [coalescer.generate_responses(e) for e in events]
+        elapsed = time.perf_counter() - start_time
+        self.assertListEqual(response_lsts, self.reference * 4)
+        self.assertFewerCalls('coalescing', sarcasm_generator, len(events))
+        self.assertSpeedup('coalescing', elapsed, len(events))
+
+    def test_cache(self):
+        for backend in [
+            LRUCache(), SQLiteCache(self.tmp_path / 'cache.db')
+        ]:
+            sarcasm_generator = stub_sarcasm_generator(cache=backend)
+            self.assertListEqual(
+                [sarcasm_generator.generate_responses(e) for e in EVENTS],
+                self.reference
+            )
+            # A new generator sharing the backend finds everything cached.
+            sarcasm_generator = stub_sarcasm_generator(cache=backend)
+            start_time = time.perf_counter()
+            response_lsts = [
+                sarcasm_generator.generate_responses(e) for e in EVENTS
+            ]
+            elapsed = time.perf_counter() - start_time
+            self.assertListEqual(response_lsts, self.reference)
+            self.assertSpeedup('cache', elapsed, len(EVENTS))
+            self.assertEqual(model_calls(sarcasm_generator), 0)
+            backend.close()
+
+    def test_response_store(self):
+        store_path = self.tmp_path / 'store.bin'
+        records = {}
+        for event, response_lst in zip(EVENTS, self.reference):
+            records.setdefault(
+                canonicalize(event).key, encode_record(event, response_lst)
+            )
+        write_response_store(store_path, records)
+        sarcasm_generator = stub_sarcasm_generator(
+            response_store=ResponseStore(store_path)
+        )
+        start_time = time.perf_counter()
+        response_lsts = [
+            sarcasm_generator.generate_responses(e) for e in EVENTS
+        ]
+        elapsed = time.perf_counter() - start_time
+        self.assertListEqual(response_lsts, self.reference)
+        self.assertEqual(model_calls(sarcasm_generator), 0)
+        self.assertSpeedup('response_store', elapsed, len(EVENTS))
+        sarcasm_generator.response_store.close()
+
+    def test_batch_with_response_store(self):
+        store_path = self.tmp_path / 'half_store.bin'
+        records = {}
+        half = len(EVENTS) // 2
+        for event, response_lst in zip(EVENTS[:half], self.reference):
+            records.setdefault(
+                canonicalize(event).key, encode_record(event, response_lst)
+            )
+        write_response_store(store_path, records)
+        sarcasm_generator = stub_sarcasm_generator(
+            response_store=ResponseStore(store_path)
+        )
+        self.assertListEqual(
+            sarcasm_generator.generate_responses_batch(EVENTS),
+            self.reference
+        )
+        sarcasm_generator.response_store.close()
+
+    def test_parallel_response_store_build(self):
+        catalogue_path = self.tmp_path / 'catalogue.txt'
+        catalogue_path.write_text('\n'.join(EVENTS) + '\n', encoding='utf-8')
+        store_path = self.tmp_path / 'parallel_store.bin'
+        build_response_store(
+            catalogue_path, store_path, stub_sarcasm_generator, num_workers=2
+        )
+        store = ResponseStore(store_path)
+        for event, response_lst in zip(EVENTS, self.reference):
+            record = store.get_record(canonicalize(event).key)
+            if record['event'] == event:
+                self.assertListEqual(
+                    store.get(canonicalize(event).key), response_lst
+                )
+        store.close()
+
+    def test_batched_extraction(self):
+        extractor = self.sarcasm_generator.expectation_extractor
+        self.assertListEqual(
+            extractor.extract_expectations_batch(EVENTS, use_antonyms=True),
+            [
+                extractor.extract_expectations(e, use_antonyms=True)
+                for e in EVENTS
+            ]
+        )
+
+    def test_batched_overlap_without_xattr(self):
+        builder = self.sarcasm_generator.commonsense_builder
+
+        def cs(**obts):
+            return {
+                R: obts.get(R, [])
+                for R in [
+                    'xAttr', 'xIntent', 'xNeed', 'xReact', 'xWant',
+                    'xEffect'
+                ]
+            }
+
+        cs_pairs = [
+            (
+                cs(xAttr=['athletic', 'tired'], xWant=['to rest']),
+                cs(xAttr=['lazy'], xWant=['to sleep', 'to rest'])
+            ),
+            # No xAttr obts once preprocessed, so no reference sentence.
+            (cs(xAttr=['none', ' '], xWant=['to eat', 'to eat']), None),
+            (
+                cs(xAttr=['hungry'], xWant=['to eat cake']),
+                cs(xAttr=['none'], xWant=['to diet'])
+            ),
+        ]
+        serial = [
+            builder.remove_comet_overlap(in_cs, exp_cs)
+            for in_cs, exp_cs in cs_pairs
+        ]
+        self.assertListEqual(
+            builder.remove_comet_overlap_batch(cs_pairs), serial
+        )
+        self.assertListEqual(serial[1][0]['xAttr'], [])
+        self.assertEqual(len(serial[1][0]['xWant']), 1)
+
+    def test_batched_sentiment(self):
+        builder = self.sarcasm_generator.commonsense_builder
+        sentiment_model = builder.sentiment_analyser.model
+        s1_lst = [
+            f"{name} is {attr}"
+            for name in ['Ben', 'He', 'You'] for attr in ['happy', 'tired']
+        ] * 8
+        s2_lst = [
+            f"{name} wants to {verb} the prize"
+            for name in ['Ben', 'He'] for verb in ['celebrate', 'lose', 'get']
+        ] * 8
+
+        num_calls = sentiment_model.num_calls
+        start_time = time.perf_counter()
+        serial = [
+            builder.sents_contradict(s1, s2) for s1, s2 in zip(s1_lst, s2_lst)
+        ]
+        serial_time = time.perf_counter() - start_time
+        self.assertEqual(
+            sentiment_model.num_calls - num_calls, 2 * len(s1_lst)
+        )
+
+        num_calls = sentiment_model.num_calls
+        start_time = time.perf_counter()
+        batched = builder.sents_contradict_batch(s1_lst, s2_lst)
+        batched_time = time.perf_counter() - start_time
+        self.assertListEqual(batched, serial)
+        self.assertIn(True, serial)
+        self.assertIn(False, serial)
+        self.assertGreaterEqual(
+            2 * len(s1_lst),
+            MIN_CALL_RATIOS['sentiment_batch']
+            * (sentiment_model.num_calls - num_calls)
+        )
+        if os.environ.get('MAX_TIMING_TESTS'):
+            self.assertGreaterEqual(
+                serial_time / batched_time, MIN_SPEEDUPS['sentiment_batch']
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import json
+import pathlib
+import random
+import tempfile
+import unittest
+
+from max.latency import LatencyHistogram, LatencyTracker, size_bucket
+from max.pipeline import PipelinedSarcasmGenerator
+
+from stubs import stub_sarcasm_generator
+
+
+EVENTS = ['Ben won the marathon', 'I ran out of coffee', 'Ben lost the race']
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        rng = random.Random(0)
+        latencies = [rng.lognormvariate(-4, 1.5) for _ in range(10000)]
+        histogram = LatencyHistogram()
+        for latency in latencies:
+            histogram.record(latency)
+        latencies.sort()
+        for q in [1, 50, 90, 99, 99.9, 100]:
+            exact = latencies[max(int(q / 100 * len(latencies)) - 1, 0)]
+            # Within the bucket precision, and the microsecond resolution.
+            self.assertAlmostEqual(
+                histogram.percentile(q), exact, delta=exact / 64 + 2e-6
+            )
+        self.assertEqual(histogram.max, latencies[-1])
+        self.assertEqual(histogram.percentile(100), latencies[-1])
+        self.assertAlmostEqual(
+            histogram.summary()['mean'], sum(latencies) / len(latencies)
+        )
+        # Buckets grow with the logarithm of the largest latency.
+        self.assertLess(len(histogram.counts), 2000)
+        self.assertAlmostEqual(
+            histogram.fraction_above(histogram.percentile(90)), 0.1,
+            delta=0.01
+        )
+
+    def test_empty(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile(50))
+        self.assertDictEqual(histogram.summary(), {'count': 0})
+        self.assertEqual(histogram.fraction_above(1.0), 0.0)
+
+    def test_merge(self):
+        rng = random.Random(1)
+        latencies = [rng.expovariate(20) for _ in range(1000)]
+        histogram = LatencyHistogram()
+        first, second = LatencyHistogram(), LatencyHistogram()
+        for i, latency in enumerate(latencies):
+            histogram.record(latency)
+            (first if i % 2 == 0 else second).record(latency)
+        first.merge(LatencyHistogram.from_dict(
+            json.loads(json.dumps(second.to_dict()))
+        ))
+        self.assertDictEqual(first.counts, histogram.counts)
+        self.assertEqual(first.count, histogram.count)
+        self.assertAlmostEqual(first.total, histogram.total)
+        self.assertEqual(first.min, histogram.min)
+        self.assertEqual(first.max, histogram.max)
+
+
+class TestLatencyTracker(unittest.TestCase):
+    def test_size_bucket(self):
+        self.assertListEqual(
+            [size_bucket(size) for size in [0, 1, 2, 3, 4, 5, 8, 9, 100]],
+            ['0', '1', '2', '3-4', '3-4', '5-8', '5-8', '9-16', '65-128']
+        )
+
+    def test_instrument(self):
+        tracker = LatencyTracker(slo=10.0)
+        sarcasm_generator = stub_sarcasm_generator(latency_tracker=tracker)
+        reference = stub_sarcasm_generator()
+        for event in EVENTS:
+            self.assertListEqual(
+                sarcasm_generator.generate_responses(event),
+                reference.generate_responses(event)
+            )
+        sarcasm_generator.generate_responses_batch(EVENTS)
+
+        summary = tracker.summary()
+        self.assertEqual(summary['generate_responses']['count'], len(EVENTS))
+        self.assertEqual(summary['generate_responses']['over_slo'], 0.0)
+        self.assertEqual(summary['generate_responses_batch']['count'], 1)
+        self.assertGreater(summary['build_comet_commonsense']['count'], 0)
+        self.assertEqual(
+            summary['comet[words=3-4]']['count'],
+            sarcasm_generator.commonsense_builder.num_calls
+            - summary.get('comet[words=5-8]', {'count': 0})['count']
+        )
+        for relation_type in ['xAttr', 'xEffect', 'xWant']:
+            self.assertEqual(
+                summary[f'comet[{relation_type}]']['count'],
+                sarcasm_generator.commonsense_builder.num_calls
+            )
+        self.assertTrue(any(name.startswith('sentiment[') for name in summary))
+        for stats in summary.values():
+            self.assertLessEqual(stats['p50'], stats['p99'])
+            self.assertLessEqual(stats['p99'], stats['max'])
+
+        tracker.uninstrument()
+        sarcasm_generator.generate_responses(EVENTS[0])
+        self.assertEqual(
+            tracker.summary()['generate_responses']['count'], len(EVENTS)
+        )
+
+    def test_commonsense_batch(self):
+        tracker = LatencyTracker()
+        sarcasm_generator = stub_sarcasm_generator(latency_tracker=tracker)
+        builder = sarcasm_generator.commonsense_builder
+        builder.build_comet_commonsense_batch(EVENTS, 'beam-10')
+        # The batch of a single input that build_comet_commonsense makes is
+        # part of it, and not recorded again.
+        builder.build_comet_commonsense(EVENTS[0], 'beam-10')
+        histogram = tracker.histograms['build_comet_commonsense']
+        self.assertEqual(histogram.count, len(EVENTS) + 1)
+
+        sarcasm_generator.generate_responses_batch(EVENTS)
+        self.assertGreater(histogram.count, len(EVENTS) + 1)
+
+    def test_pipelined(self):
+        tracker = LatencyTracker()
+        pipelined = PipelinedSarcasmGenerator(
+            stub_sarcasm_generator(latency_tracker=tracker)
+        )
+        list(pipelined.generate_responses_iter(EVENTS))
+        self.assertEqual(
+            tracker.summary()['generate_responses']['count'], len(EVENTS)
+        )
+
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            export_path = pathlib.Path(tmp_dir) / 'latency' / 'latency.json'
+            tracker = LatencyTracker(
+                report_interval=0.01, export_path=export_path
+            ).start()
+            with tracker.time('generate_responses'):
+                pass
+            with self.assertLogs('sarcasm_generator', level='INFO') as logs:
+                tracker.stop()
+            self.assertIn(
+                'Latency of generate_responses: 1 calls', logs.output[-1]
+            )
+            data = json.loads(export_path.read_text(encoding='utf-8'))
+        self.assertEqual(
+            data['summary']['generate_responses']['count'], 1
+        )
+        histogram = LatencyHistogram.from_dict(
+            data['histograms']['generate_responses']
+        )
+        self.assertEqual(histogram.count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import threading
+import unittest
+
+from max.pipeline import PipelinedSarcasmGenerator
+
+from stubs import stub_sarcasm_generator
+
+
+EVENTS = ['Ben won the marathon', 'I ran out of coffee', 'Ben lost the race']
+
+
+def failing_events(events):
+    yield from events
+    raise IOError("input closed")
+
+
+def pipeline_threads():
+    return [
+        thread for thread in threading.enumerate()
+        if thread.name.startswith('pipeline-') and
+        thread.name != 'pipeline-feed'
+    ]
+
+
+class TestPipelinedSarcasmGenerator(unittest.TestCase):
+    def setUp(self):
+        self.reference = [
+            stub_sarcasm_generator().generate_responses(event)
+            for event in EVENTS
+        ]
+
+    def test_failing_input(self):
+        pipelined = PipelinedSarcasmGenerator(
+            stub_sarcasm_generator(), queue_size=1
+        )
+        response_lsts = []
+        with self.assertRaises(IOError):
+            for response_lst in pipelined.generate_responses_iter(
+                failing_events(EVENTS)
+            ):
+                response_lsts.append(response_lst)
+        # The responses to the events read before the failure are kept.
+        self.assertListEqual(response_lsts, self.reference)
+        self.assertListEqual(pipeline_threads(), [])
+
+    def test_failing_stage(self):
+        sarcasm_generator = stub_sarcasm_generator()
+
+        def extract_expectations(event, use_antonyms=True):
+            raise ValueError("out of memory")
+
+        sarcasm_generator.expectation_extractor.extract_expectations = \
+            extract_expectations
+        pipelined = PipelinedSarcasmGenerator(sarcasm_generator, queue_size=1)
+        with self.assertRaises(ValueError):
+            list(pipelined.generate_responses_iter(EVENTS * 4))
+        self.assertListEqual(pipeline_threads(), [])
+        self.assertEqual(len(pipelined.metrics), 4)
+
+    def test_early_stop(self):
+        pipelined = PipelinedSarcasmGenerator(
+            stub_sarcasm_generator(), queue_size=1
+        )
+        response_lsts = pipelined.generate_responses_iter(EVENTS * 4)
+        self.assertListEqual(next(response_lsts), self.reference[0])
+        with self.assertLogs('sarcasm_generator', level='INFO'):
+            response_lsts.close()
+        self.assertListEqual(pipeline_threads(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
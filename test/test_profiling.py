@@ -0,0 +1,131 @@
+import pathlib
+import tempfile
+import time
+import unittest
+
+from max import CommonsenseBuilderResponse, SarcasmGenerator
+from max.profiling import StageProfiler
+from max.response_generators import pattern_generator
+
+
+def busy_wait(seconds):
+    end_time = time.perf_counter() + seconds
+    while time.perf_counter() < end_time:
+        pass
+
+
+class FakeExtractor:
+    def extract_expectations(self, event, use_antonyms=False):
+        busy_wait(0.01)
+        return [f"Not {event}"]
+
+
+class FakeCommonsenseBuilder:
+    def build_commonsense(self, event, failed_expectation=None, **kwargs):
+        in_cs = self.build_comet_commonsense(event, 'beam-10')
+        exp_cs = self.build_comet_commonsense(failed_expectation, 'beam-10')
+        in_cs = {R: [self.preproc_obt(o, R) for o in obts]
+                 for R, obts in in_cs.items()}
+        self.sents_contradict_batch(in_cs['xAttr'], in_cs['xAttr'])
+        response = CommonsenseBuilderResponse(
+            event_obts=in_cs, failed_expectation_obts=exp_cs
+        )
+        return response, response
+
+    def build_comet_commonsense(self, input, sampling):
+        busy_wait(0.01)
+        return {'xAttr': ['fast', 'tired']}
+
+    def preproc_obt(self, obt, R):
+        return obt
+
+    def sents_contradict_batch(self, s1_lst, s2_lst):
+        return [False] * len(s1_lst)
+
+
+class FakeSubclassCommonsenseBuilder(FakeCommonsenseBuilder):
+    pass
+
+
+class FakeResponseGenerator:
+    def generate_responses(self, event, failed_expectation, cs_obt):
+        return []
+
+
+class TestStageProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = pathlib.Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_sarcasm_generator(
+        self, profiler, commonsense_builder_class=FakeCommonsenseBuilder
+    ):
+        # Restored even if the test fails, since module functions are
+        # patched too.
+        self.addCleanup(profiler.uninstrument)
+        return SarcasmGenerator(
+            FakeExtractor(), commonsense_builder_class(),
+            FakeResponseGenerator(), profiler=profiler
+        )
+
+    def test_profile(self):
+        get_inflection = pattern_generator.get_inflection
+        profiler = StageProfiler(
+            self.output_dir, sample_rate=1.0, sample_interval=0.001
+        )
+        sarcasm_generator = self.make_sarcasm_generator(profiler)
+        for event in ['Ben won the marathon', 'I ran out of characters']:
+            self.assertListEqual(
+                sarcasm_generator.generate_responses(event), [[]]
+            )
+        profiler.uninstrument()
+
+        self.assertEqual(profiler.num_profiled_events, 2)
+        self.assertEqual(profiler.stage_calls['extract_expectations'], 2)
+        self.assertEqual(profiler.stage_calls['build_comet_commonsense'], 4)
+        self.assertEqual(profiler.stage_calls['preproc_obt'], 4)
+        self.assertEqual(profiler.stage_calls['sents_contradict'], 2)
+
+        profiler.save()
+        for name in [
+            'extract_expectations', 'build_comet_commonsense', 'preproc_obt',
+            'sents_contradict'
+        ]:
+            self.assertTrue((self.output_dir / f"{name}.prof").exists())
+        stacks = (self.output_dir / 'stacks.collapsed').read_text().split('\n')
+        self.assertTrue(any('busy_wait' in stack for stack in stacks))
+
+        # Uninstrumented components are back to their own methods.
+        self.assertNotIn(
+            'build_comet_commonsense',
+            vars(sarcasm_generator.commonsense_builder)
+        )
+        self.assertIs(pattern_generator.get_inflection, get_inflection)
+
+    def test_subclass(self):
+        # The stage methods inherited by a subclass are profiled too.
+        profiler = StageProfiler(
+            self.output_dir, sample_rate=1.0, sample_interval=0.001
+        )
+        sarcasm_generator = self.make_sarcasm_generator(
+            profiler, FakeSubclassCommonsenseBuilder
+        )
+        sarcasm_generator.generate_responses('Ben won the marathon')
+        self.assertEqual(profiler.stage_calls['preproc_obt'], 2)
+        self.assertEqual(profiler.stage_calls['sents_contradict'], 1)
+
+    def test_sample_rate(self):
+        profiler = StageProfiler(self.output_dir, sample_rate=0.0)
+        sarcasm_generator = self.make_sarcasm_generator(profiler)
+        sarcasm_generator.generate_responses('Ben won the marathon')
+        profiler.uninstrument()
+        self.assertEqual(profiler.num_events, 1)
+        self.assertEqual(profiler.num_profiled_events, 0)
+        self.assertEqual(sum(profiler.stage_calls.values()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+
+import torch
+
+from max.cache import LRUCache
+from max.resources import (
+    ResourceConfig, autotune, parse_cpu_list, torch_threads
+)
+
+from stubs import stub_sarcasm_generator
+
+
+class TestResourceConfig(unittest.TestCase):
+    def test_parse_cpu_list(self):
+        self.assertListEqual(parse_cpu_list("0-3,8"), [0, 1, 2, 3, 8])
+        self.assertListEqual(parse_cpu_list("5"), [5])
+
+    def test_for_worker(self):
+        config = ResourceConfig(cpu_affinity=[0, 1, 2, 3, 4, 5])
+        worker_config = config.for_worker(1, 3)
+        self.assertListEqual(worker_config.cpu_affinity, [2, 3])
+        self.assertEqual(worker_config.comet_threads, 2)
+        self.assertEqual(worker_config.sentiment_threads, 2)
+
+        config = ResourceConfig(cpu_affinity=[0, 1], comet_threads=1)
+        worker_config = config.for_worker(3, 4)
+        self.assertListEqual(worker_config.cpu_affinity, [1])
+        self.assertEqual(worker_config.comet_threads, 1)
+
+    def test_autotune(self):
+        cache = LRUCache()
+        sarcasm_generator = stub_sarcasm_generator(cache=cache)
+        builder = sarcasm_generator.commonsense_builder
+        with self.assertLogs('sarcasm_generator', level='INFO') as logs:
+            config = autotune(
+                sarcasm_generator, ['Ben won the marathon'],
+                thread_counts=[1, 2, 4],
+                base_config=ResourceConfig(cpu_affinity=[0, 1, 2, 3])
+            )
+        # The COMET thread counts, then the sentiment ones.
+        self.assertEqual(
+            sum('events/s' in line for line in logs.output), 6
+        )
+        self.assertIn(config.comet_threads, [1, 2, 4])
+        self.assertIn(config.sentiment_threads, [1, 2, 4])
+        self.assertEqual(builder.num_threads, config.comet_threads)
+        # Each timing ran the models rather than reading the cache, which
+        # is left empty.
+        self.assertEqual(len(cache), 0)
+        self.assertIsNotNone(builder.cache)
+        reference = stub_sarcasm_generator()
+        reference.generate_responses('Ben won the marathon')
+        self.assertEqual(
+            builder.num_calls, 7 * reference.commonsense_builder.num_calls
+        )
+
+    def test_torch_threads_concurrent(self):
+        num_threads = torch.get_num_threads()
+        active, overlaps = [], []
+
+        def run(count):
+            for _ in range(20):
+                with torch_threads(count):
+                    active.append(count)
+                    # Lets the other thread run within the block.
+                    time.sleep(0.001)
+                    if len(active) > 1:
+                        overlaps.append(count)
+                    active.remove(count)
+
+        # The count is process-wide, so blocks with different counts take
+        # turns, and leave the count as they found it.
+        threads = [
+            threading.Thread(target=run, args=(count,)) for count in [1, 2]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(overlaps, [])
+        # As seen from a thread that never set it.
+        seen = []
+        thread = threading.Thread(
+            target=lambda: seen.append(torch.get_num_threads())
+        )
+        thread.start()
+        thread.join()
+        self.assertListEqual(seen, [num_threads])
+
+    def test_torch_threads(self):
+        num_threads = torch.get_num_threads()
+        with torch_threads(num_threads + 1):
+            self.assertEqual(torch.get_num_threads(), num_threads + 1)
+        self.assertEqual(torch.get_num_threads(), num_threads)
+        with torch_threads(None):
+            self.assertEqual(torch.get_num_threads(), num_threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
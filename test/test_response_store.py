@@ -0,0 +1,76 @@
+import pathlib
+import tempfile
+import unittest
+
+from max import ExplainableSarcasticResponse
+from max.canonicalization import canonicalize
+from max.response_store import (
+    ResponseStore, encode_record, write_response_store
+)
+
+
+def make_response(event):
+    return ExplainableSarcasticResponse(
+        event=event,
+        failed_expectation=f"Not {event}",
+        relation_type="xNeed",
+        relation_subject="event",
+        relation_object="train for the marathon",
+        norm_violated="maxim of quality",
+        response_texts=["Brilliant! Well done not training for the marathon."]
+    )
+
+
+class TestResponseStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store_path = pathlib.Path(self.tmp_dir.name) / 'store.bin'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get(self):
+        events = ['Ben won the marathon', 'I ran out of characters', 'Zoë left']
+        write_response_store(self.store_path, {
+            canonicalize(event).key:
+                encode_record(event, [[make_response(event)]])
+            for event in events
+        })
+        store = ResponseStore(self.store_path)
+        self.assertEqual(len(store), 3)
+        for event in events:
+            self.assertListEqual(
+                store.get(canonicalize(event).key), [[make_response(event)]]
+            )
+        self.assertListEqual(
+            store.get(canonicalize(' ben  won the marathon.').key),
+            [[make_response('Ben won the marathon')]]
+        )
+        self.assertIsNone(
+            store.get(canonicalize('Ben lost the marathon').key)
+        )
+        store.close()
+
+    def test_num_responses(self):
+        event = 'Ben won the marathon'
+        # Two responses for each of two expectations.
+        response_lst = [
+            [make_response(f"{event} {i}")] for i in range(4)
+        ]
+        key = canonicalize(event).key
+        write_response_store(self.store_path, {
+            key: encode_record(event, response_lst, num_responses=2)
+        })
+        store = ResponseStore(self.store_path)
+        self.assertListEqual(store.get(key, num_responses=2), response_lst)
+        self.assertListEqual(
+            store.get(key, num_responses=1),
+            [response_lst[0], response_lst[2]]
+        )
+        # More responses than stored are not answered from the store.
+        self.assertIsNone(store.get(key, num_responses=3))
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
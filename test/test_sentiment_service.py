@@ -0,0 +1,145 @@
+import multiprocessing
+import pathlib
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from max.commonsense_builders.sentiment_service import (
+    SentimentClient, SentimentServer
+)
+
+from stubs import SENTIMENT_LABELS, stub_sarcasm_generator, \
+    stub_sentiment_analyser
+
+
+TEXTS = [
+    'I am so happy and proud',
+    'I am tired and sad',
+    'I went to the store',
+    'Ben won the marathon @ben http://marathon.org',
+    ''
+]
+
+
+class FailingModel:
+    def __call__(self, input_ids, attention_mask=None):
+        raise ValueError("out of memory")
+
+
+_inherited_client = None
+
+
+def _child_sentiments(client):
+    if client is None:
+        client = _inherited_client
+    return client.get_sentiment_batch(TEXTS)
+
+
+class TestSentimentService(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = pathlib.Path(self.tmp_dir.name) / 'sentiment.sock'
+        self.analyser = stub_sentiment_analyser()
+        self.server = SentimentServer(
+            self.analyser, self.socket_path, max_wait=0.05
+        ).start()
+
+    def tearDown(self):
+        self.server.close()
+        self.tmp_dir.cleanup()
+
+    def test_same_as_local(self):
+        client = SentimentClient(self.socket_path)
+        local = stub_sentiment_analyser()
+        self.assertListEqual(client.labels, SENTIMENT_LABELS)
+        self.assertListEqual(
+            client.get_sentiment_batch(TEXTS),
+            local.get_sentiment_batch(TEXTS)
+        )
+        for text in TEXTS:
+            self.assertEqual(
+                client.get_sentiment(text), local.get_sentiment(text)
+            )
+            np.testing.assert_allclose(
+                client.get_scores(text), local.get_scores(text)
+            )
+        self.assertListEqual(client.get_sentiment_batch([]), [])
+        client.close()
+
+    def test_batches_across_clients(self):
+        num_clients = 4
+        clients = [
+            SentimentClient(self.socket_path) for _ in range(num_clients)
+        ]
+        barrier = threading.Barrier(num_clients)
+        sentiments = [None] * num_clients
+
+        def run(i):
+            barrier.wait()
+            sentiments[i] = clients[i].get_sentiment_batch(TEXTS)
+
+        threads = [
+            threading.Thread(target=run, args=(i,))
+            for i in range(num_clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        expected = stub_sentiment_analyser().get_sentiment_batch(TEXTS)
+        for client_sentiments in sentiments:
+            self.assertListEqual(client_sentiments, expected)
+        self.assertEqual(self.server.num_requests, num_clients)
+        # The requests of the clients are scored together.
+        self.assertLess(self.server.num_batches, num_clients)
+        self.assertLess(self.analyser.model.num_calls, num_clients)
+
+    def test_forked_workers(self):
+        global _inherited_client
+        client = SentimentClient(self.socket_path)
+        # The parent's connection is open when the workers are forked.
+        client.get_sentiment('I am so happy')
+        _inherited_client = client
+        context = multiprocessing.get_context('fork')
+        with context.Pool(2) as pool:
+            # Clients inherited by the workers, and pickled to them.
+            results = pool.map(_child_sentiments, [None, None, client, client])
+        _inherited_client = None
+        self.assertEqual(client.get_sentiment('I am tired'), 'negative')
+        expected = stub_sentiment_analyser().get_sentiment_batch(TEXTS)
+        for result in results:
+            self.assertListEqual(result, expected)
+
+    def test_errors(self):
+        model = self.analyser.model
+        self.analyser.model = FailingModel()
+        client = SentimentClient(self.socket_path)
+        with self.assertRaisesRegex(RuntimeError, 'out of memory'):
+            client.get_sentiment('I am so happy')
+        # The connection is still usable after an error.
+        self.analyser.model = model
+        self.assertEqual(client.get_sentiment('I am so happy'), 'positive')
+
+    def test_sarcasm_generator(self):
+        client = SentimentClient(self.socket_path)
+        events = ['Ben won the marathon', 'I ran out of coffee']
+        self.assertListEqual(
+            [
+                stub_sarcasm_generator(
+                    sentiment_analyser=client
+                ).generate_responses(event)
+                for event in events
+            ],
+            [
+                stub_sarcasm_generator().generate_responses(event)
+                for event in events
+            ]
+        )
+        self.assertGreater(self.server.num_requests, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
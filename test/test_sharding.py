@@ -0,0 +1,133 @@
+import pathlib
+import tempfile
+import unittest
+
+from max import ExplainableSarcasticResponse
+from max.sharding import (
+    merge_shards, process_shard, read_shard, shard_of, shard_path
+)
+
+
+def make_response(event):
+    return ExplainableSarcasticResponse(
+        event=event,
+        failed_expectation=f"Not {event}",
+        relation_type="xNeed",
+        relation_subject="event",
+        relation_object="train for the marathon",
+        norm_violated="maxim of quality",
+        response_texts=["Brilliant! Well done not training for the marathon."]
+    )
+
+
+class FakeSarcasmGenerator:
+    response_store = None
+
+    def __init__(self):
+        self.events = []
+
+    def generate_responses(self, event, num_responses=1):
+        self.events.append(event)
+        return [[make_response(event)]]
+
+
+class ListWriter:
+    def __init__(self):
+        self.responses = []
+
+    def write(self, responses):
+        self.responses.append(list(responses))
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_path = pathlib.Path(self.tmp_dir.name)
+        self.events = [f"Ben won marathon number {i}" for i in range(50)]
+        self.events.append(self.events[3])
+        self.event_file_path = self.tmp_path / 'events.txt'
+        self.event_file_path.write_text(
+            ''.join(event + '\n' for event in self.events), encoding='utf-8'
+        )
+        self.shard_dir = self.tmp_path / 'shards'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_shard_of(self):
+        shards = [shard_of(event, 4) for event in self.events]
+        self.assertEqual(len(set(shards)), 4)
+        self.assertEqual(shards[3], shards[-1])
+        self.assertEqual(shard_of(' ben  won the marathon.', 4),
+                         shard_of('Ben won the marathon', 4))
+
+    def test_process_and_merge(self):
+        for shard_index in range(3):
+            process_shard(
+                FakeSarcasmGenerator(), self.event_file_path, self.shard_dir,
+                shard_index, 3
+            )
+        writer = ListWriter()
+        missing = merge_shards(self.event_file_path, self.shard_dir, 3, writer)
+        self.assertListEqual(missing, [])
+        self.assertListEqual(
+            writer.responses, [[make_response(event)] for event in self.events]
+        )
+
+    def test_resume(self):
+        process_shard(
+            FakeSarcasmGenerator(), self.event_file_path, self.shard_dir, 0, 2
+        )
+        path = shard_path(self.shard_dir, 0, 2)
+        records = list(read_shard(path))
+        # Simulate a crash after two records, in the middle of the third.
+        lines = path.read_bytes().splitlines(keepends=True)
+        path.write_bytes(b''.join(lines[:2]) + lines[2][:10])
+
+        sarcasm_generator = FakeSarcasmGenerator()
+        num_processed, num_skipped = process_shard(
+            sarcasm_generator, self.event_file_path, self.shard_dir, 0, 2
+        )
+        self.assertEqual(num_skipped, 2)
+        self.assertEqual(num_processed, len(records) - 2)
+        self.assertListEqual(
+            sarcasm_generator.events,
+            [record['event'] for record in records[2:]]
+        )
+        self.assertListEqual(list(read_shard(path)), records)
+
+    def test_merge_missing(self):
+        process_shard(
+            FakeSarcasmGenerator(), self.event_file_path, self.shard_dir, 0, 2
+        )
+        with self.assertRaises(ValueError):
+            merge_shards(self.event_file_path, self.shard_dir, 2, ListWriter())
+
+        writer = ListWriter()
+        missing = merge_shards(
+            self.event_file_path, self.shard_dir, 2, writer,
+            allow_missing=True
+        )
+        self.assertListEqual(
+            missing,
+            [i for i, event in enumerate(self.events)
+             if shard_of(event, 2) == 1]
+        )
+        self.assertEqual(len(writer.responses) + len(missing), len(self.events))
+
+    def test_merge_changed_event_file(self):
+        for shard_index in range(2):
+            process_shard(
+                FakeSarcasmGenerator(), self.event_file_path, self.shard_dir,
+                shard_index, 2
+            )
+        self.event_file_path.write_text(
+            ''.join(event + '\n' for event in reversed(self.events)),
+            encoding='utf-8'
+        )
+        with self.assertRaises(ValueError):
+            merge_shards(self.event_file_path, self.shard_dir, 2, ListWriter())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import io
+import json
+import threading
+import time
+import unittest
+
+from max.streaming import micro_batches, parse_request, stream_responses
+
+from stubs import stub_sarcasm_generator
+
+
+EVENTS = ['Ben won the marathon', 'I ran out of coffee', 'Ben lost the race']
+
+
+def slow_lines(lines, delay):
+    for line in lines:
+        time.sleep(delay)
+        yield line
+
+
+class FailingSarcasmGenerator:
+    def generate_responses(self, event, num_responses=1):
+        raise ValueError("out of memory")
+
+    def generate_responses_batch(self, events, num_responses=1):
+        raise ValueError("out of memory")
+
+
+class TestMicroBatches(unittest.TestCase):
+    def test_full_batches(self):
+        lines = [f"{i}\n" for i in range(7)]
+        lines.insert(3, '\n')
+        self.assertListEqual(
+            list(micro_batches(lines, batch_size=3, flush_interval=10.0)),
+            [
+                [(0, '0\n'), (1, '1\n'), (2, '2\n')],
+                [(4, '3\n'), (5, '4\n'), (6, '5\n')],
+                [(7, '6\n')]
+            ]
+        )
+
+    def test_flush_interval(self):
+        lines = slow_lines([f"{i}\n" for i in range(4)], delay=0.1)
+        batches = list(micro_batches(
+            lines, batch_size=32, flush_interval=0.01
+        ))
+        # Lines arriving slowly are not held back for a full batch.
+        self.assertListEqual(
+            batches, [[(i, f"{i}\n")] for i in range(4)]
+        )
+
+
+class TestStreamResponses(unittest.TestCase):
+    def setUp(self):
+        self.sarcasm_generator = stub_sarcasm_generator()
+        self.expected = [
+            [
+                r.to_json() for r in
+                stub_sarcasm_generator().generate_responses(event)[0]
+            ]
+            for event in EVENTS
+        ]
+
+    def stream(self, lines, **kwargs):
+        out_fp = io.StringIO()
+        num_events = stream_responses(
+            self.sarcasm_generator, io.StringIO(''.join(lines)), out_fp,
+            **kwargs
+        )
+        return num_events, [
+            json.loads(line) for line in out_fp.getvalue().splitlines()
+        ]
+
+    def test_text(self):
+        for batch_size in [1, 2]:
+            num_events, records = self.stream(
+                [event + '\n' for event in EVENTS], batch_size=batch_size
+            )
+            self.assertEqual(num_events, len(EVENTS))
+            self.assertListEqual(
+                records,
+                [
+                    {"line": i, "event": event, "responses": responses}
+                    for i, (event, responses) in enumerate(
+                        zip(EVENTS, self.expected)
+                    )
+                ]
+            )
+
+    def test_jsonl(self):
+        lines = [
+            json.dumps({"id": "a", "event": EVENTS[0]}),
+            'not json',
+            json.dumps(EVENTS[1]),
+            json.dumps({"id": 3, "text": EVENTS[2]}),
+        ]
+        num_events, records = self.stream(
+            [line + '\n' for line in lines], input_format='jsonl',
+            batch_size=4
+        )
+        self.assertEqual(num_events, 2)
+        self.assertDictEqual(records[0], {
+            "line": 0, "id": "a", "event": EVENTS[0],
+            "responses": self.expected[0]
+        })
+        self.assertEqual(records[1]["line"], 1)
+        self.assertIn("Invalid json", records[1]["error"])
+        self.assertDictEqual(records[2], {
+            "line": 2, "event": EVENTS[1], "responses": self.expected[1]
+        })
+        self.assertEqual(records[3]["id"], 3)
+        self.assertIn("error", records[3])
+
+    def test_errors(self):
+        self.sarcasm_generator = FailingSarcasmGenerator()
+        with self.assertLogs('sarcasm_generator', level='ERROR'):
+            num_events, records = self.stream(
+                [event + '\n' for event in EVENTS], batch_size=2
+            )
+        # The stream goes on after a failure.
+        self.assertEqual(len(records), len(EVENTS))
+        for event, record in zip(EVENTS, records):
+            self.assertEqual(record["event"], event)
+            self.assertEqual(record["error"], "ValueError: out of memory")
+
+    def test_incremental(self):
+        written = threading.Event()
+
+        class Output(io.StringIO):
+            def flush(self):
+                written.set()
+
+        def lines():
+            yield EVENTS[0] + '\n'
+            # The responses to the first event are written before the
+            # next event is sent, as a process driving Max would expect.
+            self.assertTrue(written.wait(timeout=10))
+            yield EVENTS[1] + '\n'
+
+        out_fp = Output()
+        stream_responses(
+            self.sarcasm_generator, lines(), out_fp, batch_size=8,
+            flush_interval=0.01
+        )
+        self.assertEqual(len(out_fp.getvalue().splitlines()), 2)
+
+    def test_parse_request(self):
+        request = parse_request(4, ' Ben won the marathon \n', 'text')
+        self.assertEqual(
+            (request.line_num, request.event, request.id, request.error),
+            (4, 'Ben won the marathon', None, None)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import pathlib
+import tempfile
+import unittest
+
+import spacy
+
+from max.cache import LRUCache
+from max.commonsense_builders.retrieval_builder import (
+    EventVectorIndex, RetrievalCommonsenseBuilder
+)
+from max.warmup import WARMUP_EVENTS, warm_up
+
+from stubs import stub_sarcasm_generator
+
+
+class FakeResponseStore:
+    def __init__(self):
+        self.num_preloads = 0
+        self.num_gets = 0
+
+    def preload(self):
+        self.num_preloads += 1
+
+    def get(self, key):
+        self.num_gets += 1
+        return None
+
+
+class TestWarmUp(unittest.TestCase):
+    def test_warm_up(self):
+        response_store = FakeResponseStore()
+        sarcasm_generator = stub_sarcasm_generator(
+            response_store=response_store
+        )
+        builder = sarcasm_generator.commonsense_builder
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ready_file = pathlib.Path(tmp_dir) / 'ready.json'
+            ready_file.write_text('stale', encoding='utf-8')
+            report = warm_up(
+                sarcasm_generator, max_rounds=4, ready_file=ready_file
+            )
+            self.assertDictEqual(
+                json.loads(ready_file.read_text(encoding='utf-8')),
+                {
+                    'preload_time': report.preload_time,
+                    'round_latencies': report.round_latencies,
+                    'steady': report.steady
+                }
+            )
+
+        self.assertGreaterEqual(len(report.round_latencies), 2)
+        self.assertLessEqual(len(report.round_latencies), 4)
+        # The caches are preloaded, but the warm-up events go through the
+        # models rather than the response store.
+        self.assertEqual(response_store.num_preloads, 1)
+        self.assertEqual(response_store.num_gets, 0)
+        self.assertIs(sarcasm_generator.response_store, response_store)
+        self.assertGreaterEqual(
+            builder.num_calls, len(WARMUP_EVENTS) * len(report.round_latencies)
+        )
+
+    def test_caches_bypassed(self):
+        cache = LRUCache()
+        sarcasm_generator = stub_sarcasm_generator(cache=cache)
+        comet_builder = sarcasm_generator.commonsense_builder
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index = EventVectorIndex.load(tmp_dir)
+            retrieval_builder = RetrievalCommonsenseBuilder(
+                index, spacy.load('en_core_web_sm'), comet_builder
+            )
+            sarcasm_generator.commonsense_builder = retrieval_builder
+            warm_up(sarcasm_generator, min_rounds=1, max_rounds=1)
+            num_calls = comet_builder.num_calls
+            warm_up(sarcasm_generator, min_rounds=1, max_rounds=1)
+
+        # Every round went through the models, and left the caches and the
+        # index as they were.
+        self.assertGreater(num_calls, 0)
+        self.assertEqual(comet_builder.num_calls, 2 * num_calls)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(len(index), 0)
+        self.assertIsNotNone(comet_builder.cache)
+        self.assertIsNotNone(sarcasm_generator.response_generator.cache)
+        self.assertEqual(retrieval_builder.threshold, 0.9)
+        self.assertTrue(retrieval_builder.insert_misses)
+
+    def test_min_rounds(self):
+        report = warm_up(
+            stub_sarcasm_generator(), events=['Ben won the marathon'],
+            min_rounds=3, max_rounds=3
+        )
+        self.assertEqual(len(report.round_latencies), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
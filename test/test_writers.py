@@ -0,0 +1,66 @@
+import importlib.util
+import pathlib
+import tempfile
+import unittest
+
+from max import ExplainableSarcasticResponse, CompactSarcasticResponse
+from max.types import ResponseContext
+from max.writers import ParquetResponseWriter, read_parquet_responses
+
+
+def make_responses():
+    context = ResponseContext(
+        "Ben won the marathon", "Ben did not win the marathon"
+    )
+    return [
+        CompactSarcasticResponse(
+            context, "xNeed", "event", "train for the marathon",
+            "maxim of quality",
+            ["Brilliant! Well done not training for the marathon."]
+        ),
+        CompactSarcasticResponse(
+            context, "xAttr", "event", "athletic", "maxim of quality",
+            ["Yay! You're not very athletic, that's for sure."]
+        )
+    ]
+
+
+class TestCompactSarcasticResponse(unittest.TestCase):
+    def test_round_trip(self):
+        for response in make_responses():
+            explainable = response.to_response()
+            self.assertIsInstance(explainable, ExplainableSarcasticResponse)
+            self.assertDictEqual(explainable.to_json(), response.to_json())
+            self.assertEqual(
+                CompactSarcasticResponse.from_response(explainable), response
+            )
+
+    def test_shared_context(self):
+        r1, r2 = make_responses()
+        self.assertIs(r1.event, r2.event)
+        self.assertIs(r1.failed_expectation, r2.failed_expectation)
+
+
+@unittest.skipIf(
+    importlib.util.find_spec('pyarrow') is None, "pyarrow is not installed"
+)
+class TestParquetResponseWriter(unittest.TestCase):
+    def test_write(self):
+        # Both kinds of responses are written as the same rows.
+        responses = make_responses()
+        responses += [r.to_response() for r in responses]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file_path = pathlib.Path(tmp_dir) / 'responses.parquet'
+            with ParquetResponseWriter(
+                output_file_path, row_group_size=3
+            ) as writer:
+                for _ in range(2):
+                    writer.write(responses)
+            self.assertListEqual(
+                list(read_parquet_responses(output_file_path)),
+                [r.to_json() for r in responses] * 2
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()